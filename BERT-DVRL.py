@@ -13,6 +13,7 @@ from utils.create_embedding_feautres import load_data, normalize_scores, create_
 from utils.evaluation import train_epoch, evaluate_epoch
 from models.transfomer_enc import BERT_Regressor
 from utils.general_utils import set_seed
+from utils.metrics_sink import MetricsSink
 
 
 def main(args):
@@ -29,7 +30,9 @@ def main(args):
     MAX_LEN = args.max_length
     BATCH_SIZE = args.batch_size
 
-    wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
+    metrics_sink = MetricsSink(args.metrics_dir + args.run_name + str(test_prompt_id) + '.jsonl', use_wandb=not args.offline)
+    if not args.offline:
+        wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
     interval = 0.1
     for p in np.arange(0.0, 1.0, interval):
 
@@ -202,7 +205,7 @@ def main(args):
                     best_val_metrics_low[i] = dev_history[met]
                     best_test_metrics_low[i] = eval_history[met]
         
-        wandb.log({
+        metrics_sink.log({
             'p': p,
             'best_dev_qwk_high': best_val_metrics_high[0],
             'best_test_qwk_high': best_test_metrics_high[0],
@@ -212,7 +215,9 @@ def main(args):
             'best_dev_loss_low': best_dev_loss_low
             })
     
-    wandb.finish()
+    metrics_sink.close()
+    if not args.offline:
+        wandb.finish()
 
 
 if __name__ == '__main__':
@@ -220,6 +225,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pj_name', type=str, default='DVRL', help='wandb project name for logging')
     parser.add_argument('--run_name', type=str, default='BERT-DVRL', help='name of the experiment')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--metrics_dir', type=str, default='outputs/metrics/', help='directory of the local metrics files')
     parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
     parser.add_argument('--seed', type=int, default=12, help='set random seed')
     parser.add_argument('--device', type=str, default='cuda', help='device to run the model on')
@@ -6,6 +6,7 @@ import wandb
 from utils.general_utils import set_seed
 from utils.create_embedding_feautres import create_embedding_features
 from utils.dvrl_utils import remove_top_p_sample, fit_func, pred_func, calc_qwk, random_remove_sample, get_dev_sample
+from utils.metrics_sink import MetricsSink
 from dvrl.predictor_model import MLP
 from sklearn.metrics import mean_squared_error
 
@@ -66,7 +67,9 @@ def main(args):
     print('Y_test min: ', np.min(y_test))
     print('================================')
 
-    wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
+    metrics_sink = MetricsSink(args.metrics_dir + args.run_name + str(test_prompt_id) + '.jsonl', use_wandb=not args.offline)
+    if not args.offline:
+        wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
     interval = 0.1
     p = np.arange(0.0, 1.0, interval)
     for p_val in p:
@@ -88,7 +91,7 @@ def main(args):
         weights = np.concatenate([weights, np.array([1]*x_dev.shape[0])])
         qwk_random, _, _, dev_loss_random = train_and_evaluate(x_source, y_source, x_dev, y_dev, x_test, y_test, test_prompt_id, weights)
 
-        wandb.log({
+        metrics_sink.log({
             'p': p_val,
             'QWK[High]': qwk_high,
             'QWK[Low]': qwk_low,
@@ -98,7 +101,9 @@ def main(args):
             'Dev Loss[Random]': dev_loss_random
         })
 
-    wandb.finish()
+    metrics_sink.close()
+    if not args.offline:
+        wandb.finish()
 
 
 if __name__ == '__main__':
@@ -106,6 +111,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pj_name', type=str, default='DVRL', help='wandb project name for logging')
     parser.add_argument('--run_name', type=str, default='MLP-DVRL', help='name of the experiment')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--metrics_dir', type=str, default='outputs/metrics/', help='directory of the local metrics files')
     parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
     parser.add_argument('--seed', type=int, default=12, help='set random seed')
     parser.add_argument('--device', type=str, default='cuda', help='device to run the model on')
@@ -12,6 +12,7 @@ from utils.create_embedding_feautres import create_embedding_features
 from utils.read_data import read_essays_single_score, read_pos_vocab
 from utils.general_utils import get_single_scaled_down_score, set_seed, pad_text_sequences, flatten_hierarchical_sequences, pad_hierarchical_text_sequences
 from utils.evaluation import train_model, evaluate_model
+from utils.metrics_sink import MetricsSink
 from models.paes import tinyPAES, PAES
 
 
@@ -148,7 +149,9 @@ def main(args):
 
     data_value = np.load(data_value_path + f'estimated_data_value{test_prompt_id}.npy')
 
-    wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
+    metrics_sink = MetricsSink(args.metrics_dir + args.run_name + str(test_prompt_id) + '.jsonl', use_wandb=not args.offline)
+    if not args.offline:
+        wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
     for p in np.arange(0.0, 1.0, 0.1):
         # データの価値が低いものを削除
         set_seed(seed)
@@ -222,7 +225,7 @@ def main(args):
                 best_test_qwk_low = test_results['qwk']
                 best_dev_loss_low = dev_results['loss']
 
-        wandb.log({
+        metrics_sink.log({
             'p': p,
             'best_dev_qwk_high': best_dev_qwk_high,
             'best_test_qwk_high': best_test_qwk_high,
@@ -232,7 +235,9 @@ def main(args):
             'best_dev_loss_low': best_dev_loss_low
         })
     
-    wandb.finish()
+    metrics_sink.close()
+    if not args.offline:
+        wandb.finish()
 
 
 if __name__ == '__main__':
@@ -240,6 +245,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pj_name', type=str, default='DVRL', help='wandb project name for logging')
     parser.add_argument('--run_name', type=str, default='DVRL-PAES', help='name of the experiment')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--metrics_dir', type=str, default='outputs/metrics/', help='directory of the local metrics files')
     parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
     parser.add_argument('--seed', type=int, default=12, help='set random seed')
     parser.add_argument('--model_type', type=str, default='normal', help='type of model to train', choices=['normal', 'tiny'])
@@ -15,6 +15,7 @@ from utils.pmaes_utils import PMAESDataSet, TrainSingleOverallScoring
 from utils.general_utils import get_single_scaled_down_score, pad_hierarchical_text_sequences
 from utils.create_embedding_feautres import create_embedding_features
 from utils.dvrl_utils import get_dev_sample, remove_top_p_sample
+from utils.metrics_sink import MetricsSink
 
 
 def seed_all(seed_value):
@@ -38,6 +39,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="PAES_attributes models")
     parser.add_argument('--pj_name', type=str, default='DVRL', help='wandb project name for logging')
     parser.add_argument('--run_name', type=str, default='PMAES-DVRL-nodev', help='name of the experiment')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--metrics_dir', type=str, default='outputs/metrics/', help='directory of the local metrics files')
     parser.add_argument('--seed', type=int, default=12, help='set random seed')
     parser.add_argument('--target_id', type=int, default=1, help='set random seed')
     parser.add_argument('--attribute_name', type=str, default='score', help='set random seed')
@@ -157,7 +160,9 @@ if __name__ == '__main__':
 
     data_value = np.load(data_value_path + f'estimated_data_value{test_prompt_id}.npy')
 
-    # wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
+    metrics_sink = MetricsSink(args.metrics_dir + args.run_name + str(test_prompt_id) + '.jsonl', use_wandb=not args.offline)
+    if not args.offline:
+        wandb.init(project=args.pj_name, name=args.run_name+str(test_prompt_id), config=args)
     for p in np.arange(0.1, 1.0, 0.1):
         # データの価値が低いものを削除
         seed_all(seed)
@@ -271,7 +276,7 @@ if __name__ == '__main__':
                 best_loss_low = va_loss_low
                 best_dev_qwk_low = va_qwk_low
 
-        wandb.log({
+        metrics_sink.log({
             'p': p,
             'best_dev_qwk_high': best_dev_qwk_high,
             'best_qwk_high': best_qwk_high,
@@ -281,6 +286,8 @@ if __name__ == '__main__':
             'best_dev_loss_low': best_loss_low
         })
 
-    wandb.finish()
+    metrics_sink.close()
+    if not args.offline:
+        wandb.finish()
             
         
\ No newline at end of file
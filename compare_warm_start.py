@@ -0,0 +1,122 @@
+"""Speed versus valuation quality of warm-started DVRL inner retraining"""
+
+import os
+import time
+import torch
+import numpy as np
+import pandas as pd
+import argparse
+import torch.nn as nn
+from scipy.stats import spearmanr
+
+from dvrl import dvrl
+from utils.dvrl_utils import calc_qwk, get_dev_sample
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.output_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    x_dev, x_test, y_dev, y_test, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+    config = AutoConfig.from_pretrained(model_name)
+
+    ###################################################
+    # Step2. Train DVRL with each inner retraining start
+    ###################################################
+    results = []
+    data_values = {}
+    for warm_start in ['init', 'ori', 'ema']:
+        print(f'Warm start: {warm_start}')
+        set_seed(seed)
+        pred_model = MLP(input_feature=config.hidden_size).to(device)
+
+        dvrl_params = {}
+        dvrl_params['hidden_dim'] = 100
+        dvrl_params['comb_dim'] = 10
+        dvrl_params['iterations'] = args.iterations
+        dvrl_params['activation'] = nn.Tanh()
+        dvrl_params['layer_number'] = 5
+        dvrl_params['learning_rate'] = 0.001
+        dvrl_params['batch_size'] = 10000
+        dvrl_params['inner_iterations'] = 100
+        dvrl_params['batch_size_predictor'] = 256
+        dvrl_params['moving_average_window'] = 10
+        dvrl_params['moving_average'] = False
+        dvrl_params['std_penalty_weight'] = None
+        dvrl_params['seed'] = seed
+        dvrl_params['cache_dir'] = args.cache_dir
+        dvrl_params['use_wandb'] = False
+        dvrl_params['metrics_path'] = save_dir + f'warm_start_{warm_start}_metrics{test_prompt_id}.jsonl'
+        dvrl_params['warm_start'] = warm_start
+        dvrl_params['warm_start_epochs'] = args.warm_start_epochs
+        dvrl_params['warm_start_decay'] = args.warm_start_decay
+
+        dvrl_class = dvrl.Dvrl(x_source, y_source, x_dev, y_dev, pred_model, dvrl_params, device, test_prompt_id)
+        start = time.perf_counter()
+        dvrl_class.train_dvrl(args.metric)
+        elapsed = time.perf_counter() - start
+
+        data_value = dvrl_class.dvrl_valuator(x_source, y_source).reshape(-1)
+        data_values[warm_start] = data_value
+        y_test_hat = dvrl_class.dvrl_predict(x_test)
+        results.append({
+            'warm_start': warm_start,
+            'train_dvrl_s': elapsed,
+            'qwk': calc_qwk(y_test, y_test_hat, test_prompt_id, attribute_name)
+        })
+
+    # agreement of the valuation with the cold-start ('init') valuation
+    num_low = max(1, int(len(x_source) * args.low_value_ratio))
+    low_init = set(np.argsort(data_values['init'])[:num_low])
+    for result in results:
+        data_value = data_values[result['warm_start']]
+        result['speedup'] = results[0]['train_dvrl_s'] / result['train_dvrl_s']
+        result['spearman_vs_init'] = spearmanr(data_values['init'], data_value)[0]
+        result['low_value_overlap'] = len(low_init & set(np.argsort(data_value)[:num_low])) / num_low
+
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    results.to_csv(save_dir + f'warm_start_comparison{test_prompt_id}.csv', index=False)
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="DVRL warm start comparison")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--output_dir', type=str, default='outputs/warm_start', help='output directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--metric', type=str, default='qwk', help='metric to be used for DVRL', choices=['corr', 'mse', 'qwk'])
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--iterations', type=int, default=1000, help='outer iterations of each DVRL run')
+    parser.add_argument('--cache_dir', type=str, default='tmp/dvrl_cache', help='directory caching the trained original/validation models across runs')
+    parser.add_argument('--warm_start_epochs', type=int, default=5, help='fine-tuning epochs of a warm-started inner retraining')
+    parser.add_argument('--warm_start_decay', type=float, default=0.9, help='decay of the ema reference model')
+    parser.add_argument('--low_value_ratio', type=float, default=0.1, help='share of lowest-valued rows compared between valuations')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
@@ -0,0 +1,80 @@
+"""Data-OOB valuation with a vectorized bagging ensemble"""
+
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+
+from utils.inner_trainer import BatchedInnerTrainer
+
+
+class DataOob(object):
+    """
+    Out-of-bag data valuation (Kwon & Zou, 2023). B bootstrap copies of the
+    predictor are trained at once by BatchedInnerTrainer, with each copy's
+    bootstrap counts as its sample weights, and each source row is valued
+    by the mean negative squared error of the copies that did not draw it.
+    No dev data is needed.
+    """
+
+    def __init__(
+        self,
+        x_train: np.ndarray,
+        y_train: np.ndarray,
+        pred_model: nn.Module,
+        parameters: dict,
+        device: torch.device
+    ) -> None:
+        """
+        Args:
+            x_train: Training data
+            y_train: Training labels
+            pred_model: Prediction model (every copy starts from its weights)
+            parameters: Parameters for Data-OOB
+                num_bags, bags_per_batch, epochs, batch_size, learning_rate, seed
+            device: Device to run the model
+        """
+        self.x_train = x_train
+        self.y_train = np.asarray(y_train).reshape(-1)
+        self.pred_model = pred_model
+        self.init_state = copy.deepcopy(pred_model.state_dict())
+        self.device = device
+        self.num_bags = parameters.get('num_bags', 64)
+        # bags trained in one batched loop (bounds the memory of the stacked weights)
+        self.bags_per_batch = parameters.get('bags_per_batch', self.num_bags)
+        self.epochs = parameters.get('epochs', 100)
+        self.batch_size = parameters.get('batch_size', 256)
+        self.learning_rate = parameters.get('learning_rate', 0.001)
+        self.seed = parameters.get('seed', 0)
+
+    def values(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Data value of each source row (N, 1)
+        """
+        num_samples = len(self.y_train)
+        rng = np.random.default_rng(self.seed)
+        torch.manual_seed(self.seed)
+        y_train = torch.as_tensor(self.y_train, dtype=torch.float).to(self.device)
+        score_sum = torch.zeros(num_samples, device=self.device)
+        oob_count = torch.zeros(num_samples, device=self.device)
+
+        trainer = BatchedInnerTrainer(self.pred_model, self.init_state, self.x_train, self.y_train, self.batch_size, self.epochs, self.device, lr=self.learning_rate)
+        for start in range(0, self.num_bags, self.bags_per_batch):
+            num_bags = min(self.bags_per_batch, self.num_bags - start)
+            # bootstrap counts of each row in each bag
+            counts = np.stack([np.bincount(rng.integers(0, num_samples, num_samples), minlength=num_samples) for _ in range(num_bags)])
+            params = trainer.fit(counts)
+            y_pred = trainer.predict(params, trainer.x_train).squeeze(-1)
+
+            oob = torch.as_tensor(counts == 0, device=self.device).float()
+            score_sum += torch.sum(-(y_pred - y_train) ** 2 * oob, dim=0)
+            oob_count += oob.sum(dim=0)
+            print(f'Bags: {start + num_bags}/{self.num_bags}')
+
+        data_value = score_sum / oob_count.clamp(min=1)
+        # rows drawn by every bag (unlikely for B >= 10) get the mean value
+        never_oob = oob_count == 0
+        if torch.any(never_oob):
+            data_value[never_oob] = data_value[~never_oob].mean()
+        return data_value.cpu().numpy().reshape(-1, 1)
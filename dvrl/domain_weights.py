@@ -0,0 +1,93 @@
+"""Domain-classifier importance weights as a cheap source-essay valuation"""
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.model_selection import KFold, StratifiedKFold
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+
+def _domain_classifier(classifier: str, seed: int):
+    if classifier == 'logistic':
+        return make_pipeline(StandardScaler(), LogisticRegression(C=1.0, max_iter=1000))
+    if classifier == 'mlp':
+        return make_pipeline(StandardScaler(), MLPClassifier(hidden_layer_sizes=(128,), early_stopping=True, max_iter=200, random_state=seed))
+    raise ValueError(f'Unknown classifier: {classifier}')
+
+
+def importance_weights(
+    x_source: np.ndarray,
+    x_target: np.ndarray,
+    classifier: str = 'logistic',
+    num_folds: int = 5,
+    seed: int = 0,
+    clip: float = 20.0
+) -> np.ndarray:
+    """
+    Estimate the density ratio p_target(x) / p_source(x) of each source
+    essay with a source-vs-target classifier. Every source essay is scored
+    by a classifier that was not trained on it (k-fold cross-fitting), so
+    the weights are not inflated by memorization.
+        w(x) = P(target | x) / P(source | x) * n_source / n_target
+    Args:
+        x_source: Source embeddings (N, D)
+        x_target: Target embeddings (M, D), no labels needed
+        classifier: 'logistic' or 'mlp'
+        num_folds: Number of cross-fitting folds
+        seed: Random seed of the folds and the classifier
+        clip: Upper bound of the weights
+    Returns:
+        np.ndarray: Importance weight of each source essay (N,)
+    """
+    x = np.concatenate([x_source, x_target])
+    domain = np.concatenate([np.zeros(len(x_source)), np.ones(len(x_target))])
+    prob_target = np.zeros(len(x_source))
+    for train_idx, test_idx in StratifiedKFold(num_folds, shuffle=True, random_state=seed).split(x, domain):
+        model = _domain_classifier(classifier, seed).fit(x[train_idx], domain[train_idx])
+        source_idx = test_idx[test_idx < len(x_source)]
+        prob_target[source_idx] = model.predict_proba(x[source_idx])[:, 1]
+
+    prob_target = np.clip(prob_target, 1e-6, 1 - 1e-6)
+    weights = prob_target / (1 - prob_target) * len(x_source) / len(x_target)
+    return np.clip(weights, 0.0, clip)
+
+
+def label_residuals(x_source: np.ndarray, y_source: np.ndarray, num_folds: int = 5, seed: int = 0, alpha: float = 1.0) -> np.ndarray:
+    """
+    Cross-fitted absolute residual of a ridge regression of the label on
+    the embedding, as a label-noise indicator.
+    Args:
+        x_source: Source embeddings (N, D)
+        y_source: Source labels (N,)
+        num_folds: Number of cross-fitting folds
+        seed: Random seed of the folds
+        alpha: L2 strength of the ridge
+    Returns:
+        np.ndarray: Absolute out-of-fold residual of each source essay (N,)
+    """
+    y_source = np.asarray(y_source).reshape(-1)
+    residuals = np.zeros(len(y_source))
+    for train_idx, test_idx in KFold(num_folds, shuffle=True, random_state=seed).split(x_source):
+        model = Ridge(alpha=alpha).fit(x_source[train_idx], y_source[train_idx])
+        residuals[test_idx] = np.abs(y_source[test_idx] - model.predict(x_source[test_idx]))
+    return residuals
+
+
+def combined_score(weights: np.ndarray, residuals: np.ndarray, noise_weight: float = 1.0) -> np.ndarray:
+    """
+    Combine the shift and the label-noise evidence into one data value:
+    the standardized log importance weight minus noise_weight times the
+    standardized residual, so essays close to the target prompt with
+    labels consistent with similar essays rank highest.
+    Args:
+        weights: Importance weights (N,)
+        residuals: Label residuals (N,)
+        noise_weight: Weight of the label-noise term
+    Returns:
+        np.ndarray: Data value of each source essay (N, 1)
+    """
+    def standardize(values):
+        return (values - values.mean()) / (values.std() + 1e-12)
+    score = standardize(np.log(weights + 1e-12)) - noise_weight * standardize(residuals)
+    return score.reshape(-1, 1)
@@ -1,4 +1,3 @@
-
 """DVRL class for data valuation using reinforcement learning"""
 
 import copy
@@ -8,11 +7,15 @@ from tqdm import tqdm
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from sklearn import metrics
-import wandb
 
+from dvrl.dvrl_base import DvrlBase
 from dvrl.dvrl_loss import DvrlLoss
-from utils.dvrl_utils import fit_func, pred_func, calc_qwk
+from dvrl.ridge import WeightedRidge
+from dvrl.rollout_pool import RolloutPool
+from utils.dvrl_utils import fit_func, pred_func, QWKKernel, batched_performance, save_checkpoint, load_checkpoint, hash_contents, RankingConvergence, value_in_chunks, value_array
+from utils.inner_trainer import InnerTrainer, BatchedInnerTrainer
+from utils.profiler import StageTimer
+from utils.metrics_sink import MetricsSink
 
 
 class DataValueEstimator(nn.Module):
@@ -87,7 +90,7 @@ class DataValueEstimator(nn.Module):
 
 
 
-class Dvrl(object):
+class Dvrl(DvrlBase):
 
     def __init__(
         self,
@@ -131,6 +134,44 @@ class Dvrl(object):
         self.batch_size_predictor = int(np.min([parameters['batch_size_predictor'], self.x_dev.shape[0]]))
         self.moving_average_window = parameters['moving_average_window']
         self.moving_average = parameters['moving_average']
+        # Number of selection masks drawn per outer iteration (RLOO baseline when > 1)
+        self.num_rollouts = parameters.get('num_rollouts', 1)
+        # Inner learner retrained on each selection: 'mlp' (pred_model) or 'ridge' (closed form)
+        self.inner_learner = parameters.get('inner_learner', 'mlp')
+        self.ridge_alpha = parameters.get('ridge_alpha', 1.0)
+        # CPU worker processes for asynchronous rollouts (0 runs them in this process)
+        self.num_workers = parameters.get('num_workers', 0)
+        self.seed = parameters.get('seed', 0)
+        # Periodic checkpoint of the outer loop (None disables checkpointing)
+        self.checkpoint_path = parameters.get('checkpoint_path', None)
+        self.checkpoint_interval = parameters.get('checkpoint_interval', 50)
+        # Directory of the cached baseline/validation models (None disables the cache)
+        self.cache_dir = parameters.get('cache_dir', None)
+        # Per-stage timing of the outer loop (dumped to profile_path as JSON or CSV)
+        self.timer = StageTimer(parameters.get('profile', False), parameters.get('profile_capacity', 1000), sync_cuda=torch.device(device).type == 'cuda')
+        self.profile_path = parameters.get('profile_path', None)
+        # Per-iteration metrics: local JSONL/SQLite file and/or the wandb run the caller initialized
+        self.metrics_path = parameters.get('metrics_path', None)
+        self.use_wandb = parameters.get('use_wandb', False)
+        # Stop once the data value ranking is stable between snapshots (interval 0 disables the check)
+        self.convergence_interval = parameters.get('convergence_interval', 0)
+        self.convergence_method = parameters.get('convergence_method', 'spearman')
+        self.convergence_tol = parameters.get('convergence_tol', 0.99)
+        self.convergence_patience = parameters.get('convergence_patience', 3)
+        # Start of each inner retraining: 'init' (initial weights, inner_iterations epochs),
+        # 'ori' (original model) or 'ema' (EMA of the recent inner models) fine-tuned for warm_start_epochs
+        self.warm_start = parameters.get('warm_start', 'init')
+        self.warm_start_epochs = parameters.get('warm_start_epochs', 5)
+        self.warm_start_decay = parameters.get('warm_start_decay', 0.9)
+        # Schedule of the K rollouts: 'full' (every mask gets the full inner budget) or
+        # 'halving' (successive halving: keep the best 1/halving_eta masks at each of halving_rungs rungs)
+        self.rollout_scheduler = parameters.get('rollout_scheduler', 'full')
+        self.halving_eta = parameters.get('halving_eta', 2)
+        self.halving_rungs = parameters.get('halving_rungs', 3)
+        # Large-source scaling: each inner fit trains on at most inner_sample_size of the
+        # selected batch rows (None trains on all of them), and the source is valued in chunks
+        self.inner_sample_size = parameters.get('inner_sample_size', None)
+        self.valuation_chunk_size = parameters.get('valuation_chunk_size', 10000)
 
         # Basic parameters
         self.epsilon = 1e-8  # Adds to the log to avoid overflow
@@ -142,157 +183,527 @@ class Dvrl(object):
         self.pred_model = pred_model
         self.final_model = pred_model
 
-        # save initial model
-        print('Saving the initial model...')
-        os.makedirs('tmp', exist_ok=True)
-        torch.save(self.pred_model.state_dict(), 'tmp/init_model.pth')
+        # keep the initial weights in memory for the weight resets
+        self.init_state = copy.deepcopy(self.pred_model.state_dict())
 
-        # train baseline model
+        # train baseline model and validation model (or load them from the setup cache)
         self.ori_model = copy.deepcopy(self.pred_model)
-        self.ori_model.load_state_dict(torch.load('tmp/init_model.pth'))
-        print('Training the original model...')
-        fit_func(self.ori_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device)
-
         self.val_model = copy.deepcopy(self.pred_model)
-        self.val_model.load_state_dict(torch.load('tmp/init_model.pth'))
-        print('Training the validation model...')
-        fit_func(self.val_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.inner_iterations, self.device)
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_key = hash_contents(self.x_train, self.y_train, self.x_dev, self.y_dev, repr(self.pred_model), self.init_state, self.inner_iterations, self.batch_size_predictor)
+            cache_path = os.path.join(self.cache_dir, f'dvrl_setup_{cache_key}.pth')
+
+        # on resume the set-up models come from the checkpoint instead of being retrained
+        self.resume_checkpoint = None
+        if parameters.get('resume', False) and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            self.resume_checkpoint = load_checkpoint(self.checkpoint_path)
+
+        if self.resume_checkpoint is not None and 'y_valid_hat_ori' in self.resume_checkpoint:
+            print(f'Loading the original and validation models from {self.checkpoint_path}...')
+            checkpoint = self.resume_checkpoint
+            self.init_state = checkpoint['init_state']
+            self.ori_model.load_state_dict(checkpoint['ori_model'])
+            self.val_model.load_state_dict(checkpoint['val_model'])
+            self.y_valid_hat_ori = checkpoint['y_valid_hat_ori']
+            y_pred_diff = checkpoint['y_pred_diff']
+        elif cache_path is not None and os.path.exists(cache_path):
+            print(f'Loading the original and validation models from {cache_path}...')
+            cache = load_checkpoint(cache_path)
+            self.ori_model.load_state_dict(cache['ori_model'])
+            self.val_model.load_state_dict(cache['val_model'])
+            self.y_valid_hat_ori = cache['y_valid_hat_ori']
+            y_pred_diff = cache['y_pred_diff']
+        else:
+            self.ori_model.load_state_dict(self.init_state)
+            print('Training the original model...')
+            fit_func(self.ori_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device)
+
+            self.val_model.load_state_dict(self.init_state)
+            print('Training the validation model...')
+            fit_func(self.val_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.inner_iterations, self.device)
+
+            # predictions of the original model and prediction differences
+            self.y_valid_hat_ori = pred_func(self.ori_model, self.x_dev, self.batch_size_predictor, self.device)
+            y_train_valid_pred = pred_func(self.val_model, self.x_train, self.batch_size_predictor, self.device)
+            y_pred_diff = np.abs(self.y_train - y_train_valid_pred)
+            if cache_path is not None:
+                save_checkpoint({
+                    'ori_model': self.ori_model.state_dict(),
+                    'val_model': self.val_model.state_dict(),
+                    'y_valid_hat_ori': self.y_valid_hat_ori,
+                    'y_pred_diff': y_pred_diff
+                }, cache_path)
+        self.y_pred_diff_tensor = torch.as_tensor(y_pred_diff, dtype=torch.float).to(self.device)
+
+        # keep the source and dev data on the device for the inner loop
+        self.trainer = InnerTrainer(self.pred_model, self.x_train, self.y_train, 512, self.inner_iterations, self.device, x_dev=self.x_dev, pred_batch_size=self.batch_size_predictor)
+        self.x_train_tensor = self.trainer.x_train[0]
+        self.y_train_tensor = self.trainer.y_train.view(-1, 1)
+        self.qwk_kernel = QWKKernel(self.y_dev, self.test_prompt_id, 'score', self.device)
+        self.y_dev_tensor = torch.tensor(self.y_dev, dtype=self.qwk_kernel.dtype).to(self.device)
+        if self.inner_learner == 'ridge':
+            self.ridge = WeightedRidge(self.x_train_tensor, self.y_train_tensor, self.ridge_alpha)
+        elif self.inner_learner != 'mlp':
+            raise ValueError('Inner learner not supported')
+        if self.num_workers > 0 and (self.inner_learner != 'mlp' or self.num_rollouts > 1):
+            raise ValueError('The rollout pool only supports single-mask mlp rollouts')
+        if self.warm_start not in ('init', 'ori', 'ema'):
+            raise ValueError('Warm start not supported')
+        if self.num_workers > 0 and self.warm_start == 'ema':
+            raise ValueError('The rollout pool does not support the ema warm start')
+        if self.rollout_scheduler not in ('full', 'halving'):
+            raise ValueError('Rollout scheduler not supported')
+        if self.rollout_scheduler == 'halving' and (self.inner_learner != 'mlp' or self.num_rollouts < 2 or self.num_workers > 0):
+            raise ValueError('Successive halving needs num_rollouts > 1 in-process mlp rollouts')
 
 
     def train_dvrl(
         self,
-        metric: str
+        metric: str,
+        resume: bool = False
     ) -> None:
         """
         Train the DVRL model
         Args:
             metric: Metric to use for the DVRL
                 mse or qwk or corr
+            resume: Resume from the checkpoint if it exists (implied by the 'resume' parameter,
+                which also restores the original/validation models in the constructor)
         """
         # selection network
         self.value_estimator = DataValueEstimator(self.data_dim+self.label_dim, self.hidden_dim, self.comb_dim, self.layer_number, self.act_fn)
         self.value_estimator = self.value_estimator.to(self.device)
-        dvrl_criterion = DvrlLoss(self.epsilon, self.threshold, self.std_penalty_weight).to(self.device)
-        dvrl_optimizer = optim.Adam(self.value_estimator.parameters(), lr=self.learning_rate)
+        self.dvrl_criterion = DvrlLoss(self.epsilon, self.threshold, self.std_penalty_weight).to(self.device)
+        self.dvrl_optimizer = optim.Adam(self.value_estimator.parameters(), lr=self.learning_rate)
 
-        # baseline performance
-        y_valid_hat = pred_func(self.ori_model, self.x_dev, self.batch_size_predictor, self.device)
-        if metric == 'mse':
-            valid_perf = metrics.mean_squared_error(self.y_dev, y_valid_hat)
-            print(f'Origin model Performance MSE: {valid_perf: .3f}')
-        elif metric == 'qwk':
-            valid_perf = calc_qwk(self.y_dev, y_valid_hat, self.test_prompt_id, 'score')
-            print(f'Origin model Performance QWK: {valid_perf: .3f}')
-        elif metric == 'corr':
-            valid_perf = np.corrcoef(self.y_dev.flatten(), np.array(y_valid_hat).flatten())[0, 1]
-            print(f'Origin model Performance Corr: {valid_perf: .3f}')
-        else:
-            raise ValueError('Metric not supported')
+        self.metrics_sink = MetricsSink(self.metrics_path, self.use_wandb, echo=True)
 
-        # Prediction differences
-        y_train_valid_pred = pred_func(self.val_model, self.x_train, self.batch_size_predictor, self.device)
-        y_pred_diff = np.abs(self.y_train - y_train_valid_pred)
+        self.convergence = RankingConvergence(self.convergence_method, self.convergence_tol, self.convergence_patience)
 
-        if self.moving_average:
-            baseline = 0
-        else:
-            baseline = valid_perf
-        
-        for iter in tqdm(range(self.outter_iterations)):
-            self.value_estimator.train()
-            dvrl_optimizer.zero_grad()
-
-            # Batch selection
-            batch_idx = np.random.permutation(self.x_train.shape[0])[:self.batch_size]
-
-            x_batch = torch.tensor(self.x_train[batch_idx], dtype=torch.float).to(self.device)
-            y_batch = torch.tensor(self.y_train[batch_idx], dtype=torch.float).to(self.device)
-            y_hat_batch = torch.tensor(y_pred_diff[batch_idx], dtype=torch.float).to(self.device)
-
-            # Generates the selection probability
-            est_dv_curr = self.value_estimator(x_batch, y_batch, y_hat_batch).squeeze()
-
-            # Samples the selection probability
-            sel_prob_curr = np.random.binomial(1, est_dv_curr.detach().cpu().numpy(), est_dv_curr.shape)
-            # Exception (When selection probability is 0)
-            if np.sum(sel_prob_curr) == 0:
-                print('All zero selection probability')
-                est_dv_curr = 0.5 * np.ones(np.shape(est_dv_curr))
-                sel_prob_curr = np.random.binomial(1, est_dv_curr, est_dv_curr.shape)
-
-            new_model = self.pred_model
-            new_model.load_state_dict(torch.load('tmp/init_model.pth'))
-            fit_func(new_model, x_batch, y_batch, 512, self.inner_iterations, self.device, sel_prob_curr)
-            y_valid_hat = pred_func(new_model, self.x_dev, self.batch_size_predictor, self.device)
-
-            # reward computation
-            if metric == 'mse':
-                dvrl_perf = metrics.mean_squared_error(self.y_dev, y_valid_hat)
-                reward = baseline - dvrl_perf
-            elif metric == 'qwk':
-                dvrl_perf = calc_qwk(self.y_dev, y_valid_hat, self.test_prompt_id, 'score')
-                reward = dvrl_perf - baseline
-            elif metric == 'corr':
-                dvrl_perf = np.corrcoef(self.y_dev.flatten(), np.array(y_valid_hat).flatten())[0, 1]
-                reward = dvrl_perf - baseline
-
-            # update the selection network
-            reward = torch.tensor([reward]).to(self.device)
-            sel_prob_curr = torch.tensor(sel_prob_curr, dtype=torch.float).to(self.device)
-            loss = dvrl_criterion(est_dv_curr, sel_prob_curr, reward)
-            loss.backward()
-            dvrl_optimizer.step()
-
-            # update the baseline
-            if self.moving_average:
-                baseline = ((self.moving_average_window - 1) / self.moving_average_window) * baseline + (dvrl_perf / self.moving_average_window)
+        checkpoint = self._take_checkpoint(resume)
 
-            if metric == 'mse':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, MSE: {dvrl_perf:.3f}')
-            elif metric == 'qwk':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, QWK: {dvrl_perf:.3f}')
-            elif metric == 'corr':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, Corr: {dvrl_perf:.3f}')
+        if checkpoint is None:
+            # baseline performance
+            if self.inner_learner == 'ridge':
+                self.ridge.fit()
+                y_valid_hat = self.ridge.predict(self.trainer.x_dev[0])
+            else:
+                y_valid_hat = self.y_valid_hat_ori
+            valid_perf = self._performance(y_valid_hat, metric)
+            print(f'Origin model Performance {metric.upper()}: {valid_perf: .3f}')
 
-            wandb.log({
-                'Reward': reward.item(),
-                'DVRL Loss': loss.item(),
-                'Prob MAX': torch.max(est_dv_curr).item(),
-                'Prob MIN': torch.min(est_dv_curr).item(),
-                metric: dvrl_perf
-                })
+            if self.moving_average:
+                baseline = 0
+            else:
+                baseline = valid_perf
 
+            self.reference_state = copy.deepcopy(self.ori_model.state_dict())
+            start_iter = 0
+        else:
+            baseline, start_iter = self._restore(checkpoint)
+
+        init_state = self.init_state
+        # the inner retraining starts from the initial weights or warm starts from the reference model
+        if self.warm_start == 'init':
+            rollout_state, rollout_epochs = init_state, self.inner_iterations
+        else:
+            rollout_state, rollout_epochs = self.reference_state, self.warm_start_epochs
+        if self.num_workers > 0:
+            self._train_dvrl_async(metric, baseline, rollout_state, rollout_epochs, start_iter)
+        else:
+            timer = self.timer
+            for iter in tqdm(range(start_iter, self.outter_iterations), initial=start_iter, total=self.outter_iterations):
+                self.value_estimator.train()
+                self.dvrl_optimizer.zero_grad()
+
+                with timer.stage('select'):
+                    # Batch selection
+                    batch_idx = self._sample_batch()
+
+                    # Generates the selection probability
+                    est_dv_curr = self._estimate(batch_idx)
+
+                    if self.num_rollouts > 1:
+                        est_dv_np = est_dv_curr.detach().cpu().numpy()
+                        sel_prob_curr = np.random.binomial(1, est_dv_np, (self.num_rollouts,) + est_dv_np.shape)
+                        # Exception (When selection probability is 0)
+                        for k in np.where(np.sum(sel_prob_curr, axis=1) == 0)[0]:
+                            print('All zero selection probability')
+                            sel_prob_curr[k] = np.random.binomial(1, 0.5, est_dv_np.shape)
+                    else:
+                        # Samples the selection probability
+                        sel_prob_curr = np.random.binomial(1, est_dv_curr.detach().cpu().numpy(), est_dv_curr.shape)
+                        # Exception (When selection probability is 0)
+                        if np.sum(sel_prob_curr) == 0:
+                            print('All zero selection probability')
+                            est_dv_curr = 0.5 * np.ones(np.shape(est_dv_curr))
+                            sel_prob_curr = np.random.binomial(1, est_dv_curr, est_dv_curr.shape)
+
+                if self.num_rollouts > 1:
+                    sign = -1 if metric == 'mse' else 1
+                    if self.rollout_scheduler == 'halving':
+                        advantages, dvrl_perf = self._halving_rollouts(self._cap_selection(sel_prob_curr), batch_idx, rollout_state, rollout_epochs, metric)
+                        # the first-rung models get a fraction of the budget, so their performance
+                        # is not a reward against the full-budget baseline and is logged on its own
+                        reward = None
+                    else:
+                        y_valid_hats = self._rollouts(self._cap_selection(sel_prob_curr), batch_idx, rollout_state, rollout_epochs)
+                        with timer.stage('reward'):
+                            dvrl_perfs = self._performances(y_valid_hats, metric)
+                            dvrl_perf = np.mean(dvrl_perfs)
+
+                            # leave-one-out (RLOO) baseline over the K rollouts
+                            advantages = sign * (dvrl_perfs - (np.sum(dvrl_perfs) - dvrl_perfs) / (self.num_rollouts - 1))
+                        reward = torch.tensor([sign * (dvrl_perf - baseline)]).to(self.device)
+
+                    # update the selection network
+                    with timer.stage('update'):
+                        sel_prob_curr = torch.tensor(sel_prob_curr, dtype=torch.float).to(self.device)
+                        advantages = torch.tensor(advantages, dtype=torch.float).to(self.device)
+                        loss = sum(self.dvrl_criterion(est_dv_curr, sel_prob_curr[k], advantages[k:k+1]) for k in range(self.num_rollouts)) / self.num_rollouts
+                        loss.backward()
+                        self.dvrl_optimizer.step()
+                else:
+                    y_valid_hat = self._rollouts(self._cap_selection(sel_prob_curr[np.newaxis]), batch_idx, rollout_state, rollout_epochs)[0]
+                    with timer.stage('reward'):
+                        dvrl_perf = self._performance(y_valid_hat, metric)
+                    with timer.stage('update'):
+                        reward, loss = self._reinforce(est_dv_curr, sel_prob_curr, dvrl_perf, baseline, metric)
+
+                # update the baseline
+                if self.moving_average:
+                    baseline = ((self.moving_average_window - 1) / self.moving_average_window) * baseline + (dvrl_perf / self.moving_average_window)
+
+                with timer.stage('log'):
+                    self._log_iteration(iter, reward, loss, est_dv_curr, dvrl_perf, metric)
+                with timer.stage('convergence'):
+                    converged = self._converged(iter + 1)
+                with timer.stage('checkpoint'):
+                    self._maybe_checkpoint(iter + 1, baseline, force=converged)
+                timer.step()
+                if converged:
+                    break
+
+        self.metrics_sink.close()
+        self._dump_profile()
 
         # Training the final model
-        x_train = torch.tensor(self.x_train, dtype=torch.float).to(self.device)
-        y_train = torch.tensor(self.y_train, dtype=torch.float).to(self.device)
-        y_pred_diff = torch.tensor(y_pred_diff, dtype=torch.float).to(self.device)
-        final_data_value = self.value_estimator(x_train, y_train, y_pred_diff).squeeze()
-        self.final_model.load_state_dict(torch.load('tmp/init_model.pth'))
+        final_data_value = self._value_source()
+        self.final_model.load_state_dict(init_state)
         fit_func(self.final_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device, final_data_value)
 
 
-    def dvrl_valuator(self, x_train: np.ndarray, y_train: np.ndarray) -> np.ndarray:
+    def _train_dvrl_async(self, metric: str, baseline: float, init_state: dict, epochs: int, start_iter: int = 0) -> None:
+        """
+        Outer loop with rollouts running asynchronously in a CPU process pool.
+        The estimator is updated as soon as each reward arrives, with the
+        selection probability recomputed under its current weights.
+        Checkpoints count completed updates; rollouts in flight at the time
+        of a checkpoint are redrawn on resume.
+        Args:
+            metric: Metric to use for the DVRL
+            baseline: Initial reward baseline
+            init_state: Start weights of the inner retraining
+            epochs: Number of epochs of the inner retraining
+            start_iter: Number of updates already done
+        """
+        pool = RolloutPool(self.pred_model, init_state, self.x_train, self.y_train, self.x_dev, 512, epochs, self.num_workers, self.seed)
+        submitted = {}
+        finished = []
+        num_submitted = start_iter
+        progress_bar = tqdm(initial=start_iter, total=self.outter_iterations)
+        timer = self.timer
+        try:
+            for iter in range(start_iter, self.outter_iterations):
+                # keep every worker busy with masks drawn from the latest estimator
+                with timer.stage('submit'):
+                    while num_submitted < self.outter_iterations and pool.num_pending() < self.num_workers:
+                        batch_idx = self._sample_batch()
+                        with torch.no_grad():
+                            est_dv_curr = self._estimate(batch_idx).cpu().numpy()
+                        sel_prob_curr = np.random.binomial(1, est_dv_curr, est_dv_curr.shape)
+                        if np.sum(sel_prob_curr) == 0:
+                            print('All zero selection probability')
+                            sel_prob_curr = np.random.binomial(1, 0.5, est_dv_curr.shape)
+                        batch_idx = batch_idx.cpu().numpy()
+                        submitted[num_submitted] = (batch_idx, sel_prob_curr)
+                        pool.submit(num_submitted, batch_idx, self._cap_selection(sel_prob_curr[np.newaxis])[0])
+                        num_submitted += 1
+
+                with timer.stage('wait'):
+                    if not finished:
+                        finished.extend(pool.wait_any())
+                task_id, y_valid_hat = finished.pop(0)
+                batch_idx, sel_prob_curr = submitted.pop(task_id)
+
+                self.value_estimator.train()
+                self.dvrl_optimizer.zero_grad()
+                with timer.stage('reward'):
+                    dvrl_perf = self._performance(y_valid_hat, metric)
+                with timer.stage('update'):
+                    est_dv_curr = self._estimate(torch.tensor(batch_idx, dtype=torch.long).to(self.device))
+                    reward, loss = self._reinforce(est_dv_curr, sel_prob_curr, dvrl_perf, baseline, metric)
+
+                if self.moving_average:
+                    baseline = ((self.moving_average_window - 1) / self.moving_average_window) * baseline + (dvrl_perf / self.moving_average_window)
+
+                with timer.stage('log'):
+                    self._log_iteration(iter, reward, loss, est_dv_curr, dvrl_perf, metric)
+                with timer.stage('convergence'):
+                    converged = self._converged(iter + 1)
+                with timer.stage('checkpoint'):
+                    self._maybe_checkpoint(iter + 1, baseline, force=converged)
+                timer.step()
+                progress_bar.update(1)
+                if converged:
+                    break
+        finally:
+            progress_bar.close()
+            pool.close()
+
+
+    def _sample_batch(self) -> torch.Tensor:
+        num_samples = self.x_train.shape[0]
+        if 4 * self.batch_size > num_samples:
+            batch_idx = np.random.permutation(num_samples)[:self.batch_size]
+        else:
+            # large source: draw with replacement and drop repeats instead of permuting
+            # every row, so the cost grows with the batch and not with the source
+            batch_idx = np.empty(0, dtype=np.int64)
+            while len(batch_idx) < self.batch_size:
+                draws = np.concatenate([batch_idx, np.random.randint(0, num_samples, 2 * self.batch_size)])
+                _, first = np.unique(draws, return_index=True)
+                batch_idx = draws[np.sort(first)]
+            batch_idx = batch_idx[:self.batch_size]
+        return torch.tensor(batch_idx, dtype=torch.long).to(self.device)
+
+
+    def _cap_selection(self, sel_prob_curr: np.ndarray) -> np.ndarray:
+        """
+        Limit each selection mask to inner_sample_size rows for the inner fit,
+        dropping a uniform random subset of the surplus selected rows. The
+        estimator is still updated with the full masks: the subsample is
+        drawn independently of the estimator, so the REINFORCE gradient stays
+        unbiased and only its variance grows.
+        Args:
+            sel_prob_curr: Selection masks over the batch (K, batch_size)
+        Returns:
+            np.ndarray: Masks used by the inner fit (K, batch_size)
+        """
+        if self.inner_sample_size is None:
+            return sel_prob_curr
+        fit_mask = np.array(sel_prob_curr, copy=True)
+        for k in range(len(fit_mask)):
+            selected = np.flatnonzero(fit_mask[k])
+            if len(selected) > self.inner_sample_size:
+                fit_mask[k, np.random.choice(selected, len(selected) - self.inner_sample_size, replace=False)] = 0
+        return fit_mask
+
+
+    def _value_source(self) -> torch.Tensor:
+        """
+        Value every source row, streaming over the source in chunks of
+        valuation_chunk_size rows without building the autograd graph.
+        Returns:
+            torch.Tensor: Data value of each source row (N,)
+        """
+        return value_in_chunks(self.value_estimator, self.x_train_tensor, self.y_train_tensor, self.y_pred_diff_tensor, self.valuation_chunk_size)
+
+
+    def _estimate(self, batch_idx: torch.Tensor) -> torch.Tensor:
+        x_batch = self.x_train_tensor[batch_idx]
+        y_batch = self.y_train_tensor[batch_idx]
+        y_hat_batch = self.y_pred_diff_tensor[batch_idx]
+        return self.value_estimator(x_batch, y_batch, y_hat_batch).squeeze()
+
+
+    def _reinforce(self, est_dv_curr: torch.Tensor, sel_prob_curr: np.ndarray, dvrl_perf: float, baseline: float, metric: str) -> tuple:
+        """
+        Update the selection network with one rollout.
+        Args:
+            est_dv_curr: Selection probability of the batch
+            sel_prob_curr: Selection mask of the rollout
+            dvrl_perf: Performance of the rollout
+            baseline: Reward baseline
+            metric: Metric to use
+        Returns:
+            tuple: Reward and DVRL loss
+        """
+        # reward computation
+        if metric == 'mse':
+            reward = baseline - dvrl_perf
+        else:
+            reward = dvrl_perf - baseline
+
+        # update the selection network
+        reward = torch.tensor([reward]).to(self.device)
+        sel_prob_curr = torch.tensor(sel_prob_curr, dtype=torch.float).to(self.device)
+        loss = self.dvrl_criterion(est_dv_curr, sel_prob_curr, reward)
+        loss.backward()
+        self.dvrl_optimizer.step()
+        return reward, loss
+
+
+    def _rollouts(self, sel_prob_curr: np.ndarray, batch_idx: torch.Tensor, init_state: dict, epochs: int) -> torch.Tensor:
         """
-        Estimate the given data value.
+        Retrain the inner learner on each selection mask and predict the validation data.
+        Args:
+            sel_prob_curr: Selection masks over the batch (K, batch_size)
+            batch_idx: Indices of the batch rows in the training data
+            init_state: Start weights of the predictor
+            epochs: Number of epochs of the inner retraining
+        Returns:
+            torch.Tensor: Predicted validation labels (K, N_dev, 1)
+        """
+        x_dev = self.trainer.x_dev[0]
+        timer = self.timer
+        if self.inner_learner == 'ridge':
+            y_valid_hats = []
+            for sel in sel_prob_curr:
+                with timer.stage('fit'):
+                    self.ridge.fit(sel, idx=batch_idx)
+                with timer.stage('predict'):
+                    y_valid_hats.append(self.ridge.predict(x_dev))
+            return torch.stack(y_valid_hats)
+
+        if len(sel_prob_curr) == 1:
+            with timer.stage('reset'):
+                self.trainer.reset(init_state)
+            with timer.stage('fit'):
+                self.trainer.fit(sel_prob_curr[0], idx=batch_idx, epochs=epochs)
+                self._update_reference(self.trainer.model.state_dict())
+            with timer.stage('predict'):
+                return self.trainer.predict().unsqueeze(0)
+
+        with timer.stage('fit'):
+            batched_trainer = BatchedInnerTrainer(self.pred_model, init_state, self.x_train_tensor[batch_idx], self.y_train_tensor[batch_idx], 512, epochs, self.device)
+            params = batched_trainer.fit(sel_prob_curr)
+            self._update_reference({name: value.mean(dim=0) for name, value in params.items()})
+        with timer.stage('predict'):
+            return batched_trainer.predict(params, x_dev)
+
+
+    def _halving_rollouts(self, sel_prob_curr: np.ndarray, batch_idx: torch.Tensor, init_state: dict, epochs: int, metric: str) -> tuple:
+        """
+        Train the K selection masks with successive halving: all masks get
+        the first rung's epochs, and after each rung only the best
+        1/halving_eta continue, until the survivors reach the full budget.
+        Rewards of different rungs are not comparable (fewer epochs give
+        worse predictors), so each mask is only compared with the masks
+        evaluated at the same rung: its advantage is the sum over the rungs
+        it reached of its reward minus the leave-one-out mean of that rung.
+        The reported performance is the first-rung mean over all K masks
+        (the later rungs only contain the best masks). It is trained for a
+        fraction of the budget, so it is logged on its own and not as a
+        reward against the full-budget baseline.
+        The EMA reference of the warm start follows the mean weights of the
+        masks trained to the full budget.
+        Args:
+            sel_prob_curr: Selection masks over the batch (K, batch_size)
+            batch_idx: Indices of the batch rows in the training data
+            init_state: Start weights of the predictor
+            epochs: Full number of epochs of the inner retraining
+            metric: Metric to use
+        Returns:
+            tuple: Advantage of each mask (K,) and mean performance of all masks at the first rung
+        """
+        timer = self.timer
+        x_dev = self.trainer.x_dev[0]
+        sign = -1 if metric == 'mse' else 1
+        rungs = [max(1, int(round(epochs / self.halving_eta ** (self.halving_rungs - 1 - rung)))) for rung in range(self.halving_rungs)]
+
+        batched_trainer = BatchedInnerTrainer(self.pred_model, init_state, self.x_train_tensor[batch_idx], self.y_train_tensor[batch_idx], 512, epochs, self.device)
+        batched_trainer.start(sel_prob_curr)
+        alive = np.arange(len(sel_prob_curr))
+        advantages = np.zeros(len(sel_prob_curr))
+        done_epochs = 0
+        for rung, rung_epochs in enumerate(rungs):
+            with timer.stage('fit'):
+                batched_trainer.advance(rung_epochs - done_epochs)
+                done_epochs = rung_epochs
+            with timer.stage('predict'):
+                y_valid_hats = batched_trainer.predict(batched_trainer.current_params(), x_dev)
+            with timer.stage('reward'):
+                dvrl_perfs = self._performances(y_valid_hats, metric)
+                if rung == 0:
+                    dvrl_perf = float(np.mean(dvrl_perfs))
+                scores = sign * dvrl_perfs
+                if len(alive) > 1:
+                    advantages[alive] += scores - (np.sum(scores) - scores) / (len(alive) - 1)
+            if rung == len(rungs) - 1:
+                self._update_reference({name: value.mean(dim=0) for name, value in batched_trainer.current_params().items()})
+                break
+            # promote the best masks to the next rung
+            keep = np.argsort(-scores)[:max(1, int(np.ceil(len(alive) / self.halving_eta)))]
+            batched_trainer.keep(keep)
+            alive = alive[keep]
+
+        return advantages / len(rungs), dvrl_perf
+
+
+    def _performance(self, y_valid_hat: list | torch.Tensor, metric: str) -> float:
+        """
+        Evaluate the predictions on the validation data.
+        Args:
+            y_valid_hat: Predicted validation labels
+            metric: Metric to use
+                mse or qwk or corr
+        Returns:
+            float: Performance
+        """
+        return self._performances(y_valid_hat, metric)[0]
+
+
+    def _performances(self, y_valid_hats: list | torch.Tensor, metric: str) -> np.ndarray:
+        """
+        Evaluate a batch of predictions on the validation data in one call.
+        Args:
+            y_valid_hats: Predicted validation labels (K, N_dev, 1)
+            metric: Metric to use
+                mse or qwk or corr
+        Returns:
+            np.ndarray: Performance of each prediction (K,)
+        """
+        return batched_performance(y_valid_hats, self.y_dev_tensor, metric, self.qwk_kernel).cpu().numpy()
+
+
+    def dvrl_valuator(self, x_train: np.ndarray, y_train: np.ndarray, chunk_size: int = None, output_path: str = None) -> np.ndarray:
+        """
+        Estimate the given data value. The rows are moved to the device and
+        valued chunk by chunk without autograd, and the values are written
+        into a preallocated array, so memory stays bounded for large pools.
         Args:
             x_train: Training data
             y_train: Training labels
+            chunk_size: Rows per chunk (valuation_chunk_size when None)
+            output_path: Write the values to this memory-mapped .npy file instead of memory
         Returns:
-            data_value: Estimated data value
+            data_value: Estimated data value (N, 1)
         """
-        x_train = torch.tensor(x_train, dtype=torch.float).to(self.device)
-        y_train = torch.tensor(y_train, dtype=torch.float).view(-1, 1).to(self.device)
+        chunk_size = chunk_size or self.valuation_chunk_size
+        num_samples = len(x_train)
+        y_train = np.asarray(y_train).reshape(-1, 1)
+        data_value = value_array(num_samples, output_path)
 
-        # first calculate the prection difference
-        output = self.val_model(x_train)
-        y_pred_diff = torch.abs(y_train - output)
+        self.val_model.eval()
+        self.value_estimator.eval()
+        with torch.no_grad():
+            for start in range(0, num_samples, chunk_size):
+                end = min(start + chunk_size, num_samples)
+                x_chunk = torch.tensor(x_train[start:end], dtype=torch.float).to(self.device)
+                y_chunk = torch.tensor(y_train[start:end], dtype=torch.float).to(self.device)
+
+                # first calculate the prection difference
+                y_pred_diff = torch.abs(y_chunk - self.val_model(x_chunk))
+
+                # predict the value
+                data_value[start:end] = self.value_estimator(x_chunk, y_chunk, y_pred_diff).cpu().numpy()
+
+        if output_path is not None:
+            data_value.flush()
+        return data_value
 
-        # predict the value
-        data_value = self.value_estimator(x_train, y_train, y_pred_diff)
-        
-        return data_value.cpu().detach().numpy()
-    
 
     def dvrl_predict(self, x_test: np.ndarray) -> np.ndarray:
         """
@@ -0,0 +1,151 @@
+"""Outer-loop bookkeeping shared by the DVRL classes"""
+
+import copy
+import os
+import torch
+
+from utils.dvrl_utils import save_checkpoint, load_checkpoint
+from utils.general_utils import get_rng_state, set_rng_state
+
+
+class DvrlBase(object):
+    """
+    Bookkeeping of the DVRL outer loop shared by dvrl.Dvrl and dvrl_pos.Dvrl.
+    Subclasses set the attributes read here in their constructor and
+    train_dvrl, and implement _value_source.
+    """
+
+    def _converged(self, iteration: int) -> bool:
+        """
+        Every convergence_interval iterations, value all source rows and
+        compare their ranking with the previous snapshot.
+        Args:
+            iteration: Number of completed outer iterations
+        Returns:
+            bool: Whether the ranking has converged
+        """
+        if self.convergence_interval <= 0 or iteration % self.convergence_interval != 0:
+            return False
+        converged = self.convergence.update(self._value_source().cpu().numpy())
+        if self.convergence.history:
+            self.metrics_sink.log({'Ranking Corr': self.convergence.history[-1]}, step=iteration)
+        if converged:
+            print(f'Data value ranking converged after {iteration} iterations')
+        return converged
+
+
+    def _update_reference(self, state: dict) -> None:
+        """
+        Move the EMA reference model of the warm start towards the weights
+        of the latest inner model.
+        Args:
+            state: Weights of the latest inner model
+        """
+        if self.warm_start != 'ema':
+            return
+        with torch.no_grad():
+            for name, value in self.reference_state.items():
+                if value.is_floating_point():
+                    value.mul_(self.warm_start_decay).add_(state[name].to(value.device), alpha=1 - self.warm_start_decay)
+
+
+    def _take_checkpoint(self, resume: bool) -> dict | None:
+        """
+        Checkpoint to resume the outer loop from: the one the constructor
+        already loaded for the 'resume' parameter, or the one at
+        checkpoint_path when `resume` is set.
+        Args:
+            resume: Resume from the checkpoint if it exists
+        Returns:
+            dict: Loaded checkpoint (None to start from scratch)
+        """
+        if self.resume_checkpoint is not None:
+            print(f'Resuming from {self.checkpoint_path}...')
+            checkpoint, self.resume_checkpoint = self.resume_checkpoint, None
+            return checkpoint
+        if resume and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            print(f'Resuming from {self.checkpoint_path}...')
+            return load_checkpoint(self.checkpoint_path)
+        return None
+
+
+    def _restore(self, checkpoint: dict) -> tuple:
+        """
+        Restore the estimator, the set-up models, the warm-start reference,
+        the convergence state and the random streams from a checkpoint.
+        Args:
+            checkpoint: Checkpoint saved by _maybe_checkpoint
+        Returns:
+            tuple: Reward baseline and number of completed outer iterations
+        """
+        self.value_estimator.load_state_dict(checkpoint['value_estimator'])
+        self.dvrl_optimizer.load_state_dict(checkpoint['dvrl_optimizer'])
+        self.ori_model.load_state_dict(checkpoint['ori_model'])
+        self.val_model.load_state_dict(checkpoint['val_model'])
+        self.y_pred_diff_tensor = checkpoint['y_pred_diff'].to(self.device)
+        self.init_state = checkpoint['init_state']
+        self.reference_state = checkpoint.get('reference_state', copy.deepcopy(self.ori_model.state_dict()))
+        self.reference_state = {name: value.to(self.device) for name, value in self.reference_state.items()}
+        baseline = checkpoint['baseline']
+        start_iter = checkpoint['iteration']
+        if 'convergence' in checkpoint:
+            self.convergence.load_state_dict(checkpoint['convergence'])
+            if self.convergence.converged:
+                start_iter = self.outter_iterations
+        # restored last so the resumed loop draws the same numbers
+        set_rng_state(checkpoint['rng_state'])
+        return baseline, start_iter
+
+
+    def _maybe_checkpoint(self, iteration: int, baseline: float, force: bool = False) -> None:
+        """
+        Save everything needed to resume after `iteration` completed updates,
+        every checkpoint_interval updates and after the last one.
+        Args:
+            iteration: Number of completed outer iterations
+            baseline: Current reward baseline
+            force: Save regardless of the interval (e.g. on early stopping)
+        """
+        if self.checkpoint_path is None:
+            return
+        if not force and iteration % self.checkpoint_interval != 0 and iteration != self.outter_iterations:
+            return
+        y_valid_hat_ori = self.y_valid_hat_ori
+        if torch.is_tensor(y_valid_hat_ori):
+            y_valid_hat_ori = y_valid_hat_ori.cpu()
+        save_checkpoint({
+            'iteration': iteration,
+            'baseline': baseline,
+            'value_estimator': self.value_estimator.state_dict(),
+            'dvrl_optimizer': self.dvrl_optimizer.state_dict(),
+            'ori_model': self.ori_model.state_dict(),
+            'val_model': self.val_model.state_dict(),
+            'init_state': self.init_state,
+            'reference_state': self.reference_state,
+            'y_pred_diff': self.y_pred_diff_tensor.cpu(),
+            'y_valid_hat_ori': y_valid_hat_ori,
+            'convergence': self.convergence.state_dict(),
+            'rng_state': get_rng_state()
+        }, self.checkpoint_path)
+
+
+    def _log_iteration(self, iter: int, reward: torch.Tensor, loss: torch.Tensor, est_dv_curr: torch.Tensor, dvrl_perf: float, metric: str) -> None:
+        # tensors are handed over as is and converted by the sink's thread
+        est_dv_curr = torch.as_tensor(est_dv_curr).detach()
+        record = {} if reward is None else {'Reward': reward.detach().squeeze()}
+        record.update({
+            'DVRL Loss': loss.detach(),
+            'Prob MAX': torch.max(est_dv_curr),
+            'Prob MIN': torch.min(est_dv_curr)
+            })
+        # without a reward (successive halving) the performance is the first-rung mean
+        record[metric if reward is not None else f'{metric} first rung'] = dvrl_perf
+        self.metrics_sink.log(record, step=iter + 1)
+
+
+    def _dump_profile(self) -> None:
+        if not self.timer.enabled:
+            return
+        print(self.timer.report())
+        if self.profile_path is not None:
+            self.timer.dump(self.profile_path)
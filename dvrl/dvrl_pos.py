@@ -1,4 +1,3 @@
-
 """DVRL class for data valuation using reinforcement learning"""
 
 import copy
@@ -8,11 +7,13 @@ from tqdm import tqdm
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from sklearn import metrics
-import wandb
 
+from dvrl.dvrl_base import DvrlBase
 from dvrl.dvrl_loss import DvrlLoss
-from utils.dvrl_utils import fit_func_for_PAES, pred_func_for_PAES, calc_qwk
+from utils.dvrl_utils import fit_func_for_PAES, pred_func_for_PAES, QWKKernel, batched_performance, save_checkpoint, load_checkpoint, hash_contents, RankingConvergence, value_in_chunks, value_array
+from utils.inner_trainer import InnerTrainer
+from utils.profiler import StageTimer
+from utils.metrics_sink import MetricsSink
 
 
 class DataValueEstimator(nn.Module):
@@ -87,7 +88,7 @@ class DataValueEstimator(nn.Module):
 
 
 
-class Dvrl(object):
+class Dvrl(DvrlBase):
 
     def __init__(
         self,
@@ -134,6 +135,31 @@ class Dvrl(object):
         self.batch_size_predictor = int(np.max([parameters['batch_size_predictor'], self.x_dev[0].shape[0]]))
         self.moving_average_window = parameters['moving_average_window']
         self.moving_average = parameters['moving_average']
+        # Periodic checkpoint of the outer loop (None disables checkpointing)
+        self.checkpoint_path = parameters.get('checkpoint_path', None)
+        self.checkpoint_interval = parameters.get('checkpoint_interval', 50)
+        # Directory of the cached baseline/validation models (None disables the cache)
+        self.cache_dir = parameters.get('cache_dir', None)
+        # Per-stage timing of the outer loop (dumped to profile_path as JSON or CSV)
+        self.timer = StageTimer(parameters.get('profile', False), parameters.get('profile_capacity', 1000), sync_cuda=torch.device(device).type == 'cuda')
+        self.profile_path = parameters.get('profile_path', None)
+        # Per-iteration metrics: local JSONL/SQLite file and/or the wandb run the caller initialized
+        self.metrics_path = parameters.get('metrics_path', None)
+        self.use_wandb = parameters.get('use_wandb', False)
+        # Stop once the data value ranking is stable between snapshots (interval 0 disables the check)
+        self.convergence_interval = parameters.get('convergence_interval', 0)
+        self.convergence_method = parameters.get('convergence_method', 'spearman')
+        self.convergence_tol = parameters.get('convergence_tol', 0.99)
+        self.convergence_patience = parameters.get('convergence_patience', 3)
+        # Start of each inner retraining: 'init' (initial weights, inner_iterations epochs),
+        # 'ori' (original model) or 'ema' (EMA of the recent inner models) fine-tuned for warm_start_epochs
+        self.warm_start = parameters.get('warm_start', 'init')
+        self.warm_start_epochs = parameters.get('warm_start_epochs', 5)
+        self.warm_start_decay = parameters.get('warm_start_decay', 0.9)
+        # Source rows valued at once (bounds the memory of the full-source valuation)
+        self.valuation_chunk_size = parameters.get('valuation_chunk_size', 10000)
+        if self.warm_start not in ('init', 'ori', 'ema'):
+            raise ValueError('Warm start not supported')
 
         # Basic parameters
         self.epsilon = 1e-8  # Adds to the log to avoid overflow
@@ -145,128 +171,234 @@ class Dvrl(object):
         self.pred_model = pred_model
         self.final_model = pred_model
 
-        # save initial model
-        print('Saving the initial model...')
-        os.makedirs('tmp', exist_ok=True)
-        torch.save(self.pred_model.state_dict(), 'tmp/init_model.pth')
+        # keep the initial weights in memory for the weight resets
+        self.init_state = copy.deepcopy(self.pred_model.state_dict())
 
-        # train baseline model
+        # train baseline model and validation model (or load them from the setup cache)
         self.ori_model = copy.deepcopy(self.pred_model)
-        self.ori_model.load_state_dict(torch.load('tmp/init_model.pth'))
-        print('Training the original model...')
-        fit_func_for_PAES(self.ori_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device)
-
         self.val_model = copy.deepcopy(self.pred_model)
-        self.val_model.load_state_dict(torch.load('tmp/init_model.pth'))
-        print('Training the validation model...')
-        fit_func_for_PAES(self.val_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.inner_iterations, self.device)
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_key = hash_contents(self.x_train, self.y_train, self.x_dev, self.y_dev, repr(self.pred_model), self.init_state, self.inner_iterations, self.batch_size_predictor)
+            cache_path = os.path.join(self.cache_dir, f'dvrl_pos_setup_{cache_key}.pth')
+
+        # on resume the set-up models come from the checkpoint instead of being retrained
+        self.resume_checkpoint = None
+        if parameters.get('resume', False) and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            self.resume_checkpoint = load_checkpoint(self.checkpoint_path)
+
+        if self.resume_checkpoint is not None and 'y_valid_hat_ori' in self.resume_checkpoint:
+            print(f'Loading the original and validation models from {self.checkpoint_path}...')
+            checkpoint = self.resume_checkpoint
+            self.init_state = checkpoint['init_state']
+            self.ori_model.load_state_dict(checkpoint['ori_model'])
+            self.val_model.load_state_dict(checkpoint['val_model'])
+            y_valid_hat_ori = checkpoint['y_valid_hat_ori']
+            y_pred_diff = checkpoint['y_pred_diff']
+        elif cache_path is not None and os.path.exists(cache_path):
+            print(f'Loading the original and validation models from {cache_path}...')
+            cache = load_checkpoint(cache_path)
+            self.ori_model.load_state_dict(cache['ori_model'])
+            self.val_model.load_state_dict(cache['val_model'])
+            y_valid_hat_ori = cache['y_valid_hat_ori']
+            y_pred_diff = cache['y_pred_diff']
+        else:
+            self.ori_model.load_state_dict(self.init_state)
+            print('Training the original model...')
+            fit_func_for_PAES(self.ori_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device)
+
+            self.val_model.load_state_dict(self.init_state)
+            print('Training the validation model...')
+            fit_func_for_PAES(self.val_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.inner_iterations, self.device)
+
+            # predictions of the original model and prediction differences
+            y_valid_hat_ori = InnerTrainer(self.ori_model, None, None, self.batch_size_predictor, 0, self.device, x_dev=self.x_dev[:3]).predict().cpu()
+            y_train_valid_pred = InnerTrainer(self.val_model, None, None, self.batch_size_predictor, 0, self.device, x_dev=self.x_train[:3]).predict().cpu()
+            y_pred_diff = torch.abs(torch.as_tensor(self.y_train, dtype=torch.float).view(-1, 1) - y_train_valid_pred)
+            if cache_path is not None:
+                save_checkpoint({
+                    'ori_model': self.ori_model.state_dict(),
+                    'val_model': self.val_model.state_dict(),
+                    'y_valid_hat_ori': y_valid_hat_ori,
+                    'y_pred_diff': y_pred_diff
+                }, cache_path)
+        self.y_valid_hat_ori = y_valid_hat_ori.to(self.device)
+        self.y_pred_diff_tensor = y_pred_diff.to(self.device)
+
+        # keep the source and dev data on the device for the inner loop
+        self.trainer = InnerTrainer(self.pred_model, self.x_train[:3], self.y_train, self.batch_size_predictor, self.inner_iterations, self.device, x_dev=self.x_dev[:3], optimizer_cls=optim.RMSprop)
+        self.x_embed_tensor = torch.tensor(self.x_source_embed, dtype=torch.float).to(self.device)
+        self.y_train_tensor = self.trainer.y_train.view(-1, 1)
+        self.qwk_kernel = QWKKernel(self.y_dev, self.test_prompt_id, 'score', self.device)
+        self.y_dev_tensor = self.y_dev.to(self.device, self.qwk_kernel.dtype)
 
 
     def train_dvrl(
         self,
-        metric: str
+        metric: str,
+        resume: bool = False
     ) -> None:
         """
         Train the DVRL model
         Args:
             metric: Metric to use for the DVRL
                 mse or qwk or corr
+            resume: Resume from the checkpoint if it exists (implied by the 'resume' parameter,
+                which also restores the original/validation models in the constructor)
         """
         # selection network
         self.value_estimator = DataValueEstimator(self.data_dim+self.label_dim, self.hidden_dim, self.comb_dim, self.layer_number, self.act_fn)
         self.value_estimator = self.value_estimator.to(self.device)
         dvrl_criterion = DvrlLoss(self.epsilon, self.threshold, self.std_penalty_weight).to(self.device)
-        dvrl_optimizer = optim.Adam(self.value_estimator.parameters(), lr=self.learning_rate)
+        self.dvrl_optimizer = optim.Adam(self.value_estimator.parameters(), lr=self.learning_rate)
+        dvrl_optimizer = self.dvrl_optimizer
+
+        self.metrics_sink = MetricsSink(self.metrics_path, self.use_wandb, echo=True)
 
-        # baseline performance
-        valid_perf, _ = pred_func_for_PAES(self.ori_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.device, 'score', metric)
-        print(f'Baseline {metric}: {valid_perf:.3f}')
+        self.convergence = RankingConvergence(self.convergence_method, self.convergence_tol, self.convergence_patience)
 
-        # Prediction differences
-        _, y_train_valid_pred = pred_func_for_PAES(self.val_model, self.x_train, self.y_train, self.batch_size_predictor, self.device, 'score', metric)
-        y_pred_diff = np.abs(self.y_train.numpy() - np.array(y_train_valid_pred).reshape(-1, 1))
+        checkpoint = self._take_checkpoint(resume)
+
+        if checkpoint is None:
+            # baseline performance
+            valid_perf = self._performance(self.y_valid_hat_ori, metric)
+            print(f'Baseline {metric}: {valid_perf:.3f}')
+
+            if self.moving_average:
+                baseline = 0
+            else:
+                baseline = valid_perf
 
-        if self.moving_average:
-            baseline = 0
+            self.reference_state = copy.deepcopy(self.ori_model.state_dict())
+            start_iter = 0
         else:
-            baseline = valid_perf
-        
-        for iter in tqdm(range(self.outter_iterations)):
+            baseline, start_iter = self._restore(checkpoint)
+
+        init_state = self.init_state
+        y_pred_diff_tensor = self.y_pred_diff_tensor
+        # the inner retraining starts from the initial weights or warm starts from the reference model
+        if self.warm_start == 'init':
+            rollout_state, rollout_epochs = init_state, self.inner_iterations
+        else:
+            rollout_state, rollout_epochs = self.reference_state, self.warm_start_epochs
+        timer = self.timer
+        for iter in tqdm(range(start_iter, self.outter_iterations), initial=start_iter, total=self.outter_iterations):
             self.value_estimator.train()
             dvrl_optimizer.zero_grad()
 
-            # Batch selection
-            batch_idx = np.random.permutation(self.x_train[0].shape[0])[:self.batch_size]
-
-            x_embed_batch = torch.tensor(self.x_source_embed[batch_idx], dtype=torch.float).to(self.device)
-            x_source_batch = self.x_train[0][batch_idx].to(self.device)
-            x_source_linguistic_batch = self.x_train[1][batch_idx].to(self.device)
-            x_source_retrieval_batch = self.x_train[2][batch_idx].to(self.device)
-            x_source_prompt_batch = self.x_train[3][batch_idx].to(self.device)
-            x_batch = [x_source_batch, x_source_linguistic_batch, x_source_retrieval_batch, x_source_prompt_batch]
-            y_batch = self.y_train[batch_idx].to(self.device)
-            y_hat_batch = torch.tensor(y_pred_diff[batch_idx], dtype=torch.float).to(self.device)
-
-            # Generates the selection probability
-            est_dv_curr = self.value_estimator(x_embed_batch, y_batch, y_hat_batch).squeeze()
-
-            # Samples the selection probability
-            sel_prob_curr = np.random.binomial(1, est_dv_curr.detach().cpu().numpy(), est_dv_curr.shape)
-            # Exception (When selection probability is 0)
-            if np.sum(sel_prob_curr) == 0:
-                print('All zero selection probability')
-                est_dv_curr = 0.5 * np.ones(np.shape(est_dv_curr))
-                sel_prob_curr = np.random.binomial(1, est_dv_curr, est_dv_curr.shape)
-
-            new_model = self.pred_model
-            new_model.load_state_dict(torch.load('tmp/init_model.pth'))
-            fit_func_for_PAES(new_model, x_batch, y_batch, self.batch_size_predictor, self.inner_iterations, self.device, sel_prob_curr)
-            dvrl_perf, _ = pred_func_for_PAES(new_model, self.x_dev, self.y_dev, self.batch_size_predictor, self.device, 'score', metric)
-
-            # reward computation
-            if metric == 'mse':
-                reward = baseline - dvrl_perf
-            elif metric == 'qwk':
-                reward = dvrl_perf - baseline
-            elif metric == 'corr':
-                reward = dvrl_perf - baseline
+            with timer.stage('select'):
+                # Batch selection
+                batch_idx = np.random.permutation(self.x_train[0].shape[0])[:self.batch_size]
+                batch_idx = torch.tensor(batch_idx, dtype=torch.long).to(self.device)
+
+                x_embed_batch = self.x_embed_tensor[batch_idx]
+                y_batch = self.y_train_tensor[batch_idx]
+                y_hat_batch = y_pred_diff_tensor[batch_idx]
+
+                # Generates the selection probability
+                est_dv_curr = self.value_estimator(x_embed_batch, y_batch, y_hat_batch).squeeze()
+
+                # Samples the selection probability
+                sel_prob_curr = np.random.binomial(1, est_dv_curr.detach().cpu().numpy(), est_dv_curr.shape)
+                # Exception (When selection probability is 0)
+                if np.sum(sel_prob_curr) == 0:
+                    print('All zero selection probability')
+                    est_dv_curr = 0.5 * np.ones(np.shape(est_dv_curr))
+                    sel_prob_curr = np.random.binomial(1, est_dv_curr, est_dv_curr.shape)
+
+            with timer.stage('reset'):
+                self.trainer.reset(rollout_state)
+            with timer.stage('fit'):
+                self.trainer.fit(sel_prob_curr, idx=batch_idx, epochs=rollout_epochs)
+                self._update_reference(self.trainer.model.state_dict())
+            with timer.stage('predict'):
+                y_valid_hat = self.trainer.predict()
+
+            with timer.stage('reward'):
+                dvrl_perf = self._performance(y_valid_hat, metric)
+
+                # reward computation
+                if metric == 'mse':
+                    reward = baseline - dvrl_perf
+                elif metric == 'qwk':
+                    reward = dvrl_perf - baseline
+                elif metric == 'corr':
+                    reward = dvrl_perf - baseline
 
             # update the selection network
-            reward = torch.tensor([reward]).to(self.device)
-            sel_prob_curr = torch.tensor(sel_prob_curr, dtype=torch.float).to(self.device)
-            loss = dvrl_criterion(est_dv_curr, sel_prob_curr, reward)
-            loss.backward()
-            dvrl_optimizer.step()
+            with timer.stage('update'):
+                reward = torch.tensor([reward]).to(self.device)
+                sel_prob_curr = torch.tensor(sel_prob_curr, dtype=torch.float).to(self.device)
+                loss = dvrl_criterion(est_dv_curr, sel_prob_curr, reward)
+                loss.backward()
+                dvrl_optimizer.step()
 
             # update the baseline
             if self.moving_average:
                 baseline = ((self.moving_average_window - 1) / self.moving_average_window) * baseline + (dvrl_perf / self.moving_average_window)
 
-            if metric == 'mse':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, MSE: {dvrl_perf:.3f}')
-            elif metric == 'qwk':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, QWK: {dvrl_perf:.3f}')
-            elif metric == 'corr':
-                print(f'Iteration: {iter+1}, Reward: {reward.item():.3f}, DVRL Loss: {loss.item():.3f}, Prob MAX: {torch.max(est_dv_curr).item():.3f}, Prob MIN: {torch.min(est_dv_curr).item():.3f}, Corr: {dvrl_perf:.3f}')
+            with timer.stage('log'):
+                self._log_iteration(iter, reward, loss, est_dv_curr, dvrl_perf, metric)
 
-            wandb.log({
-                'Reward': reward.item(),
-                'DVRL Loss': loss.item(),
-                'Prob MAX': torch.max(est_dv_curr).item(),
-                'Prob MIN': torch.min(est_dv_curr).item(),
-                metric: dvrl_perf
-                })
+            with timer.stage('convergence'):
+                converged = self._converged(iter + 1)
+            with timer.stage('checkpoint'):
+                self._maybe_checkpoint(iter + 1, baseline, force=converged)
+            timer.step()
+            if converged:
+                break
 
+        self.metrics_sink.close()
+        self._dump_profile()
 
         # Training the final model
-        x_train = torch.tensor(self.x_source_embed, dtype=torch.float).to(self.device)
-        y_pred_diff = torch.tensor(y_pred_diff, dtype=torch.float).to(self.device)
-        final_data_value = self.value_estimator(x_train, self.y_train.to(self.device), y_pred_diff).squeeze()
-        self.final_model.load_state_dict(torch.load('tmp/init_model.pth'))
+        final_data_value = self._value_source()
+        self.final_model.load_state_dict(init_state)
         fit_func_for_PAES(self.final_model, self.x_train, self.y_train, self.batch_size_predictor, self.inner_iterations, self.device, final_data_value)
 
-        return final_data_value.cpu().detach().numpy()
-    
+
+    def _value_source(self) -> torch.Tensor:
+        """
+        Value every source row, streaming over the source in chunks of
+        valuation_chunk_size rows without building the autograd graph.
+        Returns:
+            torch.Tensor: Data value of each source row (N,)
+        """
+        return value_in_chunks(self.value_estimator, self.x_embed_tensor, self.y_train_tensor, self.y_pred_diff_tensor, self.valuation_chunk_size)
+
+
+    def dvrl_valuator(self, output_path: str = None) -> np.ndarray:
+        """
+        Estimate the value of every source row with the trained estimator,
+        chunk by chunk, into a preallocated array.
+        Args:
+            output_path: Write the values to this memory-mapped .npy file instead of memory
+        Returns:
+            data_value: Estimated data value (N, 1)
+        """
+        data_value = value_array(self.x_embed_tensor.shape[0], output_path)
+        for start in range(0, len(data_value), self.valuation_chunk_size):
+            end = start + self.valuation_chunk_size
+            data_value[start:end] = value_in_chunks(
+                self.value_estimator, self.x_embed_tensor[start:end], self.y_train_tensor[start:end], self.y_pred_diff_tensor[start:end], self.valuation_chunk_size
+            ).cpu().numpy().reshape(-1, 1)
+        if output_path is not None:
+            data_value.flush()
+        return data_value
+
+
+    def _performance(self, y_valid_hat: torch.Tensor, metric: str) -> float:
+        """
+        Evaluate the predictions on the validation data (all from the target prompt).
+        Args:
+            y_valid_hat: Predicted validation labels
+            metric: Metric to use
+                mse or qwk or corr
+        Returns:
+            float: Performance
+        """
+        return batched_performance(y_valid_hat, self.y_dev_tensor, metric, self.qwk_kernel).item()
+
 
     def dvrl_predict(self, x_test: np.ndarray, y_test: np.array) -> np.ndarray:
         """
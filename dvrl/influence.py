@@ -0,0 +1,183 @@
+"""Influence-function data valuation for the MLP predictor"""
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.func import functional_call, grad, jvp, vjp, vmap
+
+
+class InfluenceFunction(object):
+    """
+    Influence of each source row on the dev loss of a trained predictor
+    (Koh & Liang, 2017), without retraining. The parameters are handled as
+    one flat vector: the inverse-Hessian-vector product s = (H + damping I)^{-1} g_dev
+    is solved with conjugate gradient or LiSSA, and the value of row i is g_i . s / N, the
+    first-order increase of the dev loss when the row is removed (the same
+    sign convention as the leave-one-out scores).
+    The curvature H is the Gauss-Newton matrix of the squared error by
+    default, which is positive semi-definite, so CG is well posed; the
+    exact Hessian (forward-over-reverse products) of the ReLU/sigmoid MLP
+    is indefinite in general, and CG stops with an error when it meets
+    negative curvature.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        x_train: np.ndarray,
+        y_train: np.ndarray,
+        device: torch.device,
+        damping: float = 0.01,
+        chunk_size: int = 64,
+        curvature: str = 'gauss_newton'
+    ) -> None:
+        """
+        Args:
+            model: Trained prediction model
+            x_train: Training data
+            y_train: Training labels
+            device: Device to run the computation
+            damping: Added to the Hessian diagonal (the MLP loss is not convex)
+            chunk_size: Rows per batch of per-sample gradients / Hessian-vector products
+            curvature: 'gauss_newton' (PSD) or 'hessian' (exact, may be indefinite)
+        """
+        if curvature not in ('gauss_newton', 'hessian'):
+            raise ValueError(f'Unknown curvature: {curvature}')
+        self.curvature = curvature
+        self.model = model.to(device).eval()
+        self.device = device
+        self.damping = damping
+        self.chunk_size = chunk_size
+        self.x_train = torch.tensor(x_train, dtype=torch.float).to(device)
+        self.y_train = torch.tensor(y_train, dtype=torch.float).view(-1).to(device)
+
+        params = {name: value.detach() for name, value in model.named_parameters()}
+        self.names = list(params)
+        self.shapes = [value.shape for value in params.values()]
+        self.numels = [value.numel() for value in params.values()]
+        self.theta = torch.cat([value.reshape(-1) for value in params.values()])
+
+    def _unflatten(self, vec: torch.Tensor) -> dict:
+        return {name: chunk.view(shape) for name, chunk, shape in zip(self.names, torch.split(vec, self.numels), self.shapes)}
+
+    def _loss(self, vec: torch.Tensor, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        # summed squared error (the caller divides by the number of rows)
+        y_pred = functional_call(self.model, self._unflatten(vec), (x,))
+        return torch.sum((y_pred.view(-1) - y) ** 2)
+
+    def _output(self, vec: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        return functional_call(self.model, self._unflatten(vec), (x,)).view(-1)
+
+    def _sample_loss(self, vec: torch.Tensor, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        return self._loss(vec, x.unsqueeze(0), y.unsqueeze(0))
+
+    def hvp(self, v: torch.Tensor, idx: torch.Tensor = None) -> torch.Tensor:
+        """
+        Damped curvature-vector product of the mean training loss
+        (Gauss-Newton J^T 2 J v or exact Hessian, see curvature).
+        Args:
+            v: Vector (P,)
+            idx: Rows of the loss (all source rows when None)
+        Returns:
+            torch.Tensor: (H + damping I) v
+        """
+        x_train, y_train = (self.x_train, self.y_train) if idx is None else (self.x_train[idx], self.y_train[idx])
+        result = torch.zeros_like(v)
+        for start in range(0, len(y_train), self.chunk_size):
+            x_chunk, y_chunk = x_train[start:start + self.chunk_size], y_train[start:start + self.chunk_size]
+            if self.curvature == 'gauss_newton':
+                output = lambda vec: self._output(vec, x_chunk)
+                jv = jvp(output, (self.theta,), (v,))[1]
+                result += vjp(output, self.theta)[1](2 * jv)[0]
+            else:
+                gradient = grad(lambda vec: self._loss(vec, x_chunk, y_chunk))
+                result += jvp(gradient, (self.theta,), (v,))[1]
+        return result / len(y_train) + self.damping * v
+
+    def solve_cg(self, b: torch.Tensor, max_iterations: int = 100, tol: float = 1e-6) -> torch.Tensor:
+        """
+        Solve (H + damping I) s = b with conjugate gradient.
+        Args:
+            b: Right-hand side (P,)
+            max_iterations: Maximum number of CG iterations (one pass over the source each)
+            tol: Relative residual norm to stop at
+        Returns:
+            torch.Tensor: Solution s
+        """
+        s = torch.zeros_like(b)
+        r = b.clone()
+        p = r.clone()
+        rr = torch.dot(r, r)
+        b_norm = torch.sqrt(rr)
+        for iteration in range(max_iterations):
+            hp = self.hvp(p)
+            curvature = torch.dot(p, hp)
+            if curvature <= 0:
+                # CG is only defined for positive definite systems; past this point alpha
+                # flips sign or blows up and the solution is meaningless
+                raise ValueError(
+                    f'CG met negative curvature (p.Hp = {curvature.item():.3e}) at iteration {iteration}: '
+                    'use the gauss_newton curvature, a larger damping or the lissa solver'
+                )
+            alpha = rr / curvature
+            s += alpha * p
+            r -= alpha * hp
+            rr_new = torch.dot(r, r)
+            if torch.sqrt(rr_new) <= tol * b_norm:
+                break
+            p = r + (rr_new / rr) * p
+            rr = rr_new
+        return s
+
+    def solve_lissa(self, b: torch.Tensor, depth: int = 1000, scale: float = 10.0, batch_size: int = 256, num_repeats: int = 1) -> torch.Tensor:
+        """
+        Approximate (H + damping I)^{-1} b with the LiSSA recursion
+            h_j = b + h_{j-1} - (H_j + damping I) h_{j-1} / scale
+        on random minibatch Hessians H_j, averaged over num_repeats runs.
+        Args:
+            b: Right-hand side (P,)
+            depth: Recursion steps per run
+            scale: Must exceed the largest Hessian eigenvalue for convergence
+            batch_size: Rows per minibatch Hessian
+            num_repeats: Independent runs averaged
+        Returns:
+            torch.Tensor: Approximate solution
+        """
+        estimate = torch.zeros_like(b)
+        for _ in range(num_repeats):
+            h = b.clone()
+            for _ in range(depth):
+                idx = torch.randint(0, len(self.y_train), (batch_size,), device=self.device)
+                h = b + h - self.hvp(h, idx) / scale
+            estimate += h / scale
+        return estimate / num_repeats
+
+    def values(self, x_dev: np.ndarray, y_dev: np.ndarray, solver: str = 'cg', **solver_kwargs) -> np.ndarray:
+        """
+        Value every source row by its influence on the dev loss.
+        Args:
+            x_dev: Validation data
+            y_dev: Validation labels
+            solver: Inverse-HVP solver ('cg' or 'lissa')
+            solver_kwargs: Arguments of the solver
+        Returns:
+            np.ndarray: Data value of each source row (N, 1)
+        """
+        x_dev = torch.tensor(x_dev, dtype=torch.float).to(self.device)
+        y_dev = torch.tensor(y_dev, dtype=torch.float).view(-1).to(self.device)
+        dev_gradient = grad(self._loss)(self.theta, x_dev, y_dev) / len(y_dev)
+        if solver == 'cg':
+            s = self.solve_cg(dev_gradient, **solver_kwargs)
+        elif solver == 'lissa':
+            s = self.solve_lissa(dev_gradient, **solver_kwargs)
+        else:
+            raise ValueError(f'Unknown solver: {solver}')
+
+        # batched per-sample gradients, projected on s chunk by chunk
+        sample_gradients = vmap(grad(self._sample_loss), in_dims=(None, 0, 0))
+        data_value = torch.empty(len(self.y_train), device=self.device)
+        for start in range(0, len(self.y_train), self.chunk_size):
+            end = start + self.chunk_size
+            data_value[start:end] = sample_gradients(self.theta, self.x_train[start:end], self.y_train[start:end]) @ s
+        data_value /= len(self.y_train)
+        return data_value.cpu().numpy().reshape(-1, 1)
@@ -0,0 +1,64 @@
+"""Exact KNN-Shapley data valuation on fixed essay embeddings"""
+
+import numpy as np
+import torch
+
+
+def knn_shapley(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_dev: np.ndarray,
+    y_dev: np.ndarray,
+    k: int = 10,
+    label_tolerance: float = 0.05,
+    device: torch.device = torch.device('cpu'),
+    chunk_size: int = 8
+) -> np.ndarray:
+    """
+    Exact Shapley values of the source rows for a K-nearest-neighbour
+    predictor (Jia et al., 2019). The utility of a subset on one dev essay
+    is the share of its K nearest source essays whose label matches the dev
+    label, so every dev essay only needs one sort of the source by distance
+    and a recursion from the farthest to the nearest row:
+        s_N = match_N / max(N, K)
+        s_i = s_{i+1} + (match_i - match_{i+1}) / K * min(K, i) / i
+    The recursion is run for a chunk of dev essays at once with a reversed
+    cumulative sum, and the values are averaged over the dev essays.
+    Args:
+        x_train: Training data (N, D)
+        y_train: Training labels (N,)
+        x_dev: Validation data (M, D)
+        y_dev: Validation labels (M,)
+        k: Number of neighbours
+        label_tolerance: Labels closer than this count as the same score
+        device: Device to run the computation
+        chunk_size: Number of dev essays processed at once (bounds the (chunk, N) buffers)
+    Returns:
+        np.ndarray: Data value of each source row (N, 1)
+    """
+    x_train = torch.tensor(x_train, dtype=torch.float).to(device)
+    y_train = torch.tensor(y_train, dtype=torch.float).view(-1).to(device)
+    x_dev = torch.tensor(x_dev, dtype=torch.float).to(device)
+    y_dev = torch.tensor(y_dev, dtype=torch.float).view(-1).to(device)
+    num_samples = x_train.shape[0]
+
+    # min(K, i) / i for the 1-based rank i of the row in front of each difference
+    rank = torch.arange(1, num_samples, dtype=torch.float, device=device)
+    rank_weight = torch.clamp(rank, max=k) / rank / k
+
+    data_value = torch.zeros(num_samples, dtype=torch.float, device=device)
+    for start in range(0, x_dev.shape[0], chunk_size):
+        x_chunk, y_chunk = x_dev[start:start + chunk_size], y_dev[start:start + chunk_size]
+        order = torch.argsort(torch.cdist(x_chunk, x_train), dim=1)
+        match = (torch.abs(y_train[order] - y_chunk[:, None]) <= label_tolerance).float()
+
+        # s_i = s_N + sum_{j >= i} (match_j - match_{j+1}) * rank_weight_j
+        diffs = (match[:, :-1] - match[:, 1:]) * rank_weight
+        shapley = torch.empty_like(match)
+        shapley[:, -1] = match[:, -1] / max(num_samples, k)
+        shapley[:, :-1] = shapley[:, -1:] + torch.flip(torch.cumsum(torch.flip(diffs, [1]), dim=1), [1])
+
+        data_value.scatter_add_(0, order.reshape(-1), shapley.reshape(-1))
+
+    data_value /= x_dev.shape[0]
+    return data_value.cpu().numpy().reshape(-1, 1)
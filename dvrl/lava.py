@@ -0,0 +1,92 @@
+"""Training-free data valuation with optimal transport (LAVA)"""
+
+import math
+import numpy as np
+import torch
+
+
+def sinkhorn(cost: torch.Tensor, epsilon: float = 0.1, max_iterations: int = 1000, tol: float = 1e-6) -> tuple:
+    """
+    Entropic optimal transport between uniform marginals, solved by
+    Sinkhorn in the log domain. The coupling is
+        P_ij = exp((f_i + g_j - cost_ij) / eps) / (N M),  eps = epsilon * mean(cost)
+    Args:
+        cost: Ground cost (N, M)
+        epsilon: Entropic regularization (relative to the mean cost)
+        max_iterations: Maximum number of Sinkhorn iterations
+        tol: Stop when the potentials change less than this (relative to the mean cost)
+    Returns:
+        tuple: Dual potentials f (N,) and g (M,), and eps
+    """
+    num_samples, num_dev = cost.shape
+    cost_scale = cost.mean().item()
+    eps = epsilon * cost_scale
+    log_a, log_b = -math.log(num_samples), -math.log(num_dev)
+    f = torch.zeros(num_samples, device=cost.device)
+    g = torch.zeros(num_dev, device=cost.device)
+    for _ in range(max_iterations):
+        f_prev = f
+        f = -eps * torch.logsumexp((g[None, :] - cost) / eps + log_b, dim=1)
+        g = -eps * torch.logsumexp((f[:, None] - cost) / eps + log_a, dim=0)
+        if torch.max(torch.abs(f - f_prev)).item() < tol * cost_scale:
+            break
+    return f, g, eps
+
+
+def lava(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_dev: np.ndarray,
+    y_dev: np.ndarray,
+    label_weight: float = 1.0,
+    epsilon: float = 0.1,
+    max_iterations: int = 1000,
+    tol: float = 1e-6,
+    device: torch.device = torch.device('cpu'),
+    chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    Value the source rows by their contribution to the optimal transport
+    distance to the dev data (Just et al., 2023). The ground cost joins
+    the squared feature distance and the squared label distance, each
+    divided by its mean so label_weight sets their balance. The entropic
+    coupling is solved by Sinkhorn in the log domain, and the value of a
+    row is minus its calibrated dual potential,
+        value_i = -(f_i - sum_{k != i} f_k / (N - 1)),
+    the (negated) change of the OT distance when mass moves to row i, so
+    rows that pull the source towards the dev data get high values.
+    Args:
+        x_train: Training data (N, D)
+        y_train: Training labels (N,)
+        x_dev: Validation data (M, D)
+        y_dev: Validation labels (M,)
+        label_weight: Weight of the label cost against the feature cost
+        epsilon: Entropic regularization (relative to the mean cost)
+        max_iterations: Maximum number of Sinkhorn iterations
+        tol: Stop when the potentials change less than this (relative to the mean cost)
+        device: Device to run the computation
+        chunk_size: Source rows per block of the cost computation
+    Returns:
+        np.ndarray: Data value of each source row (N, 1)
+    """
+    x_dev = torch.tensor(x_dev, dtype=torch.float).to(device)
+    y_dev = torch.tensor(y_dev, dtype=torch.float).view(-1).to(device)
+    num_samples, num_dev = len(x_train), len(x_dev)
+
+    # (N, M) feature and label costs, built block by block from the host arrays
+    feature_cost = torch.empty(num_samples, num_dev, device=device)
+    label_cost = torch.empty(num_samples, num_dev, device=device)
+    for start in range(0, num_samples, chunk_size):
+        x_chunk = torch.tensor(x_train[start:start + chunk_size], dtype=torch.float).to(device)
+        y_chunk = torch.tensor(y_train[start:start + chunk_size], dtype=torch.float).view(-1).to(device)
+        feature_cost[start:start + chunk_size] = torch.cdist(x_chunk, x_dev) ** 2
+        label_cost[start:start + chunk_size] = (y_chunk[:, None] - y_dev[None, :]) ** 2
+    cost = feature_cost / feature_cost.mean() + label_weight * label_cost / label_cost.mean().clamp(min=1e-12)
+    del feature_cost, label_cost
+
+    # dual potentials of the source rows
+    f = sinkhorn(cost, epsilon, max_iterations, tol)[0]
+
+    # calibrated gradient of the OT distance w.r.t. the mass of each row
+    gradient = f - (f.sum() - f) / (num_samples - 1)
+    return (-gradient).cpu().numpy().reshape(-1, 1)
@@ -0,0 +1,257 @@
+"""Exact prompt-level Shapley and Banzhaf values of the source prompts"""
+
+import copy
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from tqdm import tqdm
+
+from dvrl.ridge import WeightedRidge
+from utils.dvrl_utils import calc_qwk, hash_contents
+from utils.inner_trainer import InnerTrainer
+
+
+class CoalitionScorer(object):
+    """
+    Train the learner on the source essays of a coalition of prompts and
+    score it on the dev data. The learner is 'mlp' (the predictor trained
+    from its initial weights on the coalition's rows) or 'ridge' (a
+    closed-form head on the embeddings, solved from one cached factor).
+    """
+
+    def __init__(
+        self,
+        x_train: torch.Tensor,
+        y_train: torch.Tensor,
+        source_prompt: np.ndarray,
+        prompts: list,
+        x_dev: torch.Tensor,
+        y_dev: np.ndarray,
+        pred_model: nn.Module,
+        init_state: dict,
+        parameters: dict,
+        device: torch.device
+    ) -> None:
+        """
+        Args:
+            x_train: Training data
+            y_train: Training labels
+            source_prompt: Prompt id of each training row
+            prompts: Source prompt ids (bit i of a coalition stands for prompts[i])
+            x_dev: Validation data
+            y_dev: Validation labels
+            pred_model: Prediction model (mlp learner)
+            init_state: Initial weights of the predictor
+            parameters: Parameters for the prompt-level valuation (see PromptShapley)
+            device: Device to run the learner
+        """
+        self.learner = parameters.get('learner', 'mlp')
+        self.metric = parameters.get('metric', 'mse')
+        self.test_prompt_id = parameters.get('test_prompt_id', None)
+        self.attribute_name = parameters.get('attribute_name', 'score')
+        self.epochs = parameters.get('epochs', 100)
+        self.seed = parameters.get('seed', 0)
+        self.num_seeds = parameters.get('num_seeds', 1)
+        self.y_dev = np.asarray(y_dev).reshape(-1)
+        self.members = [torch.as_tensor(np.flatnonzero(source_prompt == prompt)) for prompt in prompts]
+        self.num_samples = len(y_train)
+        self.init_state = init_state
+        self.device = device
+        if self.learner == 'ridge':
+            self.ridge = WeightedRidge(x_train.to(device), y_train.to(device), parameters.get('ridge_alpha', 1.0))
+            self.x_dev = x_dev.to(device)
+        else:
+            self.trainer = InnerTrainer(pred_model, x_train, y_train, parameters.get('batch_size', 256), self.epochs, device, x_dev=x_dev)
+
+    def _score(self, y_pred: np.ndarray) -> float:
+        if self.metric == 'qwk':
+            return calc_qwk(self.y_dev, y_pred, self.test_prompt_id, self.attribute_name)
+        return -float(np.mean((np.asarray(y_pred).reshape(-1) - self.y_dev) ** 2))
+
+    def score(self, coalition: int) -> float:
+        """
+        Args:
+            coalition: Bit mask of the prompts in the coalition
+        Returns:
+            float: Dev score (negative MSE or QWK) of the learner trained on the coalition
+                (for the mlp, the mean over num_seeds shared training seeds)
+        """
+        if coalition == 0:
+            # no training data: predict the middle of the normalized score range
+            return self._score(np.full(len(self.y_dev), 0.5))
+        mask = torch.zeros(self.num_samples)
+        for bit, members in enumerate(self.members):
+            if coalition >> bit & 1:
+                mask[members] = 1
+        if self.learner == 'ridge':
+            self.ridge.fit(mask)
+            return self._score(self.ridge.predict(self.x_dev).cpu().numpy())
+        # every coalition is trained with the same seeds (common random numbers), so the
+        # init/shuffle noise largely cancels in the marginals scores[S | i] - scores[S]
+        scores = []
+        for repeat in range(self.num_seeds):
+            torch.manual_seed(self.seed + repeat)
+            self.trainer.reset(self.init_state)
+            self.trainer.fit(mask)
+            scores.append(self._score(self.trainer.predict().cpu().numpy()))
+        return float(np.mean(scores))
+
+
+# Per-process state set up once by the pool initializer
+_worker_state = {}
+
+
+def _init_worker(*args) -> None:
+    torch.set_num_threads(1)
+    _worker_state['scorer'] = CoalitionScorer(*args, torch.device('cpu'))
+
+
+def _score_coalition(coalition: int) -> float:
+    return _worker_state['scorer'].score(coalition)
+
+
+class PromptShapley(object):
+    """
+    Exact Shapley and Banzhaf values of the source prompts. With P prompts
+    there are only 2^P coalitions, so every coalition is trained and
+    scored (in this process or in a pool of single-threaded CPU workers),
+    and the values are exact sums over the coalition scores. The scores
+    are cached in a JSON file keyed by the data and the learner settings,
+    so a rerun, or one interrupted part way, only trains the missing
+    coalitions.
+    """
+
+    def __init__(
+        self,
+        x_train: np.ndarray,
+        y_train: np.ndarray,
+        source_prompt: np.ndarray,
+        x_dev: np.ndarray,
+        y_dev: np.ndarray,
+        pred_model: nn.Module,
+        parameters: dict,
+        device: torch.device
+    ) -> None:
+        """
+        Args:
+            x_train: Training data
+            y_train: Training labels
+            source_prompt: Prompt id of each training row
+            x_dev: Validation data
+            y_dev: Validation labels
+            pred_model: Prediction model (mlp learner)
+            parameters: Parameters for the prompt-level valuation
+                learner ('mlp' or 'ridge'), metric ('mse' or 'qwk'), test_prompt_id,
+                attribute_name, epochs, batch_size, ridge_alpha, num_workers, seed,
+                num_seeds (training seeds averaged per coalition, shared by all coalitions), cache_dir
+            device: Device to run the learner (when num_workers is 0)
+        """
+        if parameters.get('learner', 'mlp') not in ['mlp', 'ridge']:
+            raise ValueError(f'Unknown learner: {parameters.get("learner")}')
+        self.source_prompt = np.asarray(source_prompt)
+        self.prompts = sorted(np.unique(self.source_prompt).tolist())
+        self.parameters = parameters
+        self.num_workers = parameters.get('num_workers', 0)
+        self.device = device
+
+        self.x_train = torch.as_tensor(x_train, dtype=torch.float)
+        self.y_train = torch.as_tensor(y_train, dtype=torch.float).view(-1)
+        self.x_dev = torch.as_tensor(x_dev, dtype=torch.float)
+        self.y_dev = np.asarray(y_dev).reshape(-1)
+        self.pred_model = pred_model
+        self.init_state = {name: value.detach().cpu() for name, value in pred_model.state_dict().items()}
+
+        self.cache_path = None
+        if parameters.get('cache_dir', None) is not None:
+            settings = {key: value for key, value in parameters.items() if key not in ['num_workers', 'cache_dir']}
+            cache_key = hash_contents(x_train, y_train, self.source_prompt, x_dev, self.y_dev, repr(pred_model), self.init_state, settings)
+            self.cache_path = os.path.join(parameters['cache_dir'], f'prompt_coalitions_{cache_key}.json')
+        self.scores = {}
+
+    def _load_cache(self) -> None:
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                self.scores = {int(coalition): score for coalition, score in json.load(f)['scores'].items()}
+            print(f'Loaded {len(self.scores)} coalition scores from {self.cache_path}')
+
+    def _save_cache(self) -> None:
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'prompts': self.prompts, 'scores': {str(coalition): score for coalition, score in sorted(self.scores.items())}}, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def score_coalitions(self) -> dict:
+        """
+        Train and score every coalition missing from the cache.
+        Returns:
+            dict: Dev score of each coalition (bit mask over self.prompts)
+        """
+        self._load_cache()
+        todo = [coalition for coalition in range(2 ** len(self.prompts)) if coalition not in self.scores]
+        scorer_args = (self.x_train, self.y_train, self.source_prompt, self.prompts, self.x_dev, self.y_dev, self.pred_model, self.init_state, self.parameters)
+
+        progress_bar = tqdm(initial=2 ** len(self.prompts) - len(todo), total=2 ** len(self.prompts))
+        if self.num_workers > 0 and todo:
+            self.x_train.share_memory_()
+            self.y_train.share_memory_()
+            self.x_dev.share_memory_()
+            executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=mp.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=scorer_args[:6] + (copy.deepcopy(self.pred_model).cpu(),) + scorer_args[7:]
+            )
+            try:
+                futures = {executor.submit(_score_coalition, coalition): coalition for coalition in todo}
+                for future in as_completed(futures):
+                    self.scores[futures[future]] = future.result()
+                    self._save_cache()
+                    progress_bar.update(1)
+            finally:
+                executor.shutdown(cancel_futures=True)
+        elif todo:
+            scorer = CoalitionScorer(*scorer_args, self.device)
+            for coalition in todo:
+                self.scores[coalition] = scorer.score(coalition)
+                self._save_cache()
+                progress_bar.update(1)
+        progress_bar.close()
+        return self.scores
+
+    def values(self) -> dict:
+        """
+        Returns:
+            dict: Shapley and Banzhaf value of each source prompt
+        """
+        scores = self.score_coalitions()
+        num_prompts = len(self.prompts)
+        shapley = np.zeros(num_prompts)
+        banzhaf = np.zeros(num_prompts)
+        for bit in range(num_prompts):
+            for coalition in range(2 ** num_prompts):
+                if coalition >> bit & 1:
+                    continue
+                size = bin(coalition).count('1')
+                marginal = scores[coalition | 1 << bit] - scores[coalition]
+                shapley[bit] += math.factorial(size) * math.factorial(num_prompts - size - 1) / math.factorial(num_prompts) * marginal
+                banzhaf[bit] += marginal / 2 ** (num_prompts - 1)
+        return {prompt: {'shapley': shapley[bit], 'banzhaf': banzhaf[bit]} for bit, prompt in enumerate(self.prompts)}
+
+    def essay_values(self, values: dict, key: str = 'shapley') -> np.ndarray:
+        """
+        Spread the prompt values over the source essays.
+        Args:
+            values: Output of values()
+            key: 'shapley' or 'banzhaf'
+        Returns:
+            np.ndarray: Value of each source essay's prompt (N, 1)
+        """
+        return np.array([values[prompt][key] for prompt in self.source_prompt.tolist()]).reshape(-1, 1)
@@ -0,0 +1,140 @@
+"""Closed-form weighted ridge regression used as a DVRL inner learner"""
+
+import torch
+
+
+class WeightedRidge(object):
+    """
+    Weighted ridge regression on fixed features with an unpenalized bias.
+    The Gram matrix of the full data and its Cholesky factor are cached, so
+    a binary selection mask that drops only a few rows is solved with a
+    Woodbury downdate instead of a new factorization.
+    """
+
+    def __init__(
+        self,
+        x_train: torch.Tensor,
+        y_train: torch.Tensor,
+        alpha: float = 1.0
+    ) -> None:
+        """
+        Args:
+            x_train: Training data (N, D)
+            y_train: Training labels (N,) or (N, 1)
+            alpha: L2 regularization strength
+        """
+        x_train = torch.as_tensor(x_train)
+        self.device = x_train.device
+        # mps has no float64 support
+        self.dtype = torch.float32 if self.device.type == 'mps' else torch.float64
+
+        self.x = self._add_bias(x_train)
+        self.y = torch.as_tensor(y_train).to(self.device, self.dtype).view(-1)
+        self.num_features = self.x.shape[1]
+
+        self.reg = alpha * torch.eye(self.num_features, dtype=self.dtype, device=self.device)
+        self.reg[-1, -1] = 0.0
+        self.gram = self.x.T @ self.x
+        self.xty = self.x.T @ self.y
+        self.chol = torch.linalg.cholesky(self.gram + self.reg)
+        self.coef = None
+
+    def _add_bias(self, x: torch.Tensor) -> torch.Tensor:
+        x = torch.as_tensor(x).to(self.device, self.dtype)
+        return torch.cat([x, torch.ones(x.shape[0], 1, dtype=self.dtype, device=self.device)], dim=1)
+
+    def fit(self, sample_weight=None, idx=None) -> torch.Tensor:
+        """
+        Solve the weighted least squares problem.
+        Args:
+            sample_weight: Sample weight for each (indexed) data
+            idx: Indices of the training rows to use
+        Returns:
+            torch.Tensor: Coefficients (bias last)
+        """
+        weight = torch.zeros(self.x.shape[0], dtype=self.dtype, device=self.device)
+        if sample_weight is None:
+            sample_weight = 1.0
+        else:
+            sample_weight = torch.as_tensor(sample_weight).detach().to(self.device, self.dtype).view(-1)
+        if idx is None:
+            weight[:] = sample_weight
+        else:
+            weight[torch.as_tensor(idx, dtype=torch.long, device=self.device)] = sample_weight
+
+        is_binary = bool(torch.all((weight == 0) | (weight == 1)))
+        if is_binary:
+            dropped = torch.nonzero(weight == 0).view(-1)
+            num_dropped = dropped.shape[0]
+            if num_dropped == 0:
+                self.coef = torch.cholesky_solve(self.xty.view(-1, 1), self.chol).view(-1)
+            elif num_dropped < self.num_features:
+                self.coef = self._woodbury_downdate(dropped)
+            else:
+                selected = torch.nonzero(weight).view(-1)
+                if num_dropped < selected.shape[0]:
+                    x_drop = self.x[dropped]
+                    gram = self.gram - x_drop.T @ x_drop
+                    xty = self.xty - x_drop.T @ self.y[dropped]
+                else:
+                    x_sel = self.x[selected]
+                    gram = x_sel.T @ x_sel
+                    xty = x_sel.T @ self.y[selected]
+                self.coef = self._solve(gram, xty)
+        else:
+            x_weighted = self.x * weight.view(-1, 1)
+            self.coef = self._solve(x_weighted.T @ self.x, x_weighted.T @ self.y)
+
+        return self.coef
+
+    def _solve(self, gram: torch.Tensor, xty: torch.Tensor) -> torch.Tensor:
+        chol = torch.linalg.cholesky(gram + self.reg)
+        return torch.cholesky_solve(xty.view(-1, 1), chol).view(-1)
+
+    def _woodbury_downdate(self, dropped: torch.Tensor) -> torch.Tensor:
+        """
+        Solve (G + R - U^T U) w = X^T y - U^T y_U for the dropped rows U using
+        the cached Cholesky factor of G + R.
+        """
+        x_drop = self.x[dropped]
+        rhs = self.xty - x_drop.T @ self.y[dropped]
+        base = torch.cholesky_solve(rhs.view(-1, 1), self.chol)
+        z = torch.cholesky_solve(x_drop.T, self.chol)
+        capacitance = torch.eye(x_drop.shape[0], dtype=self.dtype, device=self.device) - x_drop @ z
+        correction = z @ torch.linalg.solve(capacitance, x_drop @ base)
+        return (base + correction).view(-1)
+
+    def predict(self, x_test: torch.Tensor) -> torch.Tensor:
+        """
+        Predict with the fitted coefficients.
+        Args:
+            x_test: Test data
+        Returns:
+            torch.Tensor: Predicted results clipped to the normalized score range (N, 1)
+        """
+        y_pred = self._add_bias(x_test) @ self.coef
+        return torch.clamp(y_pred, 0.0, 1.0).float().view(-1, 1)
+
+    def leave_one_out(self, x_test: torch.Tensor, chunk_size: int = 1024) -> torch.Tensor:
+        """
+        Predict the test data with the models refit without each training
+        row, all from the full fit via the hat-matrix identity
+            w_{-i} = w - A^{-1} x_i r_i / (1 - h_ii),  h_ii = x_i^T A^{-1} x_i
+        with A = X^T X + R and r_i the training residual of row i.
+        Args:
+            x_test: Test data
+            chunk_size: Training rows handled at once
+        Returns:
+            torch.Tensor: Predicted results without each row, clipped to the normalized score range (N, N_test)
+        """
+        self.coef = torch.cholesky_solve(self.xty.view(-1, 1), self.chol).view(-1)
+        x_test = self._add_bias(x_test)
+        y_pred = x_test @ self.coef
+        y_pred_loo = torch.empty(self.x.shape[0], x_test.shape[0], dtype=self.dtype, device=self.device)
+        for start in range(0, self.x.shape[0], chunk_size):
+            x_chunk = self.x[start:start + chunk_size]
+            z = torch.cholesky_solve(x_chunk.T, self.chol)
+            leverage = torch.sum(x_chunk * z.T, dim=1)
+            residual = self.y[start:start + chunk_size] - x_chunk @ self.coef
+            y_pred_loo[start:start + chunk_size] = y_pred - (x_test @ z).T * (residual / (1 - leverage)).view(-1, 1)
+        return torch.clamp(y_pred_loo, 0.0, 1.0).float()
@@ -0,0 +1,113 @@
+"""Process pool for asynchronous DVRL rollouts on multi-core CPU hosts"""
+
+import copy
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+
+from utils.inner_trainer import InnerTrainer
+
+
+# Per-process state set up once by the pool initializer
+_worker_state = {}
+
+
+def _init_worker(
+        pred_model: nn.Module,
+        init_state: dict,
+        x_train: torch.Tensor,
+        y_train: torch.Tensor,
+        x_dev: torch.Tensor,
+        batch_size: int,
+        epochs: int
+        ) -> None:
+    # one core per worker: a small MLP does not benefit from intra-op threads
+    torch.set_num_threads(1)
+    _worker_state['trainer'] = InnerTrainer(pred_model, x_train, y_train, batch_size, epochs, torch.device('cpu'), x_dev=x_dev)
+    _worker_state['init_state'] = init_state
+
+
+def _run_rollout(batch_idx: np.ndarray, sel_prob: np.ndarray, seed: int) -> np.ndarray:
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    trainer = _worker_state['trainer']
+    trainer.reset(_worker_state['init_state'])
+    trainer.fit(sel_prob, idx=batch_idx)
+    return trainer.predict().numpy()
+
+
+class RolloutPool(object):
+    """
+    Pool of single-threaded CPU workers that retrain the inner predictor on a
+    selection mask and return its predictions on the dev data. The source and
+    dev data are placed in shared memory once, so workers do not copy them.
+    """
+
+    def __init__(
+        self,
+        pred_model: nn.Module,
+        init_state: dict,
+        x_train: np.ndarray,
+        y_train: np.ndarray,
+        x_dev: np.ndarray,
+        batch_size: int,
+        epochs: int,
+        num_workers: int,
+        seed: int
+    ) -> None:
+        """
+        Args:
+            pred_model: Prediction model
+            init_state: Initial weights of the predictor
+            x_train: Training data
+            y_train: Training labels
+            x_dev: Validation data
+            batch_size: Batch size of the inner training
+            epochs: Number of epochs of the inner training
+            num_workers: Number of worker processes
+            seed: Seed of the per-rollout random streams
+        """
+        x_train = torch.as_tensor(x_train, dtype=torch.float).cpu().share_memory_()
+        y_train = torch.as_tensor(y_train, dtype=torch.float).cpu().share_memory_()
+        x_dev = torch.as_tensor(x_dev, dtype=torch.float).cpu().share_memory_()
+        init_state = {name: value.detach().cpu() for name, value in init_state.items()}
+
+        self.seed = seed
+        self.num_workers = num_workers
+        self.pending = {}
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(copy.deepcopy(pred_model).cpu(), init_state, x_train, y_train, x_dev, batch_size, epochs)
+        )
+
+    def submit(self, task_id: int, batch_idx: np.ndarray, sel_prob: np.ndarray) -> None:
+        """
+        Queue one rollout.
+        Args:
+            task_id: Rollout id (also selects its random stream)
+            batch_idx: Indices of the batch rows in the training data
+            sel_prob: Selection mask over the batch
+        """
+        # the stream depends on the rollout, not on the worker that runs it
+        seed = int(np.random.SeedSequence([self.seed, task_id]).generate_state(1)[0])
+        future = self.executor.submit(_run_rollout, np.asarray(batch_idx), np.asarray(sel_prob), seed)
+        self.pending[future] = task_id
+
+    def num_pending(self) -> int:
+        return len(self.pending)
+
+    def wait_any(self) -> list:
+        """
+        Wait until at least one rollout finishes.
+        Returns:
+            list: (task_id, predicted validation labels) of the finished rollouts
+        """
+        done, _ = wait(list(self.pending), return_when=FIRST_COMPLETED)
+        return [(self.pending.pop(future), future.result()) for future in done]
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,338 @@
+"""Truncated Monte Carlo Data Shapley over the source essays"""
+
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from tqdm import tqdm
+
+from utils.dvrl_utils import save_checkpoint, load_checkpoint
+from utils.inner_trainer import InnerTrainer
+
+
+class IncrementalRidge(object):
+    """
+    Ridge regression grown one block of rows at a time, with an unpenalized
+    bias like WeightedRidge. The inverse P of X^T X + alpha * I over the
+    features is kept and updated with the Woodbury identity, and the bias is
+    solved from the bordered system
+        [[P^{-1}, s], [s^T, n]] [w; b] = [X^T y; 1^T y]
+    (s the feature sums, n the row count) through its Schur complement, so
+    adding b rows costs O(b D^2) instead of a new solve. The empty model
+    predicts 0.
+    """
+
+    def __init__(self, x_train: torch.Tensor, y_train: torch.Tensor, alpha: float = 1.0) -> None:
+        """
+        Args:
+            x_train: Training data (N, D)
+            y_train: Training labels (N,)
+            alpha: L2 regularization strength
+        """
+        self.device = x_train.device
+        self.dtype = torch.float32 if self.device.type == 'mps' else torch.float64
+        self.x = x_train.to(self.device, self.dtype)
+        self.y = y_train.to(self.device, self.dtype).view(-1)
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self) -> None:
+        num_features = self.x.shape[1]
+        self.inv = torch.eye(num_features, dtype=self.dtype, device=self.device) / self.alpha
+        self.xty = torch.zeros(num_features, dtype=self.dtype, device=self.device)
+        self.x_sum = torch.zeros(num_features, dtype=self.dtype, device=self.device)
+        self.y_sum = 0.0
+        self.count = 0
+        # coefficients with the bias last, as in WeightedRidge
+        self.coef = torch.zeros(num_features + 1, dtype=self.dtype, device=self.device)
+
+    def add(self, idx: torch.Tensor) -> None:
+        """
+        Add training rows and refit.
+        Args:
+            idx: Indices of the rows to add
+        """
+        x_add = self.x[idx]
+        z = self.inv @ x_add.T
+        capacitance = torch.eye(x_add.shape[0], dtype=self.dtype, device=self.device) + x_add @ z
+        self.inv -= z @ torch.linalg.solve(capacitance, z.T)
+        self.xty += x_add.T @ self.y[idx]
+        self.x_sum += x_add.sum(dim=0)
+        self.y_sum += self.y[idx].sum().item()
+        self.count += x_add.shape[0]
+
+        # Schur complement n - s^T P s is positive for alpha > 0
+        inv_x_sum = self.inv @ self.x_sum
+        bias = (self.y_sum - inv_x_sum @ self.xty) / (self.count - self.x_sum @ inv_x_sum)
+        self.coef = torch.cat([self.inv @ self.xty - inv_x_sum * bias, bias.view(1)])
+
+    def predict(self, x_test: torch.Tensor) -> torch.Tensor:
+        y_pred = x_test.to(self.device, self.dtype) @ self.coef[:-1] + self.coef[-1]
+        return torch.clamp(y_pred, 0.0, 1.0).float().view(-1, 1)
+
+
+class PermutationRunner(object):
+    """
+    Walk one random permutation of the source, adding block_size rows at a
+    time to an incrementally trained learner and recording the change of
+    the dev score. The walk is truncated once the score is within the
+    tolerance of the full-data score; the remaining rows get zero.
+    The learner is 'ridge' (IncrementalRidge on the embeddings) or 'mlp'
+    (the predictor fine-tuned for mlp_epochs on each new block only,
+    starting from the previous prefix's weights, so a permutation costs
+    O(N mlp_epochs) sample updates rather than O(N^2) for refitting every
+    prefix). The
+    full-data score is that of the same incremental schedule walked to the
+    full prefix, so the truncation compares like with like; it is computed
+    once by full_walk_score and handed to every runner.
+    """
+
+    def __init__(
+        self,
+        x_train: torch.Tensor,
+        y_train: torch.Tensor,
+        x_dev: torch.Tensor,
+        y_dev: torch.Tensor,
+        pred_model: nn.Module,
+        init_state: dict,
+        parameters: dict,
+        device: torch.device,
+        full_score: float = None
+    ) -> None:
+        """
+        Args:
+            x_train: Training data
+            y_train: Training labels
+            x_dev: Validation data
+            y_dev: Validation labels
+            pred_model: Prediction model (mlp learner)
+            init_state: Initial weights of the predictor
+            parameters: Parameters for TMC-Shapley (see TmcShapley)
+            device: Device to run the learner
+            full_score: Dev score of the full source (required by run)
+        """
+        self.learner = parameters.get('learner', 'ridge')
+        self.block_size = parameters.get('block_size', 1)
+        self.tolerance = parameters.get('truncation_tolerance', 0.01)
+        self.mlp_epochs = parameters.get('mlp_epochs', 1)
+        self.num_samples = x_train.shape[0]
+        self.x_dev = x_dev.to(device)
+        self.y_dev = y_dev.to(device).float().view(-1, 1)
+        self.init_state = init_state
+        self.device = device
+        if self.learner == 'ridge':
+            self.ridge = IncrementalRidge(x_train.to(device), y_train.to(device), parameters.get('ridge_alpha', 1.0))
+        else:
+            self.trainer = InnerTrainer(pred_model, x_train, y_train, parameters.get('batch_size', 256), self.mlp_epochs, device, x_dev=x_dev)
+        self.full_score = full_score
+
+    def _score(self) -> float:
+        # negative dev MSE, so a positive marginal contribution helps
+        if self.learner == 'ridge':
+            y_pred = self.ridge.predict(self.x_dev)
+        else:
+            y_pred = self.trainer.predict()
+        return -torch.mean((y_pred.view(-1, 1) - self.y_dev) ** 2).item()
+
+    def _reset(self) -> float:
+        if self.learner == 'ridge':
+            self.ridge.reset()
+        else:
+            self.trainer.reset(self.init_state)
+        return self._score()
+
+    def _walk(self, seed: int, truncate: bool) -> tuple:
+        rng = np.random.default_rng(seed)
+        torch.manual_seed(seed)
+        perm = rng.permutation(self.num_samples)
+        marginals = np.zeros(self.num_samples)
+        score = self._reset()
+        for start in range(0, self.num_samples, self.block_size):
+            if truncate and abs(self.full_score - score) <= self.tolerance * abs(self.full_score):
+                return marginals, start, score
+            block = perm[start:start + self.block_size]
+            if self.learner == 'ridge':
+                self.ridge.add(torch.as_tensor(block, device=self.device))
+            else:
+                self.trainer.fit(idx=block, epochs=self.mlp_epochs)
+            new_score = self._score()
+            # the rows of a block share its contribution
+            marginals[block] = (new_score - score) / len(block)
+            score = new_score
+        return marginals, self.num_samples, score
+
+    def full_walk_score(self, seed: int) -> float:
+        """
+        Walk one permutation to the full prefix without truncation.
+        Args:
+            seed: Seed of the permutation and of the learner
+        Returns:
+            float: Dev score of the learner grown on the full source
+        """
+        return self._walk(seed, truncate=False)[2]
+
+    def run(self, seed: int) -> tuple:
+        """
+        Args:
+            seed: Seed of the permutation and of the learner
+        Returns:
+            tuple: Marginal contribution of each source row (N,) and number of rows added before truncation
+        """
+        marginals, num_added, _ = self._walk(seed, truncate=True)
+        return marginals, num_added
+
+
+# Per-process state set up once by the pool initializer
+_worker_state = {}
+
+
+def _init_worker(*args) -> None:
+    # args: the PermutationRunner arguments up to parameters, then the full-data score
+    torch.set_num_threads(1)
+    _worker_state['runner'] = PermutationRunner(*args[:-1], torch.device('cpu'), full_score=args[-1])
+
+
+def _run_permutation(seed: int) -> tuple:
+    return _worker_state['runner'].run(seed)
+
+
+class TmcShapley(object):
+    """
+    Truncated Monte Carlo estimate of the Data Shapley value of each
+    source row (Ghorbani & Zou, 2019): the mean marginal contribution over
+    random permutations. Permutations run in this process or in a pool of
+    single-threaded CPU workers; the running sums are checkpointed so an
+    interrupted run resumes with the permutations still missing.
+    """
+
+    def __init__(
+        self,
+        x_train: np.ndarray,
+        y_train: np.ndarray,
+        x_dev: np.ndarray,
+        y_dev: np.ndarray,
+        pred_model: nn.Module,
+        parameters: dict,
+        device: torch.device
+    ) -> None:
+        """
+        Args:
+            x_train: Training data
+            y_train: Training labels
+            x_dev: Validation data
+            y_dev: Validation labels
+            pred_model: Prediction model (mlp learner)
+            parameters: Parameters for TMC-Shapley
+                learner ('ridge' or 'mlp'), num_permutations, truncation_tolerance,
+                block_size, mlp_epochs, batch_size, ridge_alpha,
+                num_workers, seed, checkpoint_path, checkpoint_interval
+            device: Device to run the learner (when num_workers is 0)
+        """
+        if parameters.get('learner', 'ridge') not in ['ridge', 'mlp']:
+            raise ValueError(f'Unknown learner: {parameters.get("learner")}')
+        self.parameters = parameters
+        self.num_permutations = parameters.get('num_permutations', 500)
+        self.num_workers = parameters.get('num_workers', 0)
+        self.seed = parameters.get('seed', 0)
+        self.checkpoint_path = parameters.get('checkpoint_path', None)
+        self.checkpoint_interval = parameters.get('checkpoint_interval', 50)
+        self.device = device
+
+        self.x_train = torch.as_tensor(x_train, dtype=torch.float)
+        self.y_train = torch.as_tensor(y_train, dtype=torch.float).view(-1)
+        self.x_dev = torch.as_tensor(x_dev, dtype=torch.float)
+        self.y_dev = torch.as_tensor(y_dev, dtype=torch.float).view(-1)
+        self.pred_model = pred_model
+        self.init_state = {name: value.detach().cpu() for name, value in pred_model.state_dict().items()}
+
+        self.value_sum = np.zeros(len(self.y_train))
+        self.completed = set()
+        self.truncation = []
+        self.full_score = None
+
+    def _seed(self, permutation_id: int) -> int:
+        # the stream depends on the permutation, not on the worker that runs it
+        return int(np.random.SeedSequence([self.seed, permutation_id]).generate_state(1)[0])
+
+    def _record(self, permutation_id: int, marginals: np.ndarray, num_added: int) -> None:
+        self.value_sum += marginals
+        self.completed.add(permutation_id)
+        self.truncation.append(num_added)
+        if self.checkpoint_path is not None and len(self.completed) % self.checkpoint_interval == 0:
+            self.save()
+
+    def values(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Running estimate of the data value of each source row (N, 1)
+        """
+        return (self.value_sum / max(1, len(self.completed))).reshape(-1, 1)
+
+    def save(self) -> None:
+        save_checkpoint({
+            'value_sum': self.value_sum,
+            'completed': sorted(self.completed),
+            'truncation': self.truncation,
+            'full_score': self.full_score
+        }, self.checkpoint_path)
+
+    def run(self, resume: bool = False) -> np.ndarray:
+        """
+        Run the missing permutations.
+        Args:
+            resume: Continue from the checkpoint at checkpoint_path
+        Returns:
+            np.ndarray: Estimated data value of each source row (N, 1)
+        """
+        if resume and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            checkpoint = load_checkpoint(self.checkpoint_path)
+            self.value_sum = checkpoint['value_sum']
+            self.completed = set(checkpoint['completed'])
+            self.truncation = checkpoint['truncation']
+            self.full_score = checkpoint.get('full_score', None)
+            print(f'Resuming TMC-Shapley after {len(self.completed)} permutations')
+        todo = [i for i in range(self.num_permutations) if i not in self.completed]
+        runner_args = (self.x_train, self.y_train, self.x_dev, self.y_dev, self.pred_model, self.init_state, self.parameters)
+
+        # the truncation target: one seeded walk of the same incremental schedule to the full
+        # prefix, computed once here (on the workers' device when they run the permutations)
+        runner_device = torch.device('cpu') if self.num_workers > 0 else self.device
+        runner = PermutationRunner(*runner_args[:4], copy.deepcopy(self.pred_model), *runner_args[5:], runner_device)
+        if self.full_score is None:
+            self.full_score = runner.full_walk_score(int(np.random.SeedSequence(self.seed).generate_state(1)[0]))
+        runner.full_score = self.full_score
+        print(f'Full-data score: {self.full_score:.5f}')
+
+        progress_bar = tqdm(initial=len(self.completed), total=self.num_permutations)
+        if self.num_workers > 0:
+            for tensor in (self.x_train, self.y_train, self.x_dev, self.y_dev):
+                tensor.share_memory_()
+            executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=mp.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.x_train, self.y_train, self.x_dev, self.y_dev, copy.deepcopy(self.pred_model).cpu(), self.init_state, self.parameters, self.full_score)
+            )
+            try:
+                pending = {executor.submit(_run_permutation, self._seed(i)): i for i in todo}
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._record(pending.pop(future), *future.result())
+                        progress_bar.update(1)
+            finally:
+                executor.shutdown(cancel_futures=True)
+        else:
+            for i in todo:
+                self._record(i, *runner.run(self._seed(i)))
+                progress_bar.update(1)
+        progress_bar.close()
+
+        if self.checkpoint_path is not None:
+            self.save()
+        if self.truncation:
+            print(f'Mean rows added before truncation: {np.mean(self.truncation):.1f} / {len(self.y_train)}')
+        return self.values()
@@ -0,0 +1,89 @@
+"""TracIn data valuation from checkpoints of the predictor training"""
+
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.func import functional_call, grad, vmap
+
+from utils.inner_trainer import to_device_tensors
+
+
+class TracIn(object):
+    """
+    Trace the influence of each source row on the dev loss through the
+    recorded training checkpoints (Pruthi et al., 2020):
+        value_i = sum_c lr_c * grad loss_i(w_c) . grad loss_dev(w_c)
+    where loss_dev is the mean squared error on the dev data. A positive
+    value means that the row's updates lowered the dev loss. Per-sample
+    gradients are computed in chunks with torch.func (vmap of grad); for
+    models whose layers have no batching rule (e.g. the LSTM of PAES) the
+    chunk falls back to one backward pass per row.
+    """
+
+    def __init__(self, model: nn.Module, checkpoints: list, device: torch.device, chunk_size: int = 64) -> None:
+        """
+        Args:
+            model: Prediction model (its weights are replaced by each checkpoint)
+            checkpoints: Snapshots recorded by fit_func / fit_func_for_PAES (epoch, state_dict, lr)
+            device: Device to run the model
+            chunk_size: Source rows per batch of per-sample gradients
+        """
+        if not checkpoints:
+            raise ValueError('TracIn needs at least one checkpoint')
+        self.model = copy.deepcopy(model).to(device)
+        self.checkpoints = checkpoints
+        self.device = device
+        self.chunk_size = chunk_size
+        self.use_vmap = True
+
+    def _loss(self, params: dict, x: list, y: torch.Tensor) -> torch.Tensor:
+        y_pred = functional_call(self.model, params, tuple(x))
+        return torch.sum((y_pred.view(-1) - y) ** 2)
+
+    def _sample_loss(self, params: dict, x: list, y: torch.Tensor) -> torch.Tensor:
+        return self._loss(params, [x_input.unsqueeze(0) for x_input in x], y.unsqueeze(0))
+
+    def _sample_dots(self, params: dict, x: list, y: torch.Tensor, direction: dict) -> torch.Tensor:
+        # per-sample gradient of each row projected on the direction
+        if self.use_vmap:
+            try:
+                sample_gradients = vmap(grad(self._sample_loss), in_dims=(None, 0, 0))(params, x, y)
+                return sum(sample_gradients[name].reshape(len(y), -1) @ direction[name].reshape(-1) for name in direction)
+            except RuntimeError:
+                self.use_vmap = False
+        dots = torch.empty(len(y), device=self.device)
+        for i in range(len(y)):
+            sample_gradient = grad(self._sample_loss)(params, [x_input[i] for x_input in x], y[i])
+            dots[i] = sum(torch.sum(sample_gradient[name] * direction[name]) for name in direction)
+        return dots
+
+    def values(self, x_train, y_train: np.ndarray, x_dev, y_dev: np.ndarray) -> np.ndarray:
+        """
+        Value every source row.
+        Args:
+            x_train: Training data (array or list of model inputs)
+            y_train: Training labels
+            x_dev: Validation data (array or list of model inputs)
+            y_dev: Validation labels
+        Returns:
+            np.ndarray: Data value of each source row (N, 1)
+        """
+        x_train = to_device_tensors(x_train, self.device)
+        y_train = torch.as_tensor(y_train, dtype=torch.float).view(-1).to(self.device)
+        x_dev = to_device_tensors(x_dev, self.device)
+        y_dev = torch.as_tensor(y_dev, dtype=torch.float).view(-1).to(self.device)
+
+        # gradients in eval mode, so dropout does not add noise to the traces
+        self.model.eval()
+        data_value = torch.zeros(len(y_train), device=self.device)
+        for checkpoint in self.checkpoints:
+            self.model.load_state_dict(checkpoint['state_dict'])
+            params = {name: value.detach() for name, value in self.model.named_parameters()}
+            dev_gradient = grad(self._loss)(params, x_dev, y_dev)
+            dev_gradient = {name: value / len(y_dev) for name, value in dev_gradient.items()}
+            for start in range(0, len(y_train), self.chunk_size):
+                end = start + self.chunk_size
+                dots = self._sample_dots(params, [x_input[start:end] for x_input in x_train], y_train[start:end], dev_gradient)
+                data_value[start:end] += checkpoint['lr'] * dots
+        return data_value.cpu().numpy().reshape(-1, 1)
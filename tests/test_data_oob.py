@@ -0,0 +1,22 @@
+"""Out-of-bag bookkeeping of Data-OOB"""
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from dvrl.data_oob import DataOob
+
+
+def test_untrained_bags_value_rows_by_their_error():
+    # without training every bag predicts with the initial weights, so the mean
+    # out-of-bag score of a row is its own negative squared error
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    model = nn.Linear(3, 1)
+    x_train, y_train = rng.normal(size=(10, 3)).astype(np.float32), rng.uniform(size=10).astype(np.float32)
+    parameters = {'num_bags': 30, 'bags_per_batch': 7, 'epochs': 0, 'seed': 0}
+    values = DataOob(x_train, y_train, model, parameters, torch.device('cpu')).values().reshape(-1)
+
+    with torch.no_grad():
+        expected = -(model(torch.as_tensor(x_train)).view(-1).numpy() - y_train) ** 2
+    np.testing.assert_allclose(values, expected, rtol=1e-5, atol=1e-7)
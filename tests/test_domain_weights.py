@@ -0,0 +1,33 @@
+"""Domain-classifier importance weights and label residuals"""
+
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.model_selection import KFold, cross_val_predict
+
+from dvrl.domain_weights import importance_weights, label_residuals, combined_score
+
+
+def test_label_residuals_match_cross_val_predict():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(40, 4))
+    y = x @ rng.normal(size=4) + rng.normal(scale=0.1, size=40)
+    expected = np.abs(y - cross_val_predict(Ridge(alpha=0.5), x, y, cv=KFold(5, shuffle=True, random_state=3)))
+    np.testing.assert_allclose(label_residuals(x, y, num_folds=5, seed=3, alpha=0.5), expected)
+
+
+def test_importance_weights_favour_target_like_rows():
+    rng = np.random.default_rng(1)
+    x_source = np.concatenate([rng.normal(loc=0.0, size=(100, 2)), rng.normal(loc=3.0, size=(100, 2))])
+    x_target = rng.normal(loc=3.0, size=(100, 2))
+    weights = importance_weights(x_source, x_target, seed=1)
+    assert weights.shape == (200,)
+    assert weights[100:].mean() > 10 * weights[:100].mean()
+    # the weights average to about one over the source
+    assert 0.5 < weights.mean() < 2.0
+
+
+def test_combined_score_penalizes_noisy_rows():
+    weights = np.ones(4)
+    residuals = np.array([0.0, 0.1, 0.2, 1.0])
+    score = combined_score(weights, residuals).reshape(-1)
+    assert np.argsort(-score).tolist() == [0, 1, 2, 3]
@@ -0,0 +1,25 @@
+"""Batched QWK kernel against the sklearn reference"""
+
+import numpy as np
+import pytest
+import torch
+
+from utils.dvrl_utils import calc_qwk, QWKKernel, batched_performance
+from utils.general_utils import get_min_max_scores
+
+
+@pytest.mark.parametrize('prompt_id', [1, 3, 7])
+def test_qwk_kernel_matches_calc_qwk(prompt_id):
+    rng = np.random.default_rng(prompt_id)
+    minscore, maxscore = get_min_max_scores()[prompt_id]['score']
+    y_true = (rng.integers(minscore, maxscore + 1, size=50) - minscore) / (maxscore - minscore)
+    # predictions slightly outside [0, 1] round to labels outside the prompt's range
+    y_pred = rng.uniform(-0.1, 1.1, size=(6, 50))
+
+    kernel = QWKKernel(y_true, prompt_id, 'score')
+    expected = [calc_qwk(y_true, y, prompt_id, 'score') for y in y_pred]
+    np.testing.assert_allclose(kernel(y_pred).numpy(), expected, atol=1e-10)
+
+    y_true_tensor = torch.as_tensor(y_true, dtype=kernel.dtype)
+    batched = batched_performance(torch.as_tensor(y_pred).unsqueeze(-1), y_true_tensor, 'qwk', kernel)
+    np.testing.assert_allclose(batched.numpy(), expected, atol=1e-10)
@@ -0,0 +1,74 @@
+"""Curvature products and inverse solvers of the influence functions"""
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from torch.autograd.functional import hessian, jacobian
+
+from dvrl.influence import InfluenceFunction
+
+
+@pytest.fixture
+def influence_args():
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    model = nn.Sequential(nn.Linear(3, 4), nn.Tanh(), nn.Linear(4, 1)).double()
+    x = rng.normal(size=(20, 3))
+    y = rng.uniform(size=20)
+    return model, x, y
+
+
+def _dense(influence):
+    # the damped curvature matrix, one product per unit vector
+    eye = torch.eye(len(influence.theta), dtype=influence.theta.dtype)
+    return torch.stack([influence.hvp(column) for column in eye], dim=1)
+
+
+def _to_double(influence):
+    influence.x_train, influence.y_train = influence.x_train.double(), influence.y_train.double()
+    return influence
+
+
+def test_gauss_newton_product(influence_args):
+    model, x, y = influence_args
+    influence = _to_double(InfluenceFunction(model, x, y, torch.device('cpu'), damping=0.01, chunk_size=7))
+    jac = jacobian(lambda vec: influence._output(vec, influence.x_train), influence.theta)
+    expected = 2 * jac.T @ jac / len(y) + 0.01 * torch.eye(len(influence.theta), dtype=torch.double)
+    np.testing.assert_allclose(_dense(influence).numpy(), expected.numpy(), atol=1e-10)
+
+
+def test_hessian_product(influence_args):
+    model, x, y = influence_args
+    influence = _to_double(InfluenceFunction(model, x, y, torch.device('cpu'), damping=0.01, chunk_size=7, curvature='hessian'))
+    expected = hessian(lambda vec: influence._loss(vec, influence.x_train, influence.y_train), influence.theta) / len(y)
+    expected += 0.01 * torch.eye(len(influence.theta), dtype=torch.double)
+    np.testing.assert_allclose(_dense(influence).numpy(), expected.numpy(), atol=1e-10)
+
+
+def test_cg_matches_direct_solve(influence_args):
+    model, x, y = influence_args
+    influence = _to_double(InfluenceFunction(model, x, y, torch.device('cpu'), damping=0.01))
+    b = torch.as_tensor(np.random.default_rng(1).normal(size=len(influence.theta)))
+    expected = torch.linalg.solve(_dense(influence), b)
+    np.testing.assert_allclose(influence.solve_cg(b, max_iterations=200, tol=1e-10).numpy(), expected.numpy(), rtol=1e-6, atol=1e-8)
+
+
+def test_cg_stops_on_negative_curvature(influence_args):
+    model, x, y = influence_args
+    influence = InfluenceFunction(model, x, y, torch.device('cpu'))
+    influence.hvp = lambda v, idx=None: -v
+    with pytest.raises(ValueError, match='negative curvature'):
+        influence.solve_cg(torch.ones(len(influence.theta), dtype=torch.double))
+
+
+def test_lissa_converges_to_the_inverse(influence_args):
+    model, x, y = influence_args
+    influence = InfluenceFunction(model, x, y, torch.device('cpu'))
+    rng = np.random.default_rng(2)
+    basis = torch.as_tensor(np.linalg.qr(rng.normal(size=(len(influence.theta),) * 2))[0])
+    matrix = basis @ torch.diag(torch.linspace(0.5, 4.0, len(influence.theta), dtype=torch.double)) @ basis.T
+    # a fixed matrix in place of the minibatch curvature, so the recursion is deterministic
+    influence.hvp = lambda v, idx=None: matrix @ v
+    b = torch.as_tensor(rng.normal(size=len(influence.theta)))
+    np.testing.assert_allclose(influence.solve_lissa(b, depth=300, scale=5.0, batch_size=4).numpy(), torch.linalg.solve(matrix, b).numpy(), atol=1e-8)
@@ -0,0 +1,42 @@
+"""KNN-Shapley recursion against brute-force Shapley values"""
+
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from dvrl.knn_shapley import knn_shapley
+
+
+def _brute_force_shapley(x_train, y_train, x_dev, y_dev, k, label_tolerance):
+    num_samples = len(y_train)
+
+    def utility(subset):
+        total = 0.0
+        for x, y in zip(x_dev, y_dev):
+            nearest = sorted(subset, key=lambda i: np.sum((x_train[i] - x) ** 2))[:k]
+            total += sum(abs(y_train[i] - y) <= label_tolerance for i in nearest) / k
+        return total / len(y_dev)
+
+    values = np.zeros(num_samples)
+    for i in range(num_samples):
+        others = [j for j in range(num_samples) if j != i]
+        for size in range(num_samples):
+            weight = math.factorial(size) * math.factorial(num_samples - size - 1) / math.factorial(num_samples)
+            for subset in itertools.combinations(others, size):
+                values[i] += weight * (utility(subset + (i,)) - utility(subset))
+    return values
+
+
+@pytest.mark.parametrize('num_samples,k', [(5, 1), (7, 3), (6, 6), (3, 5), (8, 10)])
+def test_knn_shapley_matches_brute_force(num_samples, k):
+    rng = np.random.default_rng(num_samples)
+    x_train = rng.normal(size=(num_samples, 3)).astype(np.float32)
+    y_train = rng.choice([0.0, 0.5, 1.0], size=num_samples)
+    x_dev = rng.normal(size=(4, 3)).astype(np.float32)
+    y_dev = rng.choice([0.0, 0.5, 1.0], size=4)
+
+    values = knn_shapley(x_train, y_train, x_dev, y_dev, k=k, label_tolerance=0.05, chunk_size=3)
+    expected = _brute_force_shapley(x_train, y_train, x_dev, y_dev, k, 0.05)
+    np.testing.assert_allclose(values.reshape(-1), expected, atol=1e-5)
@@ -0,0 +1,27 @@
+"""Sinkhorn solver and LAVA values"""
+
+import numpy as np
+import torch
+
+from dvrl.lava import sinkhorn, lava
+
+
+def test_sinkhorn_coupling_has_uniform_marginals():
+    rng = np.random.default_rng(0)
+    cost = torch.as_tensor(rng.uniform(size=(12, 7)), dtype=torch.float)
+    f, g, eps = sinkhorn(cost, epsilon=0.1, max_iterations=2000, tol=1e-7)
+    coupling = torch.exp((f[:, None] + g[None, :] - cost) / eps) / (12 * 7)
+    np.testing.assert_allclose(coupling.sum(dim=1).numpy(), np.full(12, 1 / 12), rtol=1e-3)
+    np.testing.assert_allclose(coupling.sum(dim=0).numpy(), np.full(7, 1 / 7), rtol=1e-3)
+
+
+def test_lava_ranks_far_rows_last():
+    rng = np.random.default_rng(1)
+    x_dev = rng.normal(size=(20, 3))
+    y_dev = rng.uniform(size=20)
+    # rows near the dev essays with matching labels, then rows far from them
+    x_train = np.concatenate([x_dev[:10] + rng.normal(scale=0.1, size=(10, 3)), rng.normal(loc=5.0, size=(5, 3))])
+    y_train = np.concatenate([y_dev[:10], rng.uniform(size=5)])
+    values = lava(x_train, y_train, x_dev, y_dev).reshape(-1)
+    assert values[:10].min() > values[10:].max()
+    np.testing.assert_allclose(values.sum(), 0.0, atol=1e-4)
@@ -0,0 +1,61 @@
+"""Exact prompt-level Shapley and Banzhaf sums against brute force"""
+
+import itertools
+import math
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from dvrl.prompt_shapley import PromptShapley
+
+
+def _prompt_shapley(scores, prompts):
+    rng = np.random.default_rng(0)
+    source_prompt = np.repeat(prompts, 3)
+    x_train = rng.normal(size=(len(source_prompt), 2))
+    y_train = rng.uniform(size=len(source_prompt))
+    prompt_shapley = PromptShapley(x_train, y_train, source_prompt, x_train[:4], y_train[:4], nn.Linear(2, 1), {}, torch.device('cpu'))
+    # every coalition is already scored, so values() trains nothing
+    prompt_shapley.scores = dict(scores)
+    return prompt_shapley
+
+
+def _brute_force(scores, num_prompts):
+    shapley = np.zeros(num_prompts)
+    for order in itertools.permutations(range(num_prompts)):
+        coalition = 0
+        for bit in order:
+            shapley[bit] += scores[coalition | 1 << bit] - scores[coalition]
+            coalition |= 1 << bit
+    shapley /= math.factorial(num_prompts)
+    banzhaf = np.array([
+        np.mean([scores[coalition | 1 << bit] - scores[coalition] for coalition in range(2 ** num_prompts) if not coalition >> bit & 1])
+        for bit in range(num_prompts)
+    ])
+    return shapley, banzhaf
+
+
+def test_values_match_brute_force():
+    prompts = [1, 2, 5, 7]
+    rng = np.random.default_rng(1)
+    scores = {coalition: rng.normal() for coalition in range(2 ** len(prompts))}
+    values = _prompt_shapley(scores, prompts).values()
+
+    shapley, banzhaf = _brute_force(scores, len(prompts))
+    np.testing.assert_allclose([values[prompt]['shapley'] for prompt in prompts], shapley)
+    np.testing.assert_allclose([values[prompt]['banzhaf'] for prompt in prompts], banzhaf)
+    # efficiency: the Shapley values share the gain of the full coalition
+    assert np.isclose(sum(values[prompt]['shapley'] for prompt in prompts), scores[15] - scores[0])
+
+
+def test_additive_game_values_are_the_prompt_effects():
+    prompts = [3, 4, 6]
+    effects = np.array([0.3, -0.1, 0.05])
+    scores = {coalition: sum(effects[bit] for bit in range(3) if coalition >> bit & 1) for coalition in range(8)}
+    prompt_shapley = _prompt_shapley(scores, prompts)
+    values = prompt_shapley.values()
+    for bit, prompt in enumerate(prompts):
+        assert np.isclose(values[prompt]['shapley'], effects[bit])
+        assert np.isclose(values[prompt]['banzhaf'], effects[bit])
+    np.testing.assert_allclose(prompt_shapley.essay_values(values).reshape(-1), np.repeat(effects, 3))
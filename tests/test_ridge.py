@@ -0,0 +1,52 @@
+"""WeightedRidge fast paths against explicit refits"""
+
+import numpy as np
+import pytest
+import torch
+
+from dvrl.ridge import WeightedRidge
+
+
+def _explicit_fit(x, y, weight, alpha):
+    x = np.concatenate([x, np.ones((len(x), 1))], axis=1)
+    reg = alpha * np.eye(x.shape[1])
+    reg[-1, -1] = 0.0
+    return np.linalg.solve(x.T @ (weight[:, None] * x) + reg, x.T @ (weight * y))
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(40, 5))
+    y = np.clip(x @ rng.normal(size=5) * 0.1 + 0.5 + rng.normal(scale=0.05, size=40), 0, 1)
+    return x, y
+
+
+@pytest.mark.parametrize('num_dropped', [0, 3, 10, 30])
+def test_fit_binary_mask(data, num_dropped):
+    x, y = data
+    weight = np.ones(len(y))
+    weight[np.random.default_rng(num_dropped).choice(len(y), num_dropped, replace=False)] = 0
+    ridge = WeightedRidge(torch.as_tensor(x), torch.as_tensor(y), alpha=0.5)
+    np.testing.assert_allclose(ridge.fit(torch.as_tensor(weight)).numpy(), _explicit_fit(x, y, weight, 0.5), atol=1e-8)
+
+
+def test_fit_continuous_weights(data):
+    x, y = data
+    weight = np.random.default_rng(1).uniform(size=len(y))
+    ridge = WeightedRidge(torch.as_tensor(x), torch.as_tensor(y), alpha=0.5)
+    np.testing.assert_allclose(ridge.fit(torch.as_tensor(weight)).numpy(), _explicit_fit(x, y, weight, 0.5), atol=1e-8)
+
+
+def test_leave_one_out(data):
+    x, y = data
+    x_test = torch.as_tensor(np.random.default_rng(2).normal(size=(7, 5)))
+    ridge = WeightedRidge(torch.as_tensor(x), torch.as_tensor(y), alpha=0.5)
+    y_pred_loo = ridge.leave_one_out(x_test, chunk_size=16)
+
+    for i in range(len(y)):
+        weight = np.ones(len(y))
+        weight[i] = 0
+        coef = _explicit_fit(x, y, weight, 0.5)
+        expected = np.clip(np.concatenate([x_test.numpy(), np.ones((7, 1))], axis=1) @ coef, 0, 1)
+        np.testing.assert_allclose(y_pred_loo[i].numpy(), expected, atol=1e-5)
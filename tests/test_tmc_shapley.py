@@ -0,0 +1,38 @@
+"""Incremental ridge learner of TMC-Shapley against WeightedRidge"""
+
+import numpy as np
+import pytest
+import torch
+
+from dvrl.ridge import WeightedRidge
+from dvrl.tmc_shapley import IncrementalRidge, PermutationRunner
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    x = torch.as_tensor(rng.normal(size=(30, 4)))
+    y = torch.as_tensor(np.clip(rng.normal(loc=0.5, scale=0.2, size=30), 0, 1))
+    return x, y
+
+
+@pytest.mark.parametrize('block_size', [1, 4])
+def test_incremental_ridge_matches_weighted_ridge(data, block_size):
+    x, y = data
+    perm = np.random.default_rng(block_size).permutation(len(y))
+    incremental = IncrementalRidge(x, y, alpha=0.5)
+    reference = WeightedRidge(x, y, alpha=0.5)
+    for start in range(0, len(y), block_size):
+        incremental.add(torch.as_tensor(perm[start:start + block_size]))
+        expected = reference.fit(idx=perm[:start + block_size])
+        np.testing.assert_allclose(incremental.coef.numpy(), expected.numpy(), atol=1e-8)
+
+
+def test_marginals_sum_to_the_score_gain(data):
+    x, y = data
+    parameters = {'learner': 'ridge', 'block_size': 3, 'ridge_alpha': 0.5}
+    runner = PermutationRunner(x.float(), y.float(), x[:10].float(), y[:10].float(), None, None, parameters, torch.device('cpu'))
+    empty_score = runner._reset()
+    marginals, num_added, score = runner._walk(seed=0, truncate=False)
+    assert num_added == len(y)
+    assert marginals.sum() == pytest.approx(score - empty_score)
@@ -0,0 +1,40 @@
+"""TracIn traces against per-row autograd"""
+
+import copy
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from dvrl.tracin import TracIn
+
+
+def _flat_grad(model, x, y):
+    model.zero_grad()
+    torch.sum((model(x).view(-1) - y) ** 2).backward()
+    return torch.cat([param.grad.reshape(-1) for param in model.parameters()])
+
+
+def test_tracin_matches_per_row_gradients():
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    model = nn.Sequential(nn.Linear(3, 5), nn.ReLU(), nn.Linear(5, 1))
+    x_train, y_train = rng.normal(size=(11, 3)).astype(np.float32), rng.uniform(size=11).astype(np.float32)
+    x_dev, y_dev = rng.normal(size=(6, 3)).astype(np.float32), rng.uniform(size=6).astype(np.float32)
+    checkpoints = []
+    for epoch, lr in [(1, 0.01), (2, 0.005)]:
+        checkpoints.append({'epoch': epoch, 'state_dict': copy.deepcopy(model.state_dict()), 'lr': lr})
+        with torch.no_grad():
+            for param in model.parameters():
+                param.add_(0.1 * torch.randn_like(param))
+
+    values = TracIn(model, checkpoints, torch.device('cpu'), chunk_size=4).values(x_train, y_train, x_dev, y_dev).reshape(-1)
+
+    expected = np.zeros(len(y_train))
+    for checkpoint in checkpoints:
+        model.load_state_dict(checkpoint['state_dict'])
+        dev_gradient = _flat_grad(model, torch.as_tensor(x_dev), torch.as_tensor(y_dev)) / len(y_dev)
+        for i in range(len(y_train)):
+            row_gradient = _flat_grad(model, torch.as_tensor(x_train[i:i + 1]), torch.as_tensor(y_train[i:i + 1]))
+            expected[i] += checkpoint['lr'] * torch.dot(row_gradient, dev_gradient).item()
+    np.testing.assert_allclose(values, expected, rtol=1e-4, atol=1e-7)
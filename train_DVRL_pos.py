@@ -200,17 +200,37 @@ def main(args):
     dvrl_params['moving_average_window'] = 10
     dvrl_params['moving_average'] = False
     dvrl_params['std_penalty_weight'] = None
+    dvrl_params['checkpoint_path'] = save_dir + f'dvrl_checkpoint{test_prompt_id}.pth'
+    dvrl_params['checkpoint_interval'] = args.checkpoint_interval
+    dvrl_params['resume'] = args.resume
+    dvrl_params['cache_dir'] = args.cache_dir
+    dvrl_params['profile'] = args.profile
+    dvrl_params['profile_path'] = save_dir + f'dvrl_profile{test_prompt_id}.json'
+    dvrl_params['metrics_path'] = save_dir + f'dvrl_metrics{test_prompt_id}.jsonl'
+    dvrl_params['use_wandb'] = not args.offline
+    dvrl_params['convergence_interval'] = args.convergence_interval
+    dvrl_params['convergence_method'] = args.convergence_method
+    dvrl_params['convergence_tol'] = args.convergence_tol
+    dvrl_params['convergence_patience'] = args.convergence_patience
+    dvrl_params['warm_start'] = args.warm_start
+    dvrl_params['warm_start_epochs'] = args.warm_start_epochs
+    dvrl_params['warm_start_decay'] = args.warm_start_decay
+    dvrl_params['valuation_chunk_size'] = args.valuation_chunk_size
 
     # Init wandb
-    wandb.init(project=args.wandb_pjname, name=args.experiment_name+str(test_prompt_id), config=dict(args._get_kwargs())|dvrl_params)
+    if not args.offline:
+        wandb.init(project=args.wandb_pjname, name=args.experiment_name+str(test_prompt_id), config=dict(args._get_kwargs())|dvrl_params)
 
     # Initialize DVRL
     dvrl_class = dvrl_pos.Dvrl(X_source_set, Y_source, X_dev_set, Y_dev, pred_model, dvrl_params, device, test_prompt_id, x_source_embedding)
 
     # Train DVRL
     print('Training DVRL...')
-    data_value = dvrl_class.train_dvrl(args.metric)
-    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    dvrl_class.train_dvrl(args.metric, resume=args.resume)
+
+    # Estimate data value (written chunk by chunk into a memory-mapped .npy file)
+    print('Estimating data value...')
+    data_value = dvrl_class.dvrl_valuator(output_path=save_dir + f'estimated_data_value{test_prompt_id}.npy')
 
     # Pridicts with DVRl
     qwk = dvrl_class.dvrl_predict(X_target_set, Y_target)
@@ -218,8 +238,9 @@ def main(args):
     print(f'QWK: {qwk: .4f}')
     print(f'Data Value: {data_value}')
 
-    wandb.alert(title=args.wandb_pjname, text='Training finished!')
-    wandb.finish()
+    if not args.offline:
+        wandb.alert(title=args.wandb_pjname, text='Training finished!')
+        wandb.finish()
 
 
 if __name__ == '__main__':
@@ -239,6 +260,19 @@ if __name__ == '__main__':
     parser.add_argument('--readability_path', type=str, default='data/allreadability.pickle', help='path to readability features')
     parser.add_argument('--wandb_pjname', type=str, default='DVRL-pos-本番', help='name of the wandb project')
     parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--checkpoint_interval', type=int, default=50, help='outer iterations between checkpoints')
+    parser.add_argument('--resume', action='store_true', help='resume DVRL training from the last checkpoint')
+    parser.add_argument('--cache_dir', type=str, default=None, help='directory caching the trained original/validation models across runs')
+    parser.add_argument('--profile', action='store_true', help='record per-stage wall time of the DVRL loop')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--convergence_interval', type=int, default=0, help='iterations between data value ranking snapshots (0 disables early stopping)')
+    parser.add_argument('--convergence_method', type=str, default='spearman', help='rank correlation between snapshots', choices=['spearman', 'kendall'])
+    parser.add_argument('--convergence_tol', type=float, default=0.99, help='rank correlation counted as stable')
+    parser.add_argument('--convergence_patience', type=int, default=3, help='consecutive stable snapshots before stopping')
+    parser.add_argument('--warm_start', type=str, default='init', help='start of the inner retraining', choices=['init', 'ori', 'ema'])
+    parser.add_argument('--warm_start_epochs', type=int, default=5, help='fine-tuning epochs of a warm-started inner retraining')
+    parser.add_argument('--warm_start_decay', type=float, default=0.9, help='decay of the ema reference model')
+    parser.add_argument('--valuation_chunk_size', type=int, default=10000, help='rows per chunk when valuing the whole source')
     parser.add_argument('--embed_dim', type=int, default=50, help='pos embedding dimension')
     parser.add_argument('--cnn_filters', type=int, default=100, help='number of cnn filters')
     parser.add_argument('--cnn_kernel_size', type=int, default=5, help='cnn kernel size')
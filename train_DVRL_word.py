@@ -81,27 +81,52 @@ def main(args):
     dvrl_params['activation'] = nn.Tanh()
     dvrl_params['layer_number'] = 5
     dvrl_params['learning_rate'] = 0.001
-    dvrl_params['batch_size'] = 10000
+    dvrl_params['batch_size'] = args.dvrl_batch_size
     dvrl_params['inner_iterations'] = 100
     dvrl_params['batch_size_predictor'] = 256
     dvrl_params['moving_average_window'] = 10
     dvrl_params['moving_average'] = False
     dvrl_params['std_penalty_weight'] = None
+    dvrl_params['checkpoint_path'] = save_dir + f'dvrl_checkpoint{test_prompt_id}.pth'
+    dvrl_params['checkpoint_interval'] = args.checkpoint_interval
+    dvrl_params['resume'] = args.resume
+    dvrl_params['num_rollouts'] = args.num_rollouts
+    dvrl_params['inner_learner'] = args.inner_learner
+    dvrl_params['ridge_alpha'] = args.ridge_alpha
+    dvrl_params['num_workers'] = args.num_workers
+    dvrl_params['seed'] = seed
+    dvrl_params['cache_dir'] = args.cache_dir
+    dvrl_params['profile'] = args.profile
+    dvrl_params['profile_path'] = save_dir + f'dvrl_profile{test_prompt_id}.json'
+    dvrl_params['metrics_path'] = save_dir + f'dvrl_metrics{test_prompt_id}.jsonl'
+    dvrl_params['use_wandb'] = not args.offline
+    dvrl_params['convergence_interval'] = args.convergence_interval
+    dvrl_params['convergence_method'] = args.convergence_method
+    dvrl_params['convergence_tol'] = args.convergence_tol
+    dvrl_params['convergence_patience'] = args.convergence_patience
+    dvrl_params['warm_start'] = args.warm_start
+    dvrl_params['warm_start_epochs'] = args.warm_start_epochs
+    dvrl_params['warm_start_decay'] = args.warm_start_decay
+    dvrl_params['rollout_scheduler'] = args.rollout_scheduler
+    dvrl_params['halving_eta'] = args.halving_eta
+    dvrl_params['halving_rungs'] = args.halving_rungs
+    dvrl_params['inner_sample_size'] = args.inner_sample_size
+    dvrl_params['valuation_chunk_size'] = args.valuation_chunk_size
 
     # Init wandb
-    wandb.init(project=args.wandb_pjname, name=args.experiment_name, config=dvrl_params)
+    if not args.offline:
+        wandb.init(project=args.wandb_pjname, name=args.experiment_name, config=dvrl_params)
 
     # Initialize DVRL
     dvrl_class = dvrl.Dvrl(x_source, y_source, x_dev, y_dev, pred_model, dvrl_params, device, test_prompt_id)
 
     # Train DVRL
     print('Training DVRL...')
-    dvrl_class.train_dvrl(args.metric)
+    dvrl_class.train_dvrl(args.metric, resume=args.resume)
 
     # Estimate data value
     print('Estimating data value...')
-    data_value = dvrl_class.dvrl_valuator(x_source, y_source)
-    np.save(save_dir + 'estimated_data_value.npy', data_value)
+    data_value = dvrl_class.dvrl_valuator(x_source, y_source, output_path=save_dir + 'estimated_data_value.npy')
 
     # Pridicts with DVRl
     y_test_hat = dvrl_class.dvrl_predict(x_test)
@@ -112,8 +137,9 @@ def main(args):
     print(f'QWK: {qwk: .4f}')
     print(f'Data Value: {data_value}')
 
-    wandb.alert(title=args.wandb_pjname, text='Training finished!')
-    wandb.finish()
+    if not args.offline:
+        wandb.alert(title=args.wandb_pjname, text='Training finished!')
+        wandb.finish()
 
 
 if __name__ == '__main__':
@@ -131,6 +157,28 @@ if __name__ == '__main__':
     parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
     parser.add_argument('--wandb_pjname', type=str, default='テスト', help='name of the wandb project')
     parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--checkpoint_interval', type=int, default=50, help='outer iterations between checkpoints')
+    parser.add_argument('--resume', action='store_true', help='resume DVRL training from the last checkpoint')
+    parser.add_argument('--cache_dir', type=str, default=None, help='directory caching the trained original/validation models across runs')
+    parser.add_argument('--profile', action='store_true', help='record per-stage wall time of the DVRL loop')
+    parser.add_argument('--offline', action='store_true', help='log metrics to the local file only (no wandb)')
+    parser.add_argument('--convergence_interval', type=int, default=0, help='iterations between data value ranking snapshots (0 disables early stopping)')
+    parser.add_argument('--convergence_method', type=str, default='spearman', help='rank correlation between snapshots', choices=['spearman', 'kendall'])
+    parser.add_argument('--convergence_tol', type=float, default=0.99, help='rank correlation counted as stable')
+    parser.add_argument('--convergence_patience', type=int, default=3, help='consecutive stable snapshots before stopping')
+    parser.add_argument('--warm_start', type=str, default='init', help='start of the inner retraining', choices=['init', 'ori', 'ema'])
+    parser.add_argument('--warm_start_epochs', type=int, default=5, help='fine-tuning epochs of a warm-started inner retraining')
+    parser.add_argument('--warm_start_decay', type=float, default=0.9, help='decay of the ema reference model')
+    parser.add_argument('--inner_learner', type=str, default='mlp', help='learner retrained on each selection', choices=['mlp', 'ridge'])
+    parser.add_argument('--ridge_alpha', type=float, default=1.0, help='L2 strength of the ridge inner learner')
+    parser.add_argument('--num_workers', type=int, default=0, help='CPU processes running asynchronous rollouts (0 disables the pool)')
+    parser.add_argument('--num_rollouts', type=int, default=1, help='number of selection masks trained at once per iteration (RLOO baseline when > 1)')
+    parser.add_argument('--rollout_scheduler', type=str, default='full', help='inner budget of the rollouts (halving: successive halving over num_rollouts masks)', choices=['full', 'halving'])
+    parser.add_argument('--halving_eta', type=int, default=2, help='successive halving keeps 1/eta of the masks per rung')
+    parser.add_argument('--halving_rungs', type=int, default=3, help='number of successive halving rungs')
+    parser.add_argument('--dvrl_batch_size', type=int, default=10000, help='source rows scored by the data value estimator per outer iteration')
+    parser.add_argument('--inner_sample_size', type=int, default=None, help='maximum number of selected rows each inner fit trains on (all when unset)')
+    parser.add_argument('--valuation_chunk_size', type=int, default=10000, help='rows per chunk when valuing the whole source')
     args = parser.parse_args()
     print(dict(args._get_kwargs()))
 
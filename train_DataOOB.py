@@ -0,0 +1,80 @@
+"""Data valuation with Data-OOB"""
+
+import os
+import torch
+import numpy as np
+import argparse
+
+from dvrl.data_oob import DataOob
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, _ = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. Data-OOB
+    ###################################################
+    if device.type == 'cpu' and args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    config = AutoConfig.from_pretrained(model_name)
+    pred_model = MLP(input_feature=config.hidden_size).to(device)
+
+    oob_params = {}
+    oob_params['num_bags'] = args.num_bags
+    oob_params['bags_per_batch'] = args.bags_per_batch or args.num_bags
+    oob_params['epochs'] = args.epochs
+    oob_params['batch_size'] = args.batch_size
+    oob_params['learning_rate'] = 0.001
+    oob_params['seed'] = seed
+
+    data_value = DataOob(x_source, y_source, pred_model, oob_params, device).values()
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print('Data-OOB values saved.')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="Data-OOB")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/Data-OOB', help='data value directory')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--num_bags', type=int, default=64, help='number of bootstrap copies of the predictor')
+    parser.add_argument('--bags_per_batch', type=int, default=None, help='copies trained in one batched loop (all when unset)')
+    parser.add_argument('--epochs', type=int, default=100, help='training epochs of each copy')
+    parser.add_argument('--batch_size', type=int, default=256, help='batch size of the predictor')
+    parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads on CPU hosts (0 keeps the torch default)')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
@@ -0,0 +1,73 @@
+"""Data valuation with domain-classifier importance weights"""
+
+import os
+import time
+import torch
+import numpy as np
+import argparse
+
+from dvrl.domain_weights import importance_weights, label_residuals, combined_score
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # the target prompt's essays are only used unlabeled, as the target domain
+    x_target = test_data['essay']
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_target: ', x_target.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. Domain classifier
+    ###################################################
+    start = time.perf_counter()
+    weights = importance_weights(x_source, x_target, args.classifier, args.num_folds, seed, args.clip)
+    residuals = label_residuals(x_source, y_source, args.num_folds, seed, args.ridge_alpha)
+    data_value = combined_score(weights, residuals, args.noise_weight)
+    np.save(save_dir + f'importance_weight{test_prompt_id}.npy', weights)
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print(f'Importance weights and data values saved ({time.perf_counter() - start:.2f}s).')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="Domain weights")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/DomainWeights', help='data value directory')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--classifier', type=str, default='logistic', help='source-vs-target domain classifier', choices=['logistic', 'mlp'])
+    parser.add_argument('--num_folds', type=int, default=5, help='cross-fitting folds')
+    parser.add_argument('--clip', type=float, default=20.0, help='upper bound of the importance weights')
+    parser.add_argument('--ridge_alpha', type=float, default=1.0, help='L2 strength of the label-noise ridge')
+    parser.add_argument('--noise_weight', type=float, default=1.0, help='weight of the label-noise term in the data value')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
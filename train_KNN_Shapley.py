@@ -0,0 +1,118 @@
+"""Data valuation with exact KNN-Shapley"""
+
+import os
+import time
+import torch
+import numpy as np
+import pandas as pd
+import argparse
+import torch.nn as nn
+from scipy.stats import spearmanr
+
+from dvrl import dvrl
+from dvrl.knn_shapley import knn_shapley
+from utils.dvrl_utils import get_dev_sample
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # split test data into dev and test
+    x_dev, _, y_dev, _, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_dev: ', x_dev.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. KNN-Shapley
+    ###################################################
+    start = time.perf_counter()
+    data_value = knn_shapley(x_source, y_source, x_dev, y_dev, args.k, args.label_tolerance, device, args.chunk_size)
+    knn_seconds = time.perf_counter() - start
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print(f'KNN-Shapley values saved ({knn_seconds:.2f}s).')
+
+    ###################################################
+    # Step3. Timing comparison with DVRL
+    ###################################################
+    if args.compare_dvrl:
+        set_seed(seed)
+        config = AutoConfig.from_pretrained(model_name)
+        pred_model = MLP(input_feature=config.hidden_size).to(device)
+
+        dvrl_params = {}
+        dvrl_params['hidden_dim'] = 100
+        dvrl_params['comb_dim'] = 10
+        dvrl_params['iterations'] = args.dvrl_iterations
+        dvrl_params['activation'] = nn.Tanh()
+        dvrl_params['layer_number'] = 5
+        dvrl_params['learning_rate'] = 0.001
+        dvrl_params['batch_size'] = 10000
+        dvrl_params['inner_iterations'] = 100
+        dvrl_params['batch_size_predictor'] = 256
+        dvrl_params['moving_average_window'] = 10
+        dvrl_params['moving_average'] = False
+        dvrl_params['std_penalty_weight'] = None
+        dvrl_params['seed'] = seed
+        dvrl_params['use_wandb'] = False
+
+        dvrl_class = dvrl.Dvrl(x_source, y_source, x_dev, y_dev, pred_model, dvrl_params, device, test_prompt_id)
+        start = time.perf_counter()
+        dvrl_class.train_dvrl(args.metric)
+        dvrl_seconds = time.perf_counter() - start
+        dvrl_value = dvrl_class.dvrl_valuator(x_source, y_source)
+
+        results = pd.DataFrame([
+            {'method': 'knn_shapley', 'seconds': knn_seconds, 'speedup': dvrl_seconds / knn_seconds},
+            {'method': 'dvrl', 'seconds': dvrl_seconds, 'speedup': 1.0}
+        ])
+        results['spearman_vs_dvrl'] = [spearmanr(data_value.reshape(-1), dvrl_value.reshape(-1))[0], 1.0]
+        print(results.to_string(index=False))
+        results.to_csv(save_dir + f'knn_shapley_timing{test_prompt_id}.csv', index=False)
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="KNN-Shapley")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/KNN-Shapley', help='data value directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--k', type=int, default=10, help='number of nearest neighbours')
+    parser.add_argument('--label_tolerance', type=float, default=0.05, help='normalized labels closer than this count as the same score')
+    parser.add_argument('--chunk_size', type=int, default=8, help='dev essays valued at once')
+    parser.add_argument('--compare_dvrl', action='store_true', help='also train DVRL and report the timing of both methods')
+    parser.add_argument('--dvrl_iterations', type=int, default=1000, help='outer iterations of the DVRL run of the comparison')
+    parser.add_argument('--metric', type=str, default='qwk', help='metric to be used for DVRL', choices=['corr', 'mse', 'qwk'])
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
@@ -0,0 +1,72 @@
+"""Data valuation with optimal transport (LAVA)"""
+
+import os
+import time
+import torch
+import numpy as np
+import argparse
+
+from dvrl.lava import lava
+from utils.dvrl_utils import get_dev_sample
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # split test data into dev and test
+    x_dev, _, y_dev, _, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_dev: ', x_dev.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. LAVA
+    ###################################################
+    start = time.perf_counter()
+    data_value = lava(x_source, y_source, x_dev, y_dev, args.label_weight, args.epsilon, args.max_iterations, args.tol, device, args.chunk_size)
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print(f'LAVA values saved ({time.perf_counter() - start:.2f}s).')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="LAVA")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/LAVA', help='data value directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--label_weight', type=float, default=1.0, help='weight of the label cost against the feature cost')
+    parser.add_argument('--epsilon', type=float, default=0.1, help='entropic regularization relative to the mean cost')
+    parser.add_argument('--max_iterations', type=int, default=1000, help='maximum Sinkhorn iterations')
+    parser.add_argument('--tol', type=float, default=1e-6, help='change of the potentials (relative to the mean cost) to stop at')
+    parser.add_argument('--chunk_size', type=int, default=4096, help='source rows per block of the cost computation')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
@@ -1,6 +1,7 @@
 """Training on LOO"""
 
 import os
+import copy
 import torch
 import numpy as np
 import argparse
@@ -8,11 +9,14 @@ import torch
 import wandb
 from tqdm import tqdm
 
-from utils.dvrl_utils import get_dev_sample, fit_func, pred_func
+from utils.dvrl_utils import get_dev_sample, fit_func
 from transformers import AutoConfig
 from utils.create_embedding_feautres import create_embedding_features
 from utils.general_utils import set_seed
 from dvrl.predictor_model import MLP
+from dvrl.ridge import WeightedRidge
+from dvrl.rollout_pool import RolloutPool
+from utils.inner_trainer import InnerTrainer
 from sklearn.metrics import mean_squared_error
 
 
@@ -63,31 +67,78 @@ def main(args):
     print('Creating predictor model...')
     config = AutoConfig.from_pretrained(model_name)
     pred_model = MLP(input_feature=config.hidden_size).to(device)
-    torch.save(pred_model.state_dict(), f'tmp/init_model{test_prompt_id}.pth')
-
-    # Calculate the leave-one-out scores for source data
-    fit_func(pred_model, x_source, y_source, batch_size, epochs, device)
-    y_hat = pred_func(pred_model, x_dev, batch_size, device)
-    baseline_loss = mean_squared_error(y_dev, y_hat)
-
-    # Calculate the leave-one-out scores for each sample in the source data
-    loo_scores = []
-    for i in tqdm(range(len(x_source))):
-        # Exclude the i-th sample from the source data
-        x_train_loo = np.delete(x_source, i, axis=0)
-        y_train_loo = np.delete(y_source, i, axis=0)
-        
-        # Train the model on the reduced dataset
-        loo_model = MLP(input_feature=config.hidden_size).to(device)
-        loo_model.load_state_dict(torch.load(f'tmp/init_model{test_prompt_id}.pth'))
-        fit_func(loo_model, x_train_loo, y_train_loo, batch_size, epochs, device)
-        y_hat = pred_func(loo_model, x_dev, batch_size, device)
-        loo_loss = mean_squared_error(y_dev, y_hat)
-        
-        # Calculate the difference in MSE loss on the dev set
-        loo_score = loo_loss - baseline_loss
-        loo_scores.append(loo_score)
-    
+    init_state = copy.deepcopy(pred_model.state_dict())
+    y_dev_tensor = torch.tensor(y_dev, dtype=torch.float).view(1, -1).to(device)
+
+    if args.method in ['ridge', 'linear_head']:
+        if args.method == 'ridge':
+            features_source, features_dev = x_source, x_dev
+        else:
+            # refit the output layer of the full-data MLP on its hidden features
+            fit_func(pred_model, x_source, y_source, batch_size, epochs, device)
+            pred_model.eval()
+            with torch.no_grad():
+                hidden = pred_model.net[:-2]
+                features_source = torch.cat([hidden(chunk) for chunk in torch.tensor(x_source, dtype=torch.float).to(device).split(args.chunk_size)])
+                features_dev = hidden(torch.tensor(x_dev, dtype=torch.float).to(device))
+        ridge = WeightedRidge(torch.as_tensor(features_source, dtype=torch.float).to(device), y_source, alpha=args.ridge_alpha)
+        ridge.fit()
+        baseline_loss = torch.mean((ridge.predict(features_dev).view(1, -1) - y_dev_tensor) ** 2).item()
+        y_hat_loo = ridge.leave_one_out(features_dev, args.chunk_size)
+        loo_scores = (torch.mean((y_hat_loo - y_dev_tensor) ** 2, dim=1) - baseline_loss).cpu().numpy()
+
+    elif args.method == 'exact' and args.num_workers > 0:
+        # one full retraining per row on the other N - 1 rows, spread over single-threaded CPU
+        # workers. The baseline (all rows, task id N) runs in the same pool, so it shares the
+        # workers' device and random streams instead of adding a main-process offset to every score.
+        num_samples = len(x_source)
+        pool = RolloutPool(pred_model, init_state, x_source, y_source, x_dev, batch_size, epochs, args.num_workers, seed)
+        dev_losses = np.zeros(num_samples + 1)
+        all_idx = np.arange(num_samples)
+        try:
+            pool.submit(num_samples, all_idx, np.ones(num_samples))
+            next_row = 0
+            progress_bar = tqdm(total=num_samples + 1)
+            while next_row < num_samples or pool.num_pending() > 0:
+                while next_row < num_samples and pool.num_pending() < 2 * args.num_workers:
+                    pool.submit(next_row, np.delete(all_idx, next_row), np.ones(num_samples - 1))
+                    next_row += 1
+                for i, y_hat in pool.wait_any():
+                    dev_losses[i] = mean_squared_error(y_dev, y_hat)
+                    progress_bar.update(1)
+            progress_bar.close()
+        finally:
+            pool.close()
+        baseline_loss = dev_losses[num_samples]
+        loo_scores = dev_losses[:num_samples] - baseline_loss
+
+    else:
+        # retraining on the device-resident source indexed by the N - 1 kept rows, so row i is
+        # really dropped (minibatches and loss divisors only count the kept rows), as in a
+        # np.delete refit. 'warm' fine-tunes the full-data model for a few epochs with a
+        # common random stream, and its baseline gets the same fine-tuning on all rows.
+        trainer = InnerTrainer(pred_model, x_source, y_source, batch_size, epochs, device, x_dev=x_dev)
+        if args.method == 'warm':
+            trainer.fit()
+            start_state = copy.deepcopy(trainer.model.state_dict())
+            fit_epochs = args.warm_epochs
+        else:
+            start_state, fit_epochs = init_state, epochs
+        all_idx = torch.arange(len(x_source), device=device)
+
+        def dev_loss(idx) -> float:
+            trainer.reset(start_state)
+            if args.method == 'warm':
+                torch.manual_seed(seed)
+            trainer.fit(idx=idx, epochs=fit_epochs)
+            return torch.mean((trainer.predict().view(1, -1) - y_dev_tensor) ** 2).item()
+
+        baseline_loss = dev_loss(all_idx)
+        loo_scores = []
+        for i in tqdm(range(len(x_source))):
+            # Calculate the difference in MSE loss on the dev set
+            loo_scores.append(dev_loss(torch.cat([all_idx[:i], all_idx[i + 1:]])) - baseline_loss)
+
     # Save the leave-one-out scores
     np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', np.array(loo_scores))
     print('Leave-One-Out scores saved.')
@@ -109,6 +160,11 @@ if __name__ == '__main__':
     parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
     parser.add_argument('--epochs', type=int, default=100, help='number of epochs')
     parser.add_argument('--batch_size', type=int, default=512, help='batch size')
+    parser.add_argument('--method', type=str, default='exact', help='exact: MLP retrained per row, warm: full-data MLP fine-tuned per row, ridge/linear_head: closed-form LOO of a ridge on the embeddings/MLP hidden features', choices=['exact', 'warm', 'ridge', 'linear_head'])
+    parser.add_argument('--num_workers', type=int, default=0, help='CPU processes running the exact retrainings in parallel (0 runs them on the device)')
+    parser.add_argument('--warm_epochs', type=int, default=5, help='fine-tuning epochs of the warm method')
+    parser.add_argument('--ridge_alpha', type=float, default=1.0, help='L2 strength of the ridge and linear_head methods')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='source rows handled at once by the closed-form methods')
     args = parser.parse_args()
     print(dict(args._get_kwargs()))
 
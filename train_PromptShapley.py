@@ -0,0 +1,102 @@
+"""Exact prompt-level Shapley and Banzhaf values of the source prompts"""
+
+import os
+import json
+import torch
+import numpy as np
+import argparse
+
+from dvrl.prompt_shapley import PromptShapley
+from utils.dvrl_utils import get_dev_sample
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    source_prompt = np.concatenate([train_data['essay_set'], val_data['essay_set']])
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # split test data into dev and test
+    x_dev, _, y_dev, _, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_dev: ', x_dev.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. Prompt-level Shapley
+    ###################################################
+    config = AutoConfig.from_pretrained(model_name)
+    pred_model = MLP(input_feature=config.hidden_size).to(device)
+
+    shapley_params = {}
+    shapley_params['learner'] = args.learner
+    shapley_params['metric'] = args.metric
+    shapley_params['test_prompt_id'] = test_prompt_id
+    shapley_params['attribute_name'] = attribute_name
+    shapley_params['epochs'] = args.epochs
+    shapley_params['batch_size'] = args.batch_size
+    shapley_params['ridge_alpha'] = args.ridge_alpha
+    shapley_params['num_workers'] = args.num_workers
+    shapley_params['seed'] = seed
+    shapley_params['num_seeds'] = args.num_seeds
+    shapley_params['cache_dir'] = args.cache_dir
+
+    prompt_shapley = PromptShapley(x_source, y_source, source_prompt, x_dev, y_dev, pred_model, shapley_params, device)
+    values = prompt_shapley.values()
+    print(f'{"prompt":>8}{"shapley":>12}{"banzhaf":>12}')
+    for prompt, value in sorted(values.items(), key=lambda item: -item[1]['shapley']):
+        print(f'{prompt:>8}{value["shapley"]:>12.5f}{value["banzhaf"]:>12.5f}')
+
+    with open(save_dir + f'prompt_values{test_prompt_id}.json', 'w') as f:
+        json.dump({str(prompt): value for prompt, value in values.items()}, f, indent=2)
+    # every essay gets its prompt's value, so the pruning sweeps drop whole prompts
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', prompt_shapley.essay_values(values, args.value))
+    print('Prompt values saved.')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="Prompt-level Shapley")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/PromptShapley', help='data value directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--learner', type=str, default='mlp', help='learner trained on each prompt coalition', choices=['mlp', 'ridge'])
+    parser.add_argument('--metric', type=str, default='mse', help='dev score of a coalition (mse is negated)', choices=['mse', 'qwk'])
+    parser.add_argument('--epochs', type=int, default=100, help='training epochs of the mlp')
+    parser.add_argument('--batch_size', type=int, default=256, help='batch size of the mlp')
+    parser.add_argument('--num_seeds', type=int, default=1, help='mlp training seeds averaged per coalition (the same seeds for every coalition)')
+    parser.add_argument('--ridge_alpha', type=float, default=1.0, help='L2 strength of the ridge learner')
+    parser.add_argument('--num_workers', type=int, default=0, help='CPU processes training coalitions in parallel (0 trains them on the device)')
+    parser.add_argument('--cache_dir', type=str, default='tmp/prompt_shapley_cache', help='directory of the cached coalition scores')
+    parser.add_argument('--value', type=str, default='shapley', help='prompt value written to the per-essay data value file', choices=['shapley', 'banzhaf'])
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
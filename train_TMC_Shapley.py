@@ -0,0 +1,94 @@
+"""Data valuation with Truncated Monte Carlo Data Shapley"""
+
+import os
+import torch
+import numpy as np
+import argparse
+
+from dvrl.tmc_shapley import TmcShapley
+from utils.dvrl_utils import get_dev_sample
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # split test data into dev and test
+    x_dev, _, y_dev, _, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_dev: ', x_dev.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. TMC-Shapley
+    ###################################################
+    config = AutoConfig.from_pretrained(model_name)
+    pred_model = MLP(input_feature=config.hidden_size).to(device)
+
+    tmc_params = {}
+    tmc_params['learner'] = args.learner
+    tmc_params['num_permutations'] = args.num_permutations
+    tmc_params['truncation_tolerance'] = args.truncation_tolerance
+    tmc_params['block_size'] = args.block_size
+    tmc_params['mlp_epochs'] = args.mlp_epochs
+    tmc_params['batch_size'] = args.batch_size
+    tmc_params['ridge_alpha'] = args.ridge_alpha
+    tmc_params['num_workers'] = args.num_workers
+    tmc_params['seed'] = seed
+    tmc_params['checkpoint_path'] = save_dir + f'tmc_checkpoint{test_prompt_id}.pth'
+    tmc_params['checkpoint_interval'] = args.checkpoint_interval
+
+    tmc = TmcShapley(x_source, y_source, x_dev, y_dev, pred_model, tmc_params, device)
+    data_value = tmc.run(resume=args.resume)
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print('TMC-Shapley values saved.')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="TMC-Shapley")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/TMC-Shapley', help='data value directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--learner', type=str, default='ridge', help='learner grown along the permutations', choices=['ridge', 'mlp'])
+    parser.add_argument('--num_permutations', type=int, default=500, help='number of Monte Carlo permutations')
+    parser.add_argument('--truncation_tolerance', type=float, default=0.01, help='truncate a permutation once its dev score is within this relative distance of the full-data score')
+    parser.add_argument('--block_size', type=int, default=1, help='source rows added per step (they share the step contribution)')
+    parser.add_argument('--mlp_epochs', type=int, default=1, help='fine-tuning epochs of the mlp on each added block')
+    parser.add_argument('--batch_size', type=int, default=256, help='batch size of the mlp')
+    parser.add_argument('--ridge_alpha', type=float, default=1.0, help='L2 strength of the ridge learner')
+    parser.add_argument('--num_workers', type=int, default=0, help='CPU processes running permutations in parallel (0 runs them on the device)')
+    parser.add_argument('--checkpoint_interval', type=int, default=50, help='permutations between checkpoints of the running estimate')
+    parser.add_argument('--resume', action='store_true', help='resume from the last checkpoint')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
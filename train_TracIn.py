@@ -0,0 +1,80 @@
+"""Data valuation with TracIn"""
+
+import os
+import torch
+import numpy as np
+import argparse
+
+from dvrl.tracin import TracIn
+from utils.dvrl_utils import get_dev_sample, fit_func
+from transformers import AutoConfig
+from utils.create_embedding_feautres import create_embedding_features
+from utils.general_utils import set_seed
+from dvrl.predictor_model import MLP
+
+
+def main(args):
+    ###################################################
+    # Step0. Set UP
+    ###################################################
+    test_prompt_id = args.test_prompt_id
+    attribute_name = args.attribute_name
+    seed = args.seed
+    save_dir = args.save_dir + '/'
+    os.makedirs(save_dir, exist_ok=True)
+    device = torch.device(args.device)
+    set_seed(seed)
+
+    ###################################################
+    # Step1. Create/Load Text Embedding
+    ###################################################
+    # Load data
+    data_path = args.data_dir + str(test_prompt_id) + '/'
+    model_name = args.embedding_model
+
+    train_data, val_data, test_data = create_embedding_features(data_path, attribute_name, model_name, device)
+    x_source, y_source = np.concatenate([train_data['essay'], val_data['essay']]), np.concatenate([train_data['normalized_label'], val_data['normalized_label']])
+    # split test data into dev and test
+    x_dev, _, y_dev, _, _, _ = get_dev_sample(test_data['essay'], test_data['normalized_label'], dev_size=args.dev_size)
+
+    print('================================')
+    print('X_source: ', x_source.shape)
+    print('X_dev: ', x_dev.shape)
+    print('================================')
+
+    ###################################################
+    # Step2. TracIn
+    ###################################################
+    # train the predictor on the whole source and record num_checkpoints evenly spaced snapshots
+    print('Training the predictor...')
+    config = AutoConfig.from_pretrained(model_name)
+    pred_model = MLP(input_feature=config.hidden_size).to(device)
+    checkpoint_epochs = np.unique(np.linspace(0, args.epochs, args.num_checkpoints + 1)[1:].round().astype(int)).tolist()
+    checkpoints = []
+    fit_func(pred_model, x_source, y_source, args.batch_size, args.epochs, device, checkpoint_epochs=checkpoint_epochs, checkpoints=checkpoints)
+
+    tracin = TracIn(pred_model, checkpoints, device, chunk_size=args.chunk_size)
+    data_value = tracin.values(x_source, y_source, x_dev, y_dev)
+    np.save(save_dir + f'estimated_data_value{test_prompt_id}.npy', data_value)
+    print(f'TracIn scores over epochs {checkpoint_epochs} saved.')
+
+
+if __name__ == '__main__':
+    # Set up the argument parser
+    parser = argparse.ArgumentParser(description="TracIn")
+    parser.add_argument('--test_prompt_id', type=int, default=1, help='prompt id of test essay set')
+    parser.add_argument('--seed', type=int, default=12, help='set random seed')
+    parser.add_argument('--attribute_name', type=str, default='score', help='name of the attribute to be trained on')
+    parser.add_argument('--save_dir', type=str, default='outputs/Estimated_Data_Values/TracIn', help='data value directory')
+    parser.add_argument('--dev_size', type=int, default=30, help='size of the dev set')
+    parser.add_argument('--data_dir', type=str, default='data/cross_prompt_attributes/', help='data directory')
+    parser.add_argument('--embedding_model', type=str, default='microsoft/deberta-v3-large', help='name of the embedding model')
+    parser.add_argument('--device', type=str, default='cuda', help='device to be used', choices=['cuda', 'cpu', 'mps'])
+    parser.add_argument('--epochs', type=int, default=100, help='training epochs of the predictor')
+    parser.add_argument('--batch_size', type=int, default=256, help='batch size of the predictor')
+    parser.add_argument('--num_checkpoints', type=int, default=5, help='evenly spaced training checkpoints traced')
+    parser.add_argument('--chunk_size', type=int, default=64, help='source rows per batch of per-sample gradients')
+    args = parser.parse_args()
+    print(dict(args._get_kwargs()))
+
+    main(args)
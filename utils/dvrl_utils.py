@@ -1,12 +1,14 @@
 """Utility functions for DVRL model."""
 
+import hashlib
 import numpy as np
 from torch.utils.data import DataLoader, TensorDataset
 import torch
-import torch.optim as optim
 import torch.nn as nn
 from sklearn.metrics import cohen_kappa_score
+from scipy.stats import spearmanr, kendalltau
 from utils.general_utils import get_min_max_scores
+from utils.inner_trainer import InnerTrainer
 import matplotlib.pyplot as plt
 import os
 
@@ -18,7 +20,9 @@ def fit_func(
         batch_size: int,
         epochs: int,
         device: torch.device,
-        sample_weight: np.ndarray = None
+        sample_weight: np.ndarray = None,
+        checkpoint_epochs: list = None,
+        checkpoints: list = None
         ) -> list:
     """
     Fit the model with the given data.
@@ -30,53 +34,14 @@ def fit_func(
         epochs: Number of epochs
         device: Device to run the model
         sample_weight: Sample weight for each data
+        checkpoint_epochs: Epochs (1-based) after which the weights are recorded
+        checkpoints: List receiving the recorded snapshots (epoch, weights and learning rate)
     Returns:
         list: Loss history
     """
 
-    model = model.to(device)
-    model.train()
-    optimizer = optim.Adam(model.parameters(), lr=0.001)
-
-    x_train = torch.tensor(x_train, dtype=torch.float)
-    y_train = torch.tensor(y_train, dtype=torch.float)
-
-    if sample_weight is not None:
-        loss_fn = nn.MSELoss(reduction='none')
-        sample_weight = torch.tensor(sample_weight, dtype=torch.float)
-        train_data = TensorDataset(x_train, y_train, sample_weight)
-    else:
-        loss_fn = nn.MSELoss(reduction='mean')
-        train_data = TensorDataset(x_train, y_train)
-    train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True, pin_memory=False, num_workers=0)
-
-    history = []
-    for epoch in range(epochs):
-        losses = []
-        if sample_weight is not None:
-            for x_batch, y_batch, w_batch in train_loader:
-                optimizer.zero_grad()
-                x_batch, y_batch, w_batch = x_batch.to(device), y_batch.to(device), w_batch.to(device)
-                y_pred = model(x_batch)
-                loss = loss_fn(y_pred.squeeze(), y_batch.squeeze()) * w_batch
-                loss = loss.mean()
-                losses.append(loss.item())
-                loss.backward()
-                optimizer.step()
-        else:
-            for x_batch, y_batch in train_loader:
-                optimizer.zero_grad()
-                x_batch, y_batch = x_batch.to(device), y_batch.to(device)
-                y_pred = model(x_batch)
-                loss = loss_fn(y_pred.squeeze(), y_batch.squeeze())
-                losses.append(loss.item())
-                loss.backward()
-                optimizer.step()
-        history.append(np.mean(losses))
-        # if (epoch) % 10 == 0:
-        #     print(f'Epoch: {epoch}, Loss:  {loss.item()}')
-    
-    return history
+    trainer = InnerTrainer(model, x_train, y_train, batch_size, epochs, device)
+    return trainer.fit(sample_weight, checkpoint_epochs=checkpoint_epochs, checkpoints=checkpoints)
 
 def pred_func(
         model: nn.Module,
@@ -94,19 +59,8 @@ def pred_func(
     Returns:
         list: Predicted results
     """
-    model = model.to(device)
-    model.eval()
-
-    x_test = torch.tensor(x_test, dtype=torch.float)
-    test_data = TensorDataset(x_test)
-    test_loader = DataLoader(test_data, batch_size=batch_size, shuffle=False, pin_memory=False, num_workers=0)
-    preds = []
-    with torch.no_grad():
-        for x_batch in test_loader:
-            x_batch = x_batch[0].to(device)
-            y_pred = model(x_batch)
-            preds.extend(y_pred.cpu().tolist())
-    return preds
+    trainer = InnerTrainer(model, None, None, batch_size, 0, device, x_dev=x_test)
+    return trainer.predict().cpu().tolist()
 
 def calc_qwk(y_true: list, y_pred: list, prompt_id: int, attribute: str, weights='quadratic') -> float:
     """
@@ -127,6 +81,250 @@ def calc_qwk(y_true: list, y_pred: list, prompt_id: int, attribute: str, weights
     
     return cohen_kappa_score(y_true, y_pred, weights=weights, labels=[i for i in range(minscore, maxscore+1)])
 
+class QWKKernel(object):
+    """
+    Quadratic weighted kappa against fixed true labels of one prompt.
+    The label range, weight matrix and rounded true labels are computed once
+    and the confusion matrices of a whole batch of prediction vectors are
+    built with one scatter-add on the device. Matches calc_qwk (sklearn's
+    cohen_kappa_score with the prompt's label list).
+    """
+
+    def __init__(self, y_true, prompt_id: int, attribute: str, device: torch.device = 'cpu', weights: str = 'quadratic') -> None:
+        """
+        Args:
+            y_true: True labels (normalized)
+            prompt_id: Prompt ID
+            attribute: Attribute name
+            device: Device to compute on
+            weights: 'quadratic' or 'linear'
+        """
+        self.minscore, self.maxscore = get_min_max_scores()[prompt_id][attribute]
+        self.num_labels = self.maxscore - self.minscore + 1
+        self.device = torch.device(device)
+        # mps has no float64 support
+        self.dtype = torch.float32 if self.device.type == 'mps' else torch.float64
+
+        self.true_idx, self.true_valid = self._to_label_index(y_true)
+        labels = torch.arange(self.num_labels, dtype=self.dtype, device=self.device)
+        diff = labels.view(-1, 1) - labels.view(1, -1)
+        self.weights = diff ** 2 if weights == 'quadratic' else torch.abs(diff)
+
+    def _to_label_index(self, y) -> tuple:
+        y = torch.as_tensor(y).detach().to(self.device, self.dtype)
+        idx = torch.round((self.maxscore - self.minscore) * y + self.minscore).long() - self.minscore
+        # sklearn ignores samples whose labels fall outside the label list
+        valid = (idx >= 0) & (idx < self.num_labels)
+        return idx.clamp(0, self.num_labels - 1), valid
+
+    def __call__(self, y_pred) -> torch.Tensor:
+        """
+        Calculate the QWK of one or many prediction vectors.
+        Args:
+            y_pred: Predicted labels (N,), (N, 1), (B, N) or (B, N, 1)
+        Returns:
+            torch.Tensor: QWK of each prediction vector (B,)
+        """
+        y_pred = torch.as_tensor(y_pred).detach()
+        if y_pred.dim() == 3:
+            y_pred = y_pred.squeeze(-1)
+        y_pred = y_pred.reshape(-1, self.true_idx.numel())
+        num_batch = y_pred.shape[0]
+
+        pred_idx, pred_valid = self._to_label_index(y_pred)
+        true_idx = self.true_idx.view(1, -1)
+        valid = (pred_valid & self.true_valid.view(1, -1)).to(self.dtype)
+        batch_offset = torch.arange(num_batch, device=self.device).view(-1, 1) * self.num_labels ** 2
+        flat_idx = batch_offset + true_idx * self.num_labels + pred_idx
+
+        confusion = torch.zeros(num_batch * self.num_labels ** 2, dtype=self.dtype, device=self.device)
+        confusion.index_add_(0, flat_idx.view(-1), valid.view(-1))
+        confusion = confusion.view(num_batch, self.num_labels, self.num_labels)
+
+        sum0 = confusion.sum(dim=2)
+        sum1 = confusion.sum(dim=1)
+        expected = sum0.unsqueeze(2) * sum1.unsqueeze(1) / sum0.sum(dim=1).view(-1, 1, 1)
+        k = torch.sum(self.weights * confusion, dim=(1, 2)) / torch.sum(self.weights * expected, dim=(1, 2))
+        return 1 - k
+
+def batched_performance(y_pred, y_true: torch.Tensor, metric: str, qwk_kernel: QWKKernel = None) -> torch.Tensor:
+    """
+    Evaluate many prediction vectors against the same true labels on the device.
+    Args:
+        y_pred: Predicted labels (N,), (N, 1), (B, N) or (B, N, 1)
+        y_true: True labels on the device
+        metric: Metric to use
+            mse or qwk or corr
+        qwk_kernel: Kernel built on y_true (required for qwk)
+    Returns:
+        torch.Tensor: Performance of each prediction vector (B,)
+    """
+    y_true = y_true.view(1, -1)
+    y_pred = torch.as_tensor(y_pred).detach().to(y_true.device, y_true.dtype).reshape(-1, y_true.shape[1])
+    if metric == 'mse':
+        return torch.mean((y_pred - y_true) ** 2, dim=1)
+    elif metric == 'qwk':
+        return qwk_kernel(y_pred)
+    elif metric == 'corr':
+        pred_centered = y_pred - y_pred.mean(dim=1, keepdim=True)
+        true_centered = y_true - y_true.mean()
+        return torch.sum(pred_centered * true_centered, dim=1) / torch.sqrt(torch.sum(pred_centered ** 2, dim=1) * torch.sum(true_centered ** 2))
+    else:
+        raise ValueError('Metric not supported')
+
+def save_checkpoint(state: dict, path: str) -> None:
+    """
+    Save the checkpoint atomically: write a temporary file and rename it, so
+    an interrupted write never leaves a truncated checkpoint behind.
+    Args:
+        state: Checkpoint contents
+        path: Checkpoint path
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path: str) -> dict:
+    """
+    Load a checkpoint written by save_checkpoint onto the CPU
+    (generator states must stay on the CPU; load_state_dict moves weights).
+    Args:
+        path: Checkpoint path
+    Returns:
+        dict: Checkpoint contents
+    """
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+def value_in_chunks(value_estimator: nn.Module, x: torch.Tensor, y: torch.Tensor, y_pred_diff: torch.Tensor, chunk_size: int) -> torch.Tensor:
+    """
+    Value every row with the data value estimator, streaming over the rows
+    in chunks without building the autograd graph.
+    Args:
+        value_estimator: Data value estimator
+        x: Estimator features of each row (on the device)
+        y: Labels (N, 1)
+        y_pred_diff: Prediction differences (N, 1)
+        chunk_size: Rows per chunk
+    Returns:
+        torch.Tensor: Data value of each row (N,)
+    """
+    value_estimator.eval()
+    data_value = torch.empty(x.shape[0], device=x.device)
+    with torch.no_grad():
+        for start in range(0, len(data_value), chunk_size):
+            end = start + chunk_size
+            data_value[start:end] = value_estimator(x[start:end], y[start:end], y_pred_diff[start:end]).view(-1)
+    return data_value
+
+def value_array(num_samples: int, output_path: str = None) -> np.ndarray:
+    """
+    Preallocate the data value array, as a memory-mapped .npy file when
+    output_path is given (call flush on it once it is filled).
+    Args:
+        num_samples: Number of rows
+        output_path: Path of the .npy file (in memory when None)
+    Returns:
+        np.ndarray: Float32 array (N, 1)
+    """
+    if output_path is None:
+        return np.empty((num_samples, 1), dtype=np.float32)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    return np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(num_samples, 1))
+
+class RankingConvergence(object):
+    """
+    Track the ranking of the estimated data values between snapshots and
+    report convergence once the rank correlation with the previous snapshot
+    has stayed at or above `tol` for `patience` consecutive snapshots.
+    """
+
+    def __init__(self, method: str = 'spearman', tol: float = 0.99, patience: int = 3) -> None:
+        """
+        Args:
+            method: Rank correlation (spearman or kendall)
+            tol: Minimum correlation counted as stable
+            patience: Number of consecutive stable snapshots needed to stop
+        """
+        if method not in ('spearman', 'kendall'):
+            raise ValueError('Rank correlation not supported')
+        self.method = method
+        self.tol = tol
+        self.patience = patience
+        self.previous = None
+        self.num_stable = 0
+        self.history = []
+
+    def update(self, data_value) -> bool:
+        """
+        Add a snapshot of the data values.
+        Args:
+            data_value: Estimated data value of every source row
+        Returns:
+            bool: Whether the ranking has converged
+        """
+        data_value = np.asarray(data_value, dtype=np.float64).reshape(-1)
+        if self.previous is not None:
+            if self.method == 'spearman':
+                corr = spearmanr(self.previous, data_value)[0]
+            else:
+                corr = kendalltau(self.previous, data_value)[0]
+            # a constant snapshot has no ranking to compare
+            corr = 0.0 if np.isnan(corr) else float(corr)
+            self.history.append(corr)
+            self.num_stable = self.num_stable + 1 if corr >= self.tol else 0
+        self.previous = data_value
+        return self.converged
+
+    @property
+    def converged(self) -> bool:
+        return self.num_stable >= self.patience
+
+    def state_dict(self) -> dict:
+        return {'previous': self.previous, 'num_stable': self.num_stable, 'history': self.history}
+
+    def load_state_dict(self, state: dict) -> None:
+        self.previous = state['previous']
+        self.num_stable = state['num_stable']
+        self.history = state['history']
+
+def hash_contents(*objects) -> str:
+    """
+    Content hash of arrays, tensors, state_dicts, containers and scalars,
+    used as the key of the setup cache.
+    Args:
+        objects: Objects to hash
+    Returns:
+        str: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+
+    def update(obj):
+        if torch.is_tensor(obj):
+            obj = obj.detach().cpu().numpy()
+        if isinstance(obj, np.ndarray):
+            obj = np.ascontiguousarray(obj)
+            digest.update(f'ndarray{obj.dtype}{obj.shape}'.encode())
+            digest.update(obj.tobytes())
+        elif isinstance(obj, dict):
+            digest.update(f'dict{len(obj)}'.encode())
+            for key in sorted(obj):
+                digest.update(repr(key).encode())
+                update(obj[key])
+        elif isinstance(obj, (list, tuple)):
+            digest.update(f'{type(obj).__name__}{len(obj)}'.encode())
+            for item in obj:
+                update(item)
+        else:
+            digest.update(f'{type(obj).__name__}{obj!r}'.encode())
+
+    for obj in objects:
+        update(obj)
+    return digest.hexdigest()
+
 def remove_top_p_sample(data_value: np.ndarray, top_p: float, ascending: bool =True):
     """
     Get sample weight for the given data value.
@@ -283,7 +481,9 @@ def fit_func_for_PAES(
         batch_size: int,
         epochs: int,
         device: torch.device,
-        sample_weight: np.ndarray = None
+        sample_weight: np.ndarray = None,
+        checkpoint_epochs: list = None,
+        checkpoints: list = None
 ) -> None:
     """
     Fit the model with the given data.
@@ -295,28 +495,11 @@ def fit_func_for_PAES(
         epochs: Number of epochs
         device: Device to run the model
         sample_weight: Sample weight for each data
+        checkpoint_epochs: Epochs (1-based) after which the weights are recorded
+        checkpoints: List receiving the recorded snapshots (epoch, weights and learning rate)
     """
-    model = model.to(device)
-    optimizer = torch.optim.RMSprop(model.parameters(), lr=0.001)
-    if sample_weight is not None:
-        sample_weight = torch.tensor(sample_weight, dtype=torch.float)
-        MSE_Loss = nn.MSELoss(reduction='none').to(device)
-        train_dataset = TensorDataset(x_train[0], y_train, x_train[1], x_train[2], x_train[3], sample_weight)
-    else:
-        # Create loss and optimizer
-        MSE_Loss = nn.MSELoss(reduction='mean').to(device)
-        # Create Datasets
-        train_dataset = TensorDataset(x_train[0], y_train, x_train[1], x_train[2], x_train[3])
-    # Create Dataloaders
-    train_loader = DataLoader(dataset=train_dataset, batch_size=batch_size, shuffle=True, num_workers=0, pin_memory=True)
-
-    from utils.evaluation import train_model
-    if sample_weight is not None:
-        for _ in range(epochs):
-            train_model(model, train_loader, MSE_Loss, optimizer, device, weight=True)
-    else:
-        for _ in range(epochs):
-            train_model(model, train_loader, MSE_Loss, optimizer, device)
+    trainer = InnerTrainer(model, x_train[:3], y_train, batch_size, epochs, device, optimizer_cls=torch.optim.RMSprop)
+    trainer.fit(sample_weight, checkpoint_epochs=checkpoint_epochs, checkpoints=checkpoints)
 
 
 def pred_func_for_PAES(
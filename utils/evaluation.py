@@ -8,6 +8,7 @@ import torch.optim as optim
 from torch.utils.data import DataLoader
 from sklearn.metrics import mean_squared_error, cohen_kappa_score, mean_absolute_error
 from utils.general_utils import get_min_max_scores
+from utils.metrics_sink import MetricsSink
 
 # 訓練関数の定義
 def train_model(
@@ -17,7 +18,8 @@ def train_model(
         optimizer: nn.Module,
         device: torch.device,
         scheduler: nn.Module = None,
-        weight: bool = False
+        weight: bool = False,
+        metrics_sink: MetricsSink = None
         ) -> float:
     """
     Train the model.
@@ -28,6 +30,8 @@ def train_model(
         optimizer: Optimizer
         device: Device to run the model
         scheduler: Learning rate scheduler
+        weight: Whether the data loader yields sample weights
+        metrics_sink: Sink receiving the per-step loss (buffered, written in the background)
     Returns:
         float: Loss value
     """
@@ -49,7 +53,7 @@ def train_model(
             loss = loss_fn(y_pred.squeeze(), y_train.squeeze()) * weight.to(device)
             loss = loss.mean()
                 
-            losses.append(loss.item())
+            losses.append(loss.detach())
             loss.backward()
     
             # update weights
@@ -58,7 +62,8 @@ def train_model(
                 scheduler.step()
             optimizer.zero_grad()
     
-            progress_bar.set_postfix({'loss': sum(losses) / len(losses)})
+            if metrics_sink is not None:
+                metrics_sink.log({'train_loss': losses[-1]})
         
     else:
         for x_train, y_train, linguistic_train, readability_train, _ in progress_bar:
@@ -71,7 +76,7 @@ def train_model(
             y_pred = model(x_train, linguistic_train, readability_train)
             
             loss = loss_fn(y_pred.squeeze(), y_train.squeeze())
-            losses.append(loss.item())
+            losses.append(loss.detach())
             loss.backward()
     
             # update weights
@@ -80,9 +85,13 @@ def train_model(
                 scheduler.step()
             optimizer.zero_grad()
     
-            progress_bar.set_postfix({'loss': sum(losses) / len(losses)})
+            if metrics_sink is not None:
+                metrics_sink.log({'train_loss': losses[-1]})
 
-    return np.mean(losses)
+    # one device sync per epoch instead of one per step (nan for an empty loader, like np.mean)
+    mean_loss = torch.stack(losses).mean().item() if losses else float('nan')
+    progress_bar.set_postfix({'loss': mean_loss})
+    return mean_loss
 
 # 評価関数の定義
 def evaluate_model(
@@ -195,17 +204,32 @@ def train_epoch(model, data_loader, loss_fn, optimizer, device, scheduler, use_w
         if use_weight:
             weight = d['weights'].to(device)
 
-        outputs = model(input_ids=input_ids, attention_mask=attention_mask)
-
-        if use_weight:
-            loss = loss_fn(outputs.squeeze(), targets) * weight
+        if use_weight and bool(torch.all((weight == 0) | (weight == 1))):
+            # binary weights: run the model on the selected rows only; dividing
+            # by the full batch size keeps the same loss and gradients
+            selected = weight.bool()
+            batch_size = weight.shape[0]
+            if not bool(selected.any()):
+                for param in model.parameters():
+                    if param.requires_grad:
+                        param.grad = torch.zeros_like(param)
+                loss = torch.zeros((), device=device)
+            else:
+                outputs = model(input_ids=input_ids[selected], attention_mask=attention_mask[selected])
+                loss = loss_fn(outputs.view(-1), targets[selected]).sum() / batch_size
         else:
-            loss = loss_fn(outputs.squeeze(), targets)
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+
+            if use_weight:
+                loss = loss_fn(outputs.squeeze(), targets) * weight
+            else:
+                loss = loss_fn(outputs.squeeze(), targets)
 
-        loss = loss.mean()
+            loss = loss.mean()
         losses.append(loss.item())
 
-        loss.backward()
+        if loss.requires_grad:
+            loss.backward()
         nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
         optimizer.step()
         scheduler.step()
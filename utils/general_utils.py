@@ -13,6 +13,33 @@ def set_seed(seed):
     torch.manual_seed(seed)
     torch.cuda.manual_seed(seed)
 
+def get_rng_state() -> dict:
+    """
+    Capture the state of every random number generator used in training.
+    Returns:
+        dict: python, numpy, torch (and cuda) generator states
+    """
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state: dict) -> None:
+    """
+    Restore the generator states captured by get_rng_state.
+    Args:
+        state: Generator states
+    """
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
 def get_overall_score_range():
     return {
     1: (2, 12),
@@ -0,0 +1,330 @@
+"""Trainers for the predictor retrained inside the DVRL loop."""
+
+import copy
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.func import functional_call, vmap
+
+
+def to_device_tensors(x, device: torch.device) -> list:
+    """
+    Convert the model inputs to a list of float/long tensors on the device.
+    Args:
+        x: Array, tensor or list/tuple of them (one entry per model input)
+        device: Device to run the model
+    Returns:
+        list: Tensors on the device
+    """
+    if not isinstance(x, (list, tuple)):
+        x = [x]
+    tensors = []
+    for x_input in x:
+        x_input = torch.as_tensor(x_input).detach()
+        if x_input.is_floating_point():
+            x_input = x_input.float()
+        tensors.append(x_input.to(device))
+    return tensors
+
+
+class InnerTrainer(object):
+    """
+    Device-resident trainer for the predictor retrained inside the DVRL loop.
+    The training and dev inputs are moved to the device once, minibatches are
+    drawn by index permutation and the optimizer state buffers are reused
+    across calls (they are zeroed on reset instead of being reallocated).
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        x_train,
+        y_train,
+        batch_size: int,
+        epochs: int,
+        device: torch.device,
+        x_dev=None,
+        optimizer_cls: type = optim.Adam,
+        lr: float = 0.001,
+        pred_batch_size: int = None
+    ) -> None:
+        """
+        Args:
+            model: Model to train
+            x_train: Training data (array, tensor or list of model inputs), None for prediction only
+            y_train: Training labels, None for prediction only
+            batch_size: Batch size
+            epochs: Number of epochs
+            device: Device to run the model
+            x_dev: Validation data predicted by default in predict
+            optimizer_cls: Optimizer class
+            lr: Learning rate
+            pred_batch_size: Batch size for prediction (defaults to batch_size)
+        """
+        self.device = device
+        self.model = model.to(device)
+        self.x_train = to_device_tensors(x_train, device) if x_train is not None else None
+        self.y_train = to_device_tensors(y_train, device)[0].float().view(-1) if y_train is not None else None
+        self.x_dev = to_device_tensors(x_dev, device) if x_dev is not None else None
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.pred_batch_size = pred_batch_size if pred_batch_size is not None else batch_size
+        self.optimizer = optimizer_cls(self.model.parameters(), lr=lr)
+        self._checkpoint_epochs = set()
+        self._checkpoints = None
+
+    def reset(self, state_dict: dict = None) -> None:
+        """
+        Reset the model weights and the optimizer state.
+        Args:
+            state_dict: Weights to load (kept as is when None)
+        """
+        if state_dict is not None:
+            self.model.load_state_dict(state_dict)
+        for state in self.optimizer.state.values():
+            for key, value in state.items():
+                if torch.is_tensor(value):
+                    value.zero_()
+                else:
+                    state[key] = 0
+
+    def fit(self, sample_weight=None, idx=None, epochs: int = None, checkpoint_epochs: list = None, checkpoints: list = None) -> list:
+        """
+        Fit the model on the (optionally indexed) training data.
+        A binary sample weight (a selection mask) is trained on the selected
+        rows only: each minibatch of the permutation is compacted to its
+        selected rows and the loss is still divided by the full minibatch
+        size, so the updates are the same as with the zero-weighted rows.
+        Args:
+            sample_weight: Sample weight for each (indexed) data
+            idx: Indices of the training rows to use
+            epochs: Number of epochs (defaults to the trainer setting)
+            checkpoint_epochs: Epochs (1-based) after which a snapshot is appended to checkpoints
+            checkpoints: List receiving the snapshots (epoch, weights and learning rate)
+        Returns:
+            list: Loss history
+        """
+        epochs = self.epochs if epochs is None else epochs
+        self._checkpoint_epochs = set(checkpoint_epochs) if checkpoints is not None and checkpoint_epochs else set()
+        self._checkpoints = checkpoints
+        x_train, y_train = self.x_train, self.y_train
+        if idx is not None:
+            idx = torch.as_tensor(idx, dtype=torch.long).to(self.device)
+            x_train = [x_input[idx] for x_input in x_train]
+            y_train = y_train[idx]
+        if sample_weight is not None:
+            sample_weight = torch.as_tensor(sample_weight, dtype=torch.float).detach().to(self.device).view(-1)
+            if bool(torch.all((sample_weight == 0) | (sample_weight == 1))):
+                return self._fit_selected(x_train, y_train, sample_weight.bool(), epochs)
+
+        self.model.train()
+        num_samples = y_train.shape[0]
+        history = []
+        for epoch in range(epochs):
+            perm = torch.randperm(num_samples, device=self.device)
+            losses = []
+            for start in range(0, num_samples, self.batch_size):
+                batch = perm[start:start + self.batch_size]
+                self.optimizer.zero_grad()
+                y_pred = self.model(*[x_input[batch] for x_input in x_train])
+                loss = (y_pred.view(-1) - y_train[batch]) ** 2
+                if sample_weight is not None:
+                    loss = loss * sample_weight[batch]
+                loss = loss.mean()
+                loss.backward()
+                self.optimizer.step()
+                losses.append(loss.detach())
+            history.append(torch.stack(losses).mean())
+            self._maybe_snapshot(epoch + 1)
+        return torch.stack(history).tolist() if history else []
+
+    def _maybe_snapshot(self, epoch: int) -> None:
+        if epoch in self._checkpoint_epochs:
+            self._checkpoints.append({
+                'epoch': epoch,
+                'state_dict': copy.deepcopy(self.model.state_dict()),
+                'lr': self.optimizer.param_groups[0]['lr']
+            })
+
+    def _fit_selected(self, x_train: list, y_train: torch.Tensor, selected: torch.Tensor, epochs: int) -> list:
+        self.model.train()
+        num_samples = y_train.shape[0]
+        num_batches = (num_samples + self.batch_size - 1) // self.batch_size
+        history = []
+        for epoch in range(epochs):
+            perm = torch.randperm(num_samples, device=self.device)
+            selected_perm = selected[perm]
+            rows = perm[selected_perm]
+            # selected rows per minibatch of the permutation (one device sync per epoch)
+            padded = torch.zeros(num_batches * self.batch_size, dtype=torch.long, device=self.device)
+            padded[:num_samples] = selected_perm.long()
+            counts = padded.view(num_batches, self.batch_size).sum(dim=1).tolist()
+
+            losses = []
+            offset = 0
+            for i, count in enumerate(counts):
+                batch = rows[offset:offset + count]
+                offset += count
+                full_size = min(self.batch_size, num_samples - i * self.batch_size)
+                # keep zero (not None) gradients so an empty minibatch still steps the optimizer
+                self.optimizer.zero_grad(set_to_none=False)
+                if count == 0:
+                    for param in self.model.parameters():
+                        if param.grad is None and param.requires_grad:
+                            param.grad = torch.zeros_like(param)
+                    self.optimizer.step()
+                    losses.append(torch.zeros((), device=self.device))
+                    continue
+                y_pred = self.model(*[x_input[batch] for x_input in x_train])
+                loss = torch.sum((y_pred.view(-1) - y_train[batch]) ** 2) / full_size
+                loss.backward()
+                self.optimizer.step()
+                losses.append(loss.detach())
+            history.append(torch.stack(losses).mean())
+            self._maybe_snapshot(epoch + 1)
+        return torch.stack(history).tolist() if history else []
+
+    def predict(self, x_test=None) -> torch.Tensor:
+        """
+        Predict with the current model.
+        Args:
+            x_test: Test data (the dev data when None)
+        Returns:
+            torch.Tensor: Predicted results on the device (N, 1)
+        """
+        x_test = self.x_dev if x_test is None else to_device_tensors(x_test, self.device)
+        self.model.eval()
+        preds = []
+        with torch.no_grad():
+            for start in range(0, x_test[0].shape[0], self.pred_batch_size):
+                preds.append(self.model(*[x_input[start:start + self.pred_batch_size] for x_input in x_test]))
+        return torch.cat(preds).view(-1, 1)
+
+
+class BatchedInnerTrainer(object):
+    """
+    Train K independent copies of a predictor at once with stacked weights.
+    Each copy sees the same minibatches but its own sample weights, so one
+    vectorized forward/backward pass replaces K sequential fit_func calls.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        init_state: dict,
+        x_train: torch.Tensor,
+        y_train: torch.Tensor,
+        batch_size: int,
+        epochs: int,
+        device: torch.device,
+        lr: float = 0.001
+    ) -> None:
+        """
+        Args:
+            model: Predictor architecture (weights are taken from init_state)
+            init_state: state_dict every copy starts from
+            x_train: Training data
+            y_train: Training labels
+            batch_size: Batch size
+            epochs: Number of epochs
+            device: Device to run the model
+            lr: Learning rate of Adam
+        """
+        self.base_model = copy.deepcopy(model).to('meta')
+        self.init_state = init_state
+        self.x_train = torch.as_tensor(x_train, dtype=torch.float).to(device)
+        self.y_train = torch.as_tensor(y_train, dtype=torch.float).to(device).view(-1)
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.device = device
+        self.lr = lr
+
+    def _forward(self, params: dict, x: torch.Tensor) -> torch.Tensor:
+        def call(p, x_input):
+            return functional_call(self.base_model, p, (x_input,))
+        return vmap(call, in_dims=(0, None))(params, x)
+
+    def fit(self, sample_weights: torch.Tensor) -> dict:
+        """
+        Train one copy of the predictor per row of sample_weights.
+        Args:
+            sample_weights: Sample weight for each copy and data (K, N)
+        Returns:
+            dict: Stacked parameters of the trained copies
+        """
+        self.start(sample_weights)
+        self.advance(self.epochs)
+        return self.current_params()
+
+    def start(self, sample_weights: torch.Tensor) -> None:
+        """
+        Initialize one copy of the predictor (and its Adam state) per row of
+        sample_weights, to be trained in stages with advance.
+        Args:
+            sample_weights: Sample weight for each copy and data (K, N)
+        """
+        self.sample_weights = torch.as_tensor(sample_weights, dtype=torch.float).to(self.device)
+        num_models = self.sample_weights.shape[0]
+        self.params = {
+            name: value.detach().to(self.device).unsqueeze(0).repeat(num_models, *([1] * value.dim())).requires_grad_()
+            for name, value in self.init_state.items()
+        }
+        self.optimizer = optim.Adam(list(self.params.values()), lr=self.lr)
+
+    def advance(self, epochs: int) -> None:
+        """
+        Continue training the current copies.
+        Args:
+            epochs: Number of epochs
+        """
+        params, optimizer, sample_weights = self.params, self.optimizer, self.sample_weights
+        num_samples = self.x_train.shape[0]
+        for _ in range(epochs):
+            perm = torch.randperm(num_samples, device=self.device)
+            for start in range(0, num_samples, self.batch_size):
+                idx = perm[start:start + self.batch_size]
+                optimizer.zero_grad()
+                y_pred = self._forward(params, self.x_train[idx]).squeeze(-1)
+                loss = (y_pred - self.y_train[idx].unsqueeze(0)) ** 2 * sample_weights[:, idx]
+                # summing the per-copy means keeps the copies' gradients independent
+                loss = loss.mean(dim=1).sum()
+                loss.backward()
+                optimizer.step()
+
+    def keep(self, indices) -> None:
+        """
+        Keep only the given copies (with their Adam state) for further training.
+        Args:
+            indices: Indices of the copies to keep
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long).to(self.device)
+        params = {name: value.detach()[indices].clone().requires_grad_() for name, value in self.params.items()}
+        optimizer = optim.Adam(list(params.values()), lr=self.lr)
+        for old, new in zip(self.params.values(), params.values()):
+            state = self.optimizer.state.get(old)
+            if state:
+                optimizer.state[new] = {
+                    key: value[indices].clone() if torch.is_tensor(value) and value.dim() > 0 else copy.deepcopy(value)
+                    for key, value in state.items()
+                }
+        self.params, self.optimizer = params, optimizer
+        self.sample_weights = self.sample_weights[indices]
+
+    def current_params(self) -> dict:
+        return {name: value.detach() for name, value in self.params.items()}
+
+    def predict(self, params: dict, x_test: torch.Tensor) -> torch.Tensor:
+        """
+        Predict with every trained copy.
+        Args:
+            params: Stacked parameters returned by fit
+            x_test: Test data
+        Returns:
+            torch.Tensor: Predicted results (K, N, 1)
+        """
+        x_test = torch.as_tensor(x_test, dtype=torch.float).to(self.device)
+        preds = []
+        with torch.no_grad():
+            for start in range(0, x_test.shape[0], self.batch_size):
+                preds.append(self._forward(params, x_test[start:start + self.batch_size]))
+        return torch.cat(preds, dim=1)
@@ -0,0 +1,172 @@
+"""Buffered metrics logging to local files with wandb as an optional backend."""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import numpy as np
+import torch
+
+
+class MetricsSink(object):
+    """
+    Buffer metric records in memory and write them from a background thread
+    to a local JSONL or SQLite file (chosen by the file extension), and
+    optionally to the active wandb run. log() only enqueues the record, so
+    tensors are converted (and the device synchronized) off the training
+    thread, and nothing on the hot path needs network access.
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        path: str = None,
+        use_wandb: bool = False,
+        echo: bool = False,
+        flush_interval: float = 1.0,
+        max_buffer: int = 100000
+    ) -> None:
+        """
+        Args:
+            path: Output file (.jsonl or .db/.sqlite), None for no local file
+            use_wandb: Also send the records to the wandb run initialized by the caller
+            echo: Print each record
+            flush_interval: Seconds between background writes
+            max_buffer: Maximum number of buffered records (log blocks when full)
+        """
+        self.path = path
+        self.use_wandb = use_wandb
+        self.echo = echo
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_buffer)
+        # set when the local file cannot be opened (the records still go to echo and wandb)
+        self.failed = False
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, record: dict, step: int = None) -> None:
+        """
+        Buffer one record.
+        Args:
+            record: Metric name to value (python/numpy scalars or 0-dim tensors)
+            step: Step of the record
+        """
+        self.queue.put((time.time(), step, record))
+
+    def flush(self) -> None:
+        """Block until every buffered record has been handled (returns if the background thread has stopped)."""
+        if self.thread.is_alive():
+            self.queue.join()
+
+    def close(self) -> None:
+        """Write the remaining records and stop the background thread."""
+        if self.thread.is_alive():
+            self.queue.put(self._CLOSE)
+            self.thread.join()
+
+    def __enter__(self) -> 'MetricsSink':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _to_python(value):
+        if torch.is_tensor(value):
+            return value.item()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def _run(self) -> None:
+        try:
+            writer = self._open_writer()
+        except Exception as e:
+            # keep consuming the queue without the file, so flush() and close() still return
+            print(f'MetricsSink: cannot open {self.path} ({e}), records are not saved locally')
+            self.failed = True
+            writer = None
+        closing = False
+        while not closing:
+            try:
+                items = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                records = []
+                for item in items:
+                    if item is self._CLOSE:
+                        closing = True
+                        continue
+                    timestamp, step, record = item
+                    try:
+                        records.append((timestamp, step, {key: self._to_python(value) for key, value in record.items()}))
+                    except Exception as e:
+                        # a bad value (e.g. a multi-element tensor) only drops its own record
+                        print(f'MetricsSink: dropped a record at step {step} ({e})')
+                self._write(writer, records)
+            except Exception as e:
+                # a failing backend must not stop the training run
+                print(f'MetricsSink: failed to write {len(items)} records ({e})')
+            finally:
+                # always acknowledge the items, so flush() and close() cannot hang
+                for _ in items:
+                    self.queue.task_done()
+
+        if writer is not None:
+            writer.close()
+
+    def _open_writer(self):
+        if self.path is None:
+            return None
+        if self.path.endswith(('.db', '.sqlite')):
+            # sqlite connections are bound to the thread that creates them
+            connection = sqlite3.connect(self.path)
+            connection.execute('CREATE TABLE IF NOT EXISTS metrics (time REAL, step INTEGER, key TEXT, value REAL)')
+            return connection
+        return open(self.path, 'a')
+
+    def _write(self, writer, records: list) -> None:
+        if not records:
+            return
+        # the backends are guarded separately, so a failing one does not drop the records of the others
+        try:
+            if isinstance(writer, sqlite3.Connection):
+                writer.executemany(
+                    'INSERT INTO metrics VALUES (?, ?, ?, ?)',
+                    [(timestamp, step, key, value) for timestamp, step, record in records for key, value in record.items()]
+                )
+                writer.commit()
+            elif writer is not None:
+                for timestamp, step, record in records:
+                    writer.write(json.dumps({'time': timestamp, 'step': step, **record}) + '\n')
+                writer.flush()
+        except Exception as e:
+            print(f'MetricsSink: failed to write {len(records)} records to {self.path} ({e})')
+
+        if self.use_wandb:
+            try:
+                import wandb
+                for _, step, record in records:
+                    # keep wandb's step counter on the iteration
+                    if step is None:
+                        wandb.log(record)
+                    else:
+                        wandb.log(record, step=step)
+            except Exception as e:
+                print(f'MetricsSink: failed to send {len(records)} records to wandb ({e})')
+        if self.echo:
+            for _, step, record in records:
+                prefix = f'Iteration: {step}, ' if step is not None else ''
+                print(prefix + ', '.join(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}' for key, value in record.items()))
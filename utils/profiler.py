@@ -0,0 +1,132 @@
+"""Per-stage wall-time instrumentation for the DVRL training loop."""
+
+import collections
+import contextlib
+import csv
+import json
+import os
+import time
+import torch
+
+
+class _Stage(object):
+    """Context manager timing one call of a stage."""
+
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer: 'StageTimer', name: str) -> None:
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self) -> None:
+        if self.timer.sync_cuda:
+            torch.cuda.synchronize()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        if self.timer.sync_cuda:
+            torch.cuda.synchronize()
+        self.timer._record(self.name, time.perf_counter() - self.start)
+
+
+class StageTimer(object):
+    """
+    Record the wall time and call count of named stages per iteration.
+    The last `capacity` iterations are kept in a ring buffer, totals cover
+    the whole run. When disabled, stage() returns a shared no-op context,
+    so the instrumented loop does no timing work at all.
+    """
+
+    def __init__(self, enabled: bool = True, capacity: int = 1000, sync_cuda: bool = False) -> None:
+        """
+        Args:
+            enabled: Record timings (no-op when False)
+            capacity: Number of iterations kept in the ring buffer
+            sync_cuda: Synchronize cuda around each stage so GPU work is attributed to its stage
+        """
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.iterations = collections.deque(maxlen=capacity)
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.num_iterations = 0
+        self._current = {}
+        self._null = contextlib.nullcontext()
+
+    def stage(self, name: str):
+        """
+        Time the enclosed block as one call of the stage.
+        Args:
+            name: Stage name
+        Returns:
+            Context manager
+        """
+        if not self.enabled:
+            return self._null
+        return _Stage(self, name)
+
+    def _record(self, name: str, seconds: float) -> None:
+        elapsed, calls = self._current.get(name, (0.0, 0))
+        self._current[name] = (elapsed + seconds, calls + 1)
+        self.totals[name] += seconds
+        self.counts[name] += 1
+
+    def step(self) -> None:
+        """Close the current iteration and push it to the ring buffer."""
+        if not self.enabled:
+            return
+        self.iterations.append((self.num_iterations, self._current))
+        self.num_iterations += 1
+        self._current = {}
+
+    def summary(self) -> dict:
+        """
+        Summarize the whole run.
+        Returns:
+            dict: calls, total/mean seconds and share of the timed total per stage
+        """
+        total = sum(self.totals.values())
+        return {
+            name: {
+                'calls': self.counts[name],
+                'total_s': seconds,
+                'mean_s': seconds / self.counts[name],
+                'share': seconds / total if total > 0 else 0.0
+            }
+            for name, seconds in sorted(self.totals.items(), key=lambda item: -item[1])
+        }
+
+    def report(self) -> str:
+        lines = [f'{"stage":<12}{"calls":>8}{"total[s]":>12}{"mean[ms]":>12}{"share":>8}']
+        for name, stats in self.summary().items():
+            lines.append(f'{name:<12}{stats["calls"]:>8}{stats["total_s"]:>12.3f}{stats["mean_s"] * 1000:>12.3f}{stats["share"]:>8.1%}')
+        return '\n'.join(lines)
+
+    def dump(self, path: str) -> None:
+        """
+        Write the summary and the buffered iterations to JSON, or the
+        buffered iterations to CSV (one row per iteration and stage),
+        depending on the file extension.
+        Args:
+            path: Output path (.json or .csv)
+        """
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['iteration', 'stage', 'seconds', 'calls'])
+                for iteration, stages in self.iterations:
+                    for name, (seconds, calls) in stages.items():
+                        writer.writerow([iteration, name, seconds, calls])
+        else:
+            with open(path, 'w') as f:
+                json.dump({
+                    'num_iterations': self.num_iterations,
+                    'summary': self.summary(),
+                    'iterations': [
+                        {'iteration': iteration, 'stages': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in stages.items()}}
+                        for iteration, stages in self.iterations
+                    ]
+                }, f, indent=2)